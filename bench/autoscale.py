@@ -0,0 +1,161 @@
+# 自动伸缩测试：按给定的数据间隔变化向运行中的Dispatcher发送合成数据，记录worker数随负载的变化，输出JSON格式的结果
+# 用法: python -m bench.autoscale --instances 5000 --phases 20:1.0 60:0.1 60:1.0 --min-workers 1 --max-workers 8
+# 每个阶段为"tick数:数据间隔（秒）"，数据间隔越短，worker处理数据的时间占比越高
+
+import argparse
+import json
+import logging
+import os
+import platform
+import queue
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Manager
+
+from bench.pipeline import START_TIMESTAMP
+from bench.synthetic import synthetic_zones
+from netio.io_handler import IOHandler
+from netio.local_agent import LocalMessageAgent
+from util import tracing
+from util.clock import SimulatedClock
+from util.dispatcher import Dispatcher
+from util.metrics import SharedMetrics
+
+
+def parse_phase(text: str) -> tuple:
+    ticks, interval = text.split(':')
+    return int(ticks), float(interval)
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+
+def run(instances: int, phases: list, num_workers: int, min_workers: int, max_workers: int,
+        scale_interval: float, zones: list, seed: int) -> dict:
+    """
+    Dispatcher和各个worker与实际运行时一样在后台运行，本进程按各阶段的数据间隔发送数据，每个tick记录一次状态
+    """
+
+    data_queue = Manager().Queue()
+    anom_queue = Manager().Queue()
+    metrics = SharedMetrics(max_workers)
+    clock = SimulatedClock(START_TIMESTAMP)
+    io_handler = IOHandler(
+        interval=phases[0][1],
+        num_workers=num_workers,
+        data_queue=data_queue,
+        anom_queue=anom_queue,
+        cmd_queue=Manager().Queue(),
+        res_queue=Manager().Queue(),
+        agent=LocalMessageAgent(None),
+        metrics=metrics
+    )
+    dispatcher = Dispatcher(
+        k=5,
+        data_queue=data_queue,
+        anom_queue=anom_queue,
+        cmd_queue=Manager().Queue(),
+        res_queue=Manager().Queue(),
+        num_workers=num_workers,
+        min_workers=min_workers,
+        max_workers=max_workers,
+        scale_interval=scale_interval,
+        clock=clock,
+        metrics=metrics,
+        heartbeat_timeout=None  # 测试结束时直接结束worker进程，不需要重启
+    )
+    ThreadPoolExecutor(max_workers=1).submit(dispatcher.run)
+
+    synthetic = synthetic_zones(instances, zones, seed=seed)
+    samples = []
+    timestamp = START_TIMESTAMP
+    t_start = tracing.now()
+    for phase, (ticks, interval) in enumerate(phases):
+        for _ in range(ticks):
+            t0 = tracing.now()
+            timestamp += interval
+            clock.set(timestamp)
+            for zone in synthetic:
+                io_handler._process_message(zone.step())
+            _drain(anom_queue)
+
+            active = dispatcher._active
+            slots = [dispatcher._worker_slots[idx] for idx in active]
+            samples.append({
+                'time': t0 - t_start,
+                'phase': phase,
+                'interval': interval,
+                'workers': len(active),
+                'utilization': dispatcher._autoscaler.utilization if dispatcher._autoscaler else None,
+                'migrations': dispatcher._migration,
+                'queue_depth': data_queue.qsize(),
+                'max_lag': max(dispatcher._sent[idx] - slot.get('ticks') for idx, slot in zip(active, slots)),
+            })
+            time.sleep(max(interval - (tracing.now() - t0), 0))
+
+    # 等待积压的数据处理完，检查每个实例恰好由一个worker持有
+    deadline = tracing.now() + 30
+    while tracing.now() < deadline and (data_queue.qsize() > 0 or any(
+            dispatcher._sent[idx] > dispatcher._worker_slots[idx].get('ticks') for idx in dispatcher._active)):
+        time.sleep(0.5)
+    held = sum(dispatcher._worker_slots[idx].get('live_instances') for idx in dispatcher._active)
+
+    for process in dispatcher._processes:
+        if process is not None:
+            process.kill()
+
+    return {
+        'instances': sum(_.instance_count() for _ in synthetic),
+        'phases': [{'ticks': ticks, 'interval': interval} for ticks, interval in phases],
+        'workers': {
+            'start': num_workers,
+            'min': min_workers,
+            'max': max_workers,
+            # 每个阶段结束时的worker数
+            'phase_end': [[_ for _ in samples if _['phase'] == i][-1]['workers'] for i in range(len(phases))],
+        },
+        'migrations': dispatcher._migration,
+        'mapped_instances': len(dispatcher._instances_mapping),
+        'held_instances': int(held),
+        'samples': samples,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=5000)
+    parser.add_argument('--phases', type=parse_phase, nargs='+', default=[(20, 1.0), (60, 0.1), (60, 1.0)],
+                        help='各阶段的"tick数:数据间隔（秒）"')
+    parser.add_argument('--workers', type=int, default=None, help='启动时的worker数，默认为min-workers')
+    parser.add_argument('--min-workers', type=int, default=1)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--scale-interval', type=float, default=5)
+    parser.add_argument('--zones', type=str, nargs='+', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='结果的JSON文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run(args.instances, args.phases, args.workers or args.min_workers, args.min_workers, args.max_workers,
+                 args.scale_interval, args.zones, args.seed)
+    print(f'{result["instances"]} 实例: 各阶段结束时的worker数 {result["workers"]["phase_end"]}  '
+          f'迁移{result["migrations"]}次  worker持有的实例数 {result["held_instances"]}/{result["mapped_instances"]}',
+          file=sys.stderr)
+
+    output = {
+        'benchmark': 'autoscale',
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        **result,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
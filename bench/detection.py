@@ -0,0 +1,147 @@
+# 检测延迟基准测试：向合成或回放的数据中注入带标签的故障（CPU阶跃、内存爬升、SYN洪泛、链路故障），
+# 统计从注入到报障结果到达regulator所经过的tick数和时间，以及误报率
+# 用法: python -m bench.detection --instances 10000 --ticks 60 --inject-at 20 --k 3 5 --normal-window 5 10
+#       python -m bench.detection --capture capture --inject-at 20
+
+import argparse
+import itertools
+import json
+import logging
+import time
+
+from sam.base.messageAgentAuxillary.msgAgentRPCConf import REGULATOR_IP, REGULATOR_PORT
+
+from bench.faults import FAULT_KINDS, FaultInjector
+from bench.pipeline import Pipeline
+from bench.synthetic import synthetic_zones
+from netio import protocol
+from netio.capture import CaptureReader
+from netio.local_agent import LocalBody, LocalMessage, LocalMessageAgent
+
+
+class RegulatorStandIn(LocalMessageAgent):
+    def __init__(self):
+        """
+        代替regulator，记录收到的每个报障结果及收到的时间
+        """
+
+        super().__init__(None)
+        self.reports = []   # (收到的时间, 报障结果)
+
+    def sendMsgByRPC(self, ip, port, msg, maxRetryNum=0):
+        super().sendMsgByRPC(ip, port, msg, maxRetryNum)
+        if (ip, port) == (REGULATOR_IP, REGULATOR_PORT):
+            self.reports.append((time.perf_counter(), msg.getbody().attributes))
+
+
+def synthetic_stream(instances: int, zones: list, seed: int):
+    synthetic = synthetic_zones(instances, zones, seed=seed)
+    while True:
+        yield [_.step() for _ in synthetic]
+
+
+def replay_stream(capture_dir: str):
+    # 回放的数据中每条消息为一个tick，时间戳由Pipeline的时钟给出
+    for _, msg_type, data in CaptureReader(capture_dir):
+        yield [LocalMessage(msg_type, LocalBody(data))]
+
+
+def monitored(data: dict) -> int:
+    return sum(
+        len(entries)
+        for instance_type in (protocol.INSTANCE_TYPE_SWITCH, protocol.INSTANCE_TYPE_SERVER, protocol.INSTANCE_TYPE_LINK)
+        for entries in data.get(instance_type, {}).values()
+    )
+
+
+def run(
+        stream, ticks: int, faults: list, setting: dict,
+        interval: float, num_workers: int, inline: bool, seed: int
+) -> dict:
+    regulator = RegulatorStandIn()
+    injector = FaultInjector(faults, seed=seed)
+    pipeline = Pipeline(num_workers=num_workers, inline=inline, interval=interval, agent=regulator, **setting)
+    instance_ticks = 0
+    try:
+        for tick, messages in zip(range(1, ticks + 1), stream):
+            now = time.perf_counter()
+            for msg in messages:
+                data = msg.getbody().attributes
+                injector.inject(data, tick, now)
+                instance_ticks += monitored(data)
+            received = len(regulator.reports)
+            pipeline.step(messages)
+            for received_at, report in regulator.reports[received:]:
+                injector.observe(report, tick, received_at)
+    finally:
+        pipeline.close()
+
+    results = injector.results()
+    for r in results:
+        # 按数据的采样间隔换算的检测延迟
+        for _ in ('first', 'all'):
+            ticks_ = r[f'{_}_ticks']
+            r[f'{_}_data_seconds'] = None if ticks_ is None else ticks_ * interval
+    return {
+        'setting': setting,
+        'ticks': ticks,
+        'faults': results,
+        'false_positives': {
+            'alerts': injector.false_alerts,
+            'instances': len(injector.false_instances),
+            'rate': injector.false_alerts / instance_ticks if instance_ticks else 0.0,    # 每个实例每个tick的误报数
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=10000, help='合成拓扑的实例总数')
+    parser.add_argument('--zones', type=str, nargs='+', default=None)
+    parser.add_argument('--capture', type=str, default=None, help='回放的数据目录，指定时不使用合成数据')
+    parser.add_argument('--ticks', type=int, default=60)
+    parser.add_argument('--interval', type=float, default=3.0, help='数据的采样间隔（秒）')
+    parser.add_argument('--inject-at', type=int, default=20, help='开始注入故障的tick')
+    parser.add_argument('--faults', type=str, nargs='+', default=list(FAULT_KINDS.keys()), choices=FAULT_KINDS.keys())
+    parser.add_argument('--targets', type=int, default=3, help='每种故障注入的实例数')
+    parser.add_argument('--k', type=float, nargs='+', default=[5])
+    parser.add_argument('--normal-window', type=int, nargs='+', default=[5])
+    parser.add_argument('--abnormal-window', type=int, nargs='+', default=[2])
+    parser.add_argument('--cooldown', type=int, nargs='+', default=[30])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', action='store_true', help='每个worker运行在单独的进程中')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='结果的JSON文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    results = []
+    for k, normal, abnormal, cooldown in itertools.product(
+            args.k, args.normal_window, args.abnormal_window, args.cooldown):
+        setting = {
+            'k': k,
+            'normal_window_length': normal,
+            'abnormal_window_length': abnormal,
+            'cooldown': cooldown,
+        }
+        # 每组参数使用相同的数据和故障
+        stream = replay_stream(args.capture) if args.capture is not None \
+            else synthetic_stream(args.instances, args.zones, args.seed)
+        faults = [FAULT_KINDS[kind](args.inject_at, args.targets) for kind in args.faults]
+        results.append(run(
+            stream, args.ticks, faults, setting,
+            args.interval, args.workers, not args.processes, args.seed
+        ))
+
+    output = {
+        'benchmark': 'detection',
+        'source': args.capture or 'synthetic',
+        'inject_at': args.inject_at,
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
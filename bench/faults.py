@@ -0,0 +1,247 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from netio import protocol
+
+
+# 以下为注入故障后的实例，其余属性和方法直接使用原对象的
+
+class _Wrapper:
+    __slots__ = ('_obj',)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._obj, name)
+
+
+class FaultyServer(_Wrapper):
+    __slots__ = ('_cpu_delta', '_mem_delta')
+
+    def __init__(self, obj, cpu_delta: float=0, mem_delta: float=0):
+        super().__init__(obj)
+        self._cpu_delta = cpu_delta
+        self._mem_delta = mem_delta
+
+    def getCpuUtil(self):
+        return [min(100.0, _ + self._cpu_delta) for _ in self._obj.getCpuUtil()]
+
+    def getDRAMUsagePercentage(self):
+        return min(100.0, self._obj.getDRAMUsagePercentage() + self._mem_delta)
+
+
+class FaultyLink(_Wrapper):
+    __slots__ = ('_syn_ratio', '_utilization')
+
+    def __init__(self, obj, syn_ratio: float, utilization: float):
+        super().__init__(obj)
+        self._syn_ratio = syn_ratio
+        self._utilization = utilization
+
+    @property
+    def SYN_num(self):
+        # 保持其他包的数量不变，使SYN包占syn_ratio的比例
+        others = self._obj.NSH_num + self._obj.DNS_num
+        return int(others * self._syn_ratio / (1 - self._syn_ratio))
+
+    @property
+    def utilization(self):
+        return max(self._obj.utilization, self._utilization)
+
+
+class Fault(ABC):
+    KIND = None
+    INSTANCE_TYPE = None
+    ANOMALY_TYPE = protocol.ATTR_ABNORMAL
+
+    def __init__(self, start: int, count: int=1):
+        """
+        在第start个tick开始注入到count个实例上的故障，实例在开始注入时从数据中随机选择
+        """
+
+        self.start = start
+        self.count = count
+        self.zone = None
+        self.ids = []
+
+    def choose(self, data: dict, rng: np.random.Generator, exclude: set):
+        for zone, entries in data.get(self.INSTANCE_TYPE, {}).items():
+            candidates = [_ for _ in entries.keys() if (zone, _) not in exclude]
+            if len(candidates) >= self.count:
+                self.zone = zone
+                self.ids = [candidates[i] for i in rng.choice(len(candidates), self.count, replace=False).tolist()]
+                return
+
+    def inject(self, data: dict, tick: int):
+        """
+        修改一条消息的数据，只替换被注入故障的实例，不修改原有的dict
+        """
+
+        entries = data.get(self.INSTANCE_TYPE, {}).get(self.zone)
+        if tick < self.start or entries is None:
+            return
+        entries = dict(entries)
+        for idx in self.ids:
+            if idx in entries:
+                entries[idx] = self._modify(dict(entries[idx]), tick - self.start)
+        data[self.INSTANCE_TYPE] = dict(data[self.INSTANCE_TYPE])
+        data[self.INSTANCE_TYPE][self.zone] = entries
+
+    @abstractmethod
+    def _modify(self, entry: dict, elapsed: int) -> dict:
+        pass
+
+    def expected(self) -> dict:
+        """
+        应当报告的实例: {(zone, ATTR_XXX_ID_LIST): {id: 对应的故障实例ID}}
+        """
+
+        return {(self.zone, protocol.ATTR_SERVER_ID_LIST): {_: _ for _ in self.ids}}
+
+    def label(self) -> dict:
+        return {
+            'kind': self.KIND,
+            'zone': self.zone,
+            'instance_type': self.INSTANCE_TYPE,
+            'ids': [list(_) if isinstance(_, tuple) else _ for _ in self.ids],
+            'start_tick': self.start,
+        }
+
+
+class CpuStep(Fault):
+    KIND = 'cpu_step'
+    INSTANCE_TYPE = protocol.INSTANCE_TYPE_SERVER
+
+    def __init__(self, start: int, count: int=1, delta: float=40):
+        super().__init__(start, count)
+        self.delta = delta
+
+    def _modify(self, entry: dict, elapsed: int) -> dict:
+        entry[protocol.ATTR_SERVER] = FaultyServer(entry[protocol.ATTR_SERVER], cpu_delta=self.delta)
+        return entry
+
+
+class MemoryRamp(Fault):
+    KIND = 'memory_ramp'
+    INSTANCE_TYPE = protocol.INSTANCE_TYPE_SERVER
+
+    def __init__(self, start: int, count: int=1, rate: float=2):
+        super().__init__(start, count)
+        self.rate = rate    # 每个tick增加的内存使用率
+
+    def _modify(self, entry: dict, elapsed: int) -> dict:
+        entry[protocol.ATTR_SERVER] = FaultyServer(entry[protocol.ATTR_SERVER], mem_delta=self.rate * (elapsed + 1))
+        return entry
+
+
+class _LinkFault(Fault):
+    INSTANCE_TYPE = protocol.INSTANCE_TYPE_LINK
+
+    def expected(self) -> dict:
+        # 同一交换机发出的大部分链路异常时，告警被合并为该交换机的告警
+        result = {(self.zone, protocol.ATTR_LINK_ID_LIST): {_: _ for _ in self.ids}}
+        if self.ANOMALY_TYPE == protocol.ATTR_ABNORMAL:
+            result[(self.zone, protocol.ATTR_SWITCH_ID_LIST)] = {_[0]: _ for _ in self.ids}
+        return result
+
+
+class SynFlood(_LinkFault):
+    KIND = 'syn_flood'
+
+    def __init__(self, start: int, count: int=1, ratio: float=0.9, utilization: float=0.8):
+        super().__init__(start, count)
+        self.ratio = ratio
+        self.utilization = utilization
+
+    def _modify(self, entry: dict, elapsed: int) -> dict:
+        entry[protocol.ATTR_LINK] = FaultyLink(entry[protocol.ATTR_LINK], self.ratio, self.utilization)
+        return entry
+
+
+class LinkFailure(_LinkFault):
+    KIND = 'link_failure'
+    ANOMALY_TYPE = protocol.ATTR_FAILURE
+
+    def _modify(self, entry: dict, elapsed: int) -> dict:
+        entry[protocol.ATTR_ACTIVE] = False
+        return entry
+
+
+FAULT_KINDS = {_.KIND: _ for _ in (CpuStep, MemoryRamp, SynFlood, LinkFailure)}
+
+
+class FaultInjector:
+    def __init__(self, faults: list, seed: int=0):
+        """
+        向数据流中注入带标签的故障，并根据发给regulator的报障结果判断每个故障何时被检测到。
+        报障结果中不属于任何已注入故障的实例计为误报。
+        """
+
+        self._faults = faults
+        self._rng = np.random.default_rng(seed)
+        self._chosen = set()
+        self.injected_at = [None] * len(faults)     # 每个故障开始注入的时间
+        self.detected = [{} for _ in faults]        # 每个故障: {故障实例ID: (第一次被报告的tick, 时间)}
+        self.false_alerts = 0
+        self.false_instances = set()
+
+    def inject(self, data: dict, tick: int, now: float):
+        for i, fault in enumerate(self._faults):
+            if tick >= fault.start and not fault.ids:
+                fault.choose(data, self._rng, self._chosen)
+                self._chosen.update((fault.zone, _) for _ in fault.ids)
+            if fault.ids:
+                fault.inject(data, tick)
+                if self.injected_at[i] is None:
+                    self.injected_at[i] = now
+
+    def observe(self, report: dict, tick: int, now: float):
+        """
+        report: anomaly_report.get_anomaly_report_list()的结果，now为regulator收到该结果的时间
+        """
+
+        report = report[protocol.ATTR_ALL_ZONE_DETECTION_DICT]
+        labelled = {}
+        for i, fault in enumerate(self._faults):
+            if not fault.ids or tick < fault.start:
+                continue
+            for (zone, id_list_key), ids in fault.expected().items():
+                labelled.setdefault((zone, fault.ANOMALY_TYPE, id_list_key), {}).update(
+                    {reported: (i, target) for reported, target in ids.items()}
+                )
+
+        for zone, zone_report in report.items():
+            for anomaly_type, anomaly_desc in zone_report.items():
+                for id_list_key in (
+                        protocol.ATTR_SWITCH_ID_LIST, protocol.ATTR_SERVER_ID_LIST, protocol.ATTR_LINK_ID_LIST):
+                    expected = labelled.get((zone, anomaly_type, id_list_key), {})
+                    for idx in anomaly_desc.get(id_list_key, []):
+                        idx = tuple(idx) if isinstance(idx, list) else idx
+                        if idx in expected:
+                            i, target = expected[idx]
+                            self.detected[i].setdefault(target, (tick, now))
+                        else:
+                            self.false_alerts += 1
+                            self.false_instances.add((zone, id_list_key, idx))
+
+    def results(self) -> list:
+        result = []
+        for fault, injected_at, detected in zip(self._faults, self.injected_at, self.detected):
+            r = fault.label()
+            ticks = sorted(t - fault.start for t, _ in detected.values())
+            wall = sorted((now - injected_at) * 1000 for _, now in detected.values())
+            complete = len(detected) == len(fault.ids) and len(detected) > 0
+            # first: 第一个故障实例被报告；all: 所有故障实例都被报告
+            r.update({
+                'detected': len(detected),
+                'first_ticks': ticks[0] if ticks else None,
+                'all_ticks': ticks[-1] if complete else None,
+                'first_wall_ms': wall[0] if wall else None,
+                'all_wall_ms': wall[-1] if complete else None,
+            })
+            result.append(r)
+        return result
@@ -0,0 +1,231 @@
+# 模型和worker热点路径的微基准测试，结果保存为JSON基线，compare比较两次结果并在变慢超过阈值时返回非0
+# 基线与机器有关，不保存在仓库中，需要在同一台机器上先对修改前的代码生成
+# 用法: python -m bench.micro run --output baseline.json
+#       python -m bench.micro run --output current.json --compare baseline.json --threshold 0.15
+#       python -m bench.micro compare baseline.json current.json --threshold 0.15
+
+import argparse
+import json
+import os
+import platform
+import queue
+import statistics
+import sys
+import timeit
+
+import numpy as np
+
+from sam.base import messageAgent as ma
+
+from bench.synthetic import SyntheticZone
+from model import TimeSeries
+from model.time_series import StatList
+from netio import protocol
+from util import anomaly_report
+from util.dispatcher import Dispatcher
+
+WINDOW_SIZES = [5, 10, 30, 100]
+BATCH_SIZES = [100, 1000, 10000]
+REPORT_SIZES = [10, 100, 1000]
+VALUES = np.random.default_rng(0).uniform(0, 100, 1024).tolist()
+
+_dispatcher = None
+
+
+def _get_dispatcher() -> Dispatcher:
+    # 各个用例共用一个Dispatcher（创建时会启动Manager进程）
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = Dispatcher(
+            k=5,
+            data_queue=queue.Queue(),
+            anom_queue=queue.Queue(),
+            cmd_queue=queue.Queue(),
+            res_queue=queue.Queue(),
+            num_workers=4,
+            instance_ttl=None
+        )
+    return _dispatcher
+
+
+def _zone_data(batch: int) -> dict:
+    zone = SyntheticZone(ma.TURBONET_ZONE, {
+        protocol.INSTANCE_TYPE_SWITCH: max(2, batch // 20),
+        protocol.INSTANCE_TYPE_SERVER: batch // 2,
+        protocol.INSTANCE_TYPE_LINK: batch - batch // 2,
+    })
+    return zone.step().getbody().attributes
+
+
+# 以下每个函数构造一个用例，返回(每次调用执行的函数, 每次调用包含的操作数)
+
+def statlist_add(window: int):
+    stat = StatList(window)
+
+    def run():
+        for v in VALUES:
+            stat.add(v)
+    return run, len(VALUES)
+
+
+def timeseries_add(window: int):
+    ts = TimeSeries(k=5, normal_window_length=window, abnormal_window_length=2)
+
+    def run():
+        for v in VALUES:
+            ts.add(v)
+    return run, len(VALUES)
+
+
+def timeseries_is_abnormal(window: int):
+    ts = TimeSeries(k=5, normal_window_length=window, abnormal_window_length=2)
+    for v in VALUES[:window + 2]:
+        ts.add(v)
+
+    def run():
+        for _ in range(len(VALUES)):
+            ts.is_abnormal()
+    return run, len(VALUES)
+
+
+def worker_process_batch(batch: int):
+    dispatcher = _get_dispatcher()
+    worker = dispatcher._workers[0]
+    elements = [e for _ in dispatcher._split(_zone_data(batch)) for e in _[protocol.ATTR_VALUE]]
+    timestamp = [0]
+
+    def run():
+        timestamp[0] += 3
+        worker._process_batch({protocol.ATTR_TIMESTAMP: timestamp[0], protocol.ATTR_VALUE: elements})
+    # 先填满检测窗口，只测量稳定状态下的处理时间
+    for _ in range(worker._normal_window_length + worker._abnormal_window_length + 1):
+        run()
+    return run, len(elements)
+
+
+def dispatcher_split(batch: int):
+    dispatcher = _get_dispatcher()
+    data = _zone_data(batch)
+    count = sum(len(_) for instance_dict in data.values() for _ in instance_dict.values())
+    dispatcher._split(data)
+
+    def run():
+        dispatcher._split(data)
+    return run, count
+
+
+def get_anomaly_report_list(ids: int):
+    report = anomaly_report.empty_anomaly_report_set()
+    for zone_report in report.values():
+        for anomaly_desc in zone_report.values():
+            anomaly_desc[protocol.ATTR_SERVER_ID_LIST].update(range(ids))
+            anomaly_desc[protocol.ATTR_LINK_ID_LIST].update((i, i + 1) for i in range(ids))
+
+    def run():
+        anomaly_report.get_anomaly_report_list(report)
+    return run, 1
+
+
+CASES = [
+    (statlist_add, 'window', WINDOW_SIZES),
+    (timeseries_add, 'window', WINDOW_SIZES),
+    (timeseries_is_abnormal, 'window', WINDOW_SIZES),
+    (worker_process_batch, 'batch', BATCH_SIZES),
+    (dispatcher_split, 'batch', BATCH_SIZES),
+    (get_anomaly_report_list, 'ids', REPORT_SIZES),
+]
+
+
+def measure(func, ops: int, repeat: int) -> dict:
+    """
+    自动确定每轮的调用次数（每轮至少0.2秒），重复repeat轮，返回每个操作的耗时（纳秒）
+    """
+
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number / ops * 1e9 for t in timer.repeat(repeat, number)]
+    return {
+        'ns_per_op': statistics.median(times),
+        'min_ns_per_op': min(times),
+        'ops': ops,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def run_cases(pattern: str=None, repeat: int=5) -> dict:
+    results = {}
+    for case, param, values in CASES:
+        for value in values:
+            name = f'{case.__name__}[{param}={value}]'
+            if pattern is not None and pattern not in name:
+                continue
+            func, ops = case(value)
+            results[name] = measure(func, ops, repeat)
+            print(f'{name:<45s} {results[name]["ns_per_op"]:>12.1f} ns/op', file=sys.stderr)
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    返回比基线变慢超过threshold比例的用例: [(用例, 基线耗时, 当前耗时, 变化比例)]
+    """
+
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f'{name:<45s} {"":>12s} {result["ns_per_op"]:>12.1f}  (无基线)')
+            continue
+        change = result['ns_per_op'] / base['ns_per_op'] - 1
+        flag = '  变慢' if change > threshold else ''
+        print(f'{name:<45s} {base["ns_per_op"]:>12.1f} {result["ns_per_op"]:>12.1f} {change:>+8.1%}{flag}')
+        if change > threshold:
+            regressions.append((name, base['ns_per_op'], result['ns_per_op'], change))
+    return regressions
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--filter', type=str, default=None, help='只运行名称包含该字符串的用例')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--output', type=str, default=None, help='结果的JSON文件，默认输出到标准输出')
+    run_parser.add_argument('--compare', type=str, default=None, help='与该基线比较')
+    run_parser.add_argument('--threshold', type=float, default=0.15, help='允许变慢的比例')
+
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('baseline', type=str)
+    compare_parser.add_argument('current', type=str)
+    compare_parser.add_argument('--threshold', type=float, default=0.15, help='允许变慢的比例')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        current = {
+            'benchmark': 'micro',
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': run_cases(args.filter, args.repeat),
+        }
+        if args.output is None:
+            print(json.dumps(current, indent=2))
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w') as f:
+                json.dump(current, f, indent=2)
+        baseline = load(args.compare) if args.compare is not None else None
+    else:
+        baseline, current = load(args.baseline), load(args.current)
+
+    if baseline is not None:
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f'{len(regressions)}个用例变慢超过{args.threshold:.0%}')
+            sys.exit(1)
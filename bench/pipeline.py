@@ -0,0 +1,146 @@
+import multiprocessing
+import queue
+import resource
+import time
+from multiprocessing import Manager
+
+from netio.io_handler import IOHandler
+from netio.local_agent import LocalMessageAgent
+from util.clock import SimulatedClock
+from util.dispatcher import Dispatcher
+
+START_TIMESTAMP = 1.6e9     # 合成数据的起始时间戳
+
+
+def peak_rss_mb() -> float:
+    # Linux下ru_maxrss的单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _serve(worker, conn):
+    """
+    在子进程中运行的worker：每收到一批数据处理完后，返回本进程的峰值内存
+    """
+
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        worker._process_batch(batch)
+        conn.send(peak_rss_mb())
+
+
+class Pipeline:
+    def __init__(
+            self,
+            num_workers: int=4,
+            inline: bool=False,
+            interval: float=3.0,
+            k: float=5,
+            agent: LocalMessageAgent=None,
+            **kwargs
+    ):
+        """
+        不经过网络，按tick同步驱动IOHandler -> Dispatcher -> Worker的完整流程，并记录每个阶段的耗时。
+        inline为False时每个worker运行在单独的进程中，数据经管道发送（与Manager队列一样需要序列化）；
+        为True时所有worker在当前进程中依次处理，便于用cProfile等工具分析。
+        数据的时间戳由SimulatedClock给出，每个tick前进interval秒。agent记录发给regulator的报障结果，kwargs传给Dispatcher。
+        """
+
+        self._inline = inline
+        self._interval = interval
+        self._data_queue = queue.Queue()
+        self._anom_queue = queue.Queue() if inline else Manager().Queue()
+        self._clock = SimulatedClock(START_TIMESTAMP)
+        self.tick = 0
+        self.agent = agent or LocalMessageAgent(None)   # 代替MessageAgent
+
+        self.io_handler = IOHandler(
+            interval=interval,
+            num_workers=num_workers,
+            data_queue=self._data_queue,
+            anom_queue=self._anom_queue,
+            cmd_queue=queue.Queue(),
+            res_queue=queue.Queue(),
+            send_reports=True,
+            agent=self.agent,
+            recv_interval=0
+        )
+        self.dispatcher = Dispatcher(
+            k=k,
+            data_queue=self._data_queue,
+            anom_queue=self._anom_queue,
+            cmd_queue=queue.Queue(),
+            res_queue=queue.Queue(),
+            num_workers=num_workers,
+            clock=self._clock,
+            **kwargs
+        )
+        self.workers = self.dispatcher._workers
+
+        self._conns = []
+        self._processes = []
+        self._worker_rss = [0.0] * num_workers
+        if not inline:
+            ctx = multiprocessing.get_context('fork')
+            for w in self.workers:
+                parent, child = ctx.Pipe()
+                p = ctx.Process(target=_serve, args=(w, child), daemon=True)
+                p.start()
+                self._conns.append(parent)
+                self._processes.append(p)
+
+    def step(self, messages: list) -> dict:
+        """
+        处理一个tick的数据消息（每个zone一条），返回各阶段的耗时（秒）和发出的告警数
+        """
+
+        self.tick += 1
+        self._clock.set(START_TIMESTAMP + self.tick * self._interval)
+        cost = {'recv': 0.0, 'dispatch': 0.0, 'detect': 0.0, 'report': 0.0}
+        alerts = 0
+        for msg in messages:
+            t0 = time.perf_counter()
+            self.io_handler._process_message(msg)
+            data = self._data_queue.get_nowait()
+            t1 = time.perf_counter()
+            batches = self.dispatcher._split(data)
+            t2 = time.perf_counter()
+            if self._inline:
+                for w, batch in zip(self.workers, batches):
+                    w._process_batch(batch)
+            else:
+                for conn, batch in zip(self._conns, batches):
+                    conn.send(batch)
+                for i, conn in enumerate(self._conns):
+                    self._worker_rss[i] = conn.recv()
+            t3 = time.perf_counter()
+            alerts += self.io_handler._flush_anomaly_reports()
+            t4 = time.perf_counter()
+
+            cost['recv'] += t1 - t0
+            cost['dispatch'] += t2 - t1
+            cost['detect'] += t3 - t2
+            cost['report'] += t4 - t3
+
+        cost['total'] = sum(cost.values())
+        cost['alerts'] = alerts
+        return cost
+
+    def peak_rss(self) -> dict:
+        """
+        各进程的峰值内存（MB）
+        """
+
+        main = peak_rss_mb()
+        return {
+            'main': main,
+            'workers_max': max(self._worker_rss) if not self._inline else main,
+            'total': main + sum(self._worker_rss),
+        }
+
+    def close(self):
+        for conn in self._conns:
+            conn.send(None)
+        for p in self._processes:
+            p.join(timeout=10)
@@ -0,0 +1,245 @@
+import numpy as np
+
+from sam.base import messageAgent as ma
+
+from netio import protocol
+from netio.io_handler import IOHandler
+from netio.local_agent import LocalBody, LocalMessage
+
+# 各类实例占实例总数的默认比例
+DEFAULT_RATIO = {
+    protocol.INSTANCE_TYPE_SWITCH: 0.05,
+    protocol.INSTANCE_TYPE_SERVER: 0.35,
+    protocol.INSTANCE_TYPE_LINK: 0.40,
+    protocol.INSTANCE_TYPE_VNFI: 0.15,
+    protocol.INSTANCE_TYPE_SFCI: 0.05,
+}
+
+SERVER_ID_BASE = 10000
+
+
+# 以下为sam.base中各对象的轻量替代，只包含Worker、SFCIndex等用到的属性和方法
+
+class Server:
+    __slots__ = ('_server_id', 'cpu_util', 'dram_usage')
+
+    def __init__(self, server_id: int):
+        self._server_id = server_id
+        self.cpu_util = None    # 各个核的CPU使用率
+        self.dram_usage = 0.0
+
+    def getServerID(self):
+        return self._server_id
+
+    def getCpuUtil(self):
+        return self.cpu_util
+
+    def getDRAMUsagePercentage(self):
+        return self.dram_usage
+
+
+class Switch:
+    __slots__ = ('switchID',)
+
+    def __init__(self, switch_id: int):
+        self.switchID = switch_id
+
+
+class Link:
+    __slots__ = ('srcID', 'dstID', 'NSH_num', 'SYN_num', 'DNS_num', 'utilization')
+
+    def __init__(self, src_id: int, dst_id: int):
+        self.srcID = src_id
+        self.dstID = dst_id
+        self.NSH_num = 0
+        self.SYN_num = 0
+        self.DNS_num = 0
+        self.utilization = 0.0
+
+
+class VNFI:
+    __slots__ = ('vnfiID', 'node')
+
+    def __init__(self, vnfi_id: int, node: Server):
+        self.vnfiID = vnfi_id
+        self.node = node
+
+
+class ForwardingPathSet:
+    __slots__ = ('primaryForwardingPath',)
+
+    def __init__(self, primary: dict):
+        self.primaryForwardingPath = primary
+
+
+class SFCI:
+    __slots__ = ('sfciID', 'vnfiSequence', 'forwardingPathSet')
+
+    def __init__(self, sfci_id: int, vnfi_sequence: list, forwarding_path_set: ForwardingPathSet):
+        self.sfciID = sfci_id
+        self.vnfiSequence = vnfi_sequence
+        self.forwardingPathSet = forwarding_path_set
+
+
+def split_counts(total: int, ratio: dict=None) -> dict:
+    """
+    按比例把实例总数分配给各类实例，每类至少一个
+    """
+
+    ratio = ratio or DEFAULT_RATIO
+    return {instance_type: max(1, int(total * r)) for instance_type, r in ratio.items()}
+
+
+class SyntheticZone:
+    def __init__(
+            self,
+            zone: str,
+            counts: dict,           # {instance_type: 实例数}
+            cores: int=4,           # 每个服务器的CPU核数
+            sfci_length: int=3,     # 每个SFCI包含的VNFI数
+            seed: int=0
+    ):
+        """
+        生成一个zone的合成拓扑，并按tick生成与Simulator/Measurer格式相同的数据。
+        交换机之间按环形连接，每个交换机发出的链路数相同，链路ID为(src, dst)；服务器和VNFI轮流分配到交换机和服务器上；
+        SFCI依次经过相邻的交换机。各指标在每个实例各自的基线上加入随机噪声，同一seed生成的数据完全相同。
+        """
+
+        self.zone = zone
+        self.counts = dict(counts)
+        self._rng = np.random.default_rng(seed)
+        self._msg_type = {v: k for k, v in IOHandler.DATA_SOURCE.items()}[zone]
+        self.tick = 0
+
+        n_switch = self.counts.get(protocol.INSTANCE_TYPE_SWITCH, 0)
+        n_server = self.counts.get(protocol.INSTANCE_TYPE_SERVER, 0)
+        n_link = self.counts.get(protocol.INSTANCE_TYPE_LINK, 0)
+        n_vnfi = self.counts.get(protocol.INSTANCE_TYPE_VNFI, 0)
+        n_sfci = self.counts.get(protocol.INSTANCE_TYPE_SFCI, 0)
+
+        self.switches = [Switch(i) for i in range(n_switch)]
+        self.servers = [Server(SERVER_ID_BASE + i) for i in range(n_server)]
+
+        self.links = []
+        if n_switch > 1:
+            out_degree = min(n_switch - 1, -(-n_link // n_switch))
+            for k in range(1, out_degree + 1):
+                for s in range(n_switch):
+                    if len(self.links) == n_link:
+                        break
+                    self.links.append(Link(s, (s + k) % n_switch))
+
+        self.vnfis = [VNFI(i, self.servers[i % n_server]) for i in range(n_vnfi)] if n_server > 0 else []
+
+        self.sfcis = []
+        if self.vnfis and n_switch > 1:
+            for i in range(n_sfci):
+                sequence = [[self.vnfis[(i * sfci_length + j) % len(self.vnfis)]] for j in range(sfci_length)]
+                path = [(0, (i + j) % n_switch) for j in range(sfci_length)]
+                self.sfcis.append(SFCI(i, sequence, ForwardingPathSet({1: [path]})))
+
+        # 各实例的基线
+        self._cpu_base = self._rng.uniform(20, 60, n_server)
+        self._mem_base = self._rng.uniform(30, 70, n_server)
+        self._cores = cores
+        self._packets_base = self._rng.uniform(2e4, 1e5, len(self.links))
+        self._syn_base = self._rng.uniform(0.02, 0.08, len(self.links))
+        self._dns_base = self._rng.uniform(0.02, 0.08, len(self.links))
+        self._util_base = self._rng.uniform(0.1, 0.9, len(self.links))
+
+        self._entries = {
+            protocol.INSTANCE_TYPE_SWITCH: {
+                _.switchID: {protocol.ATTR_ACTIVE: True, protocol.ATTR_SWITCH: _} for _ in self.switches
+            },
+            protocol.INSTANCE_TYPE_SERVER: {
+                _.getServerID(): {protocol.ATTR_ACTIVE: True, protocol.ATTR_SERVER: _} for _ in self.servers
+            },
+            protocol.INSTANCE_TYPE_LINK: {
+                (_.srcID, _.dstID): {protocol.ATTR_ACTIVE: True, protocol.ATTR_LINK: _} for _ in self.links
+            },
+            protocol.INSTANCE_TYPE_VNFI: {
+                _.vnfiID: {protocol.ATTR_ACTIVE: True, protocol.ATTR_VNFI: _} for _ in self.vnfis
+            },
+            IOHandler.SFCI_NAME: {
+                _.sfciID: {protocol.ATTR_ACTIVE: True, protocol.ATTR_SFCI: _} for _ in self.sfcis
+            },
+        }
+
+    def instance_count(self) -> int:
+        return sum(len(_) for _ in self._entries.values())
+
+    def sample(self) -> dict:
+        """
+        生成下一个tick各指标的取值，返回{指标: 与实例一一对应的数组}
+        """
+
+        n_server, n_link = len(self.servers), len(self.links)
+        packets = self._packets_base * self._rng.uniform(0.9, 1.1, n_link)
+        syn = np.clip(self._syn_base + self._rng.normal(0, 0.002, n_link), 0, 1)
+        dns = np.clip(self._dns_base + self._rng.normal(0, 0.002, n_link), 0, 1)
+        return {
+            'cpu': np.clip(self._cpu_base[:, None] + self._rng.normal(0, 2, (n_server, self._cores)), 0, 100),
+            'mem': np.clip(self._mem_base + self._rng.normal(0, 1, n_server), 0, 100),
+            'syn': packets * syn,
+            'dns': packets * dns,
+            'nsh': packets * (1 - syn - dns),
+            'util': np.clip(self._util_base + self._rng.normal(0, 0.02, n_link), 0, 1),
+            'server_active': np.ones(n_server, dtype=bool),
+            'link_active': np.ones(n_link, dtype=bool),
+        }
+
+    def apply(self, values: dict):
+        """
+        把sample()生成的取值写入各实例
+        """
+
+        for server, cpu, m in zip(self.servers, values['cpu'].tolist(), values['mem'].tolist()):
+            server.cpu_util = cpu
+            server.dram_usage = m
+        for link, nsh, syn, dns, util in zip(
+                self.links,
+                values['nsh'].astype(np.int64).tolist(),
+                values['syn'].astype(np.int64).tolist(),
+                values['dns'].astype(np.int64).tolist(),
+                values['util'].tolist()):
+            link.NSH_num = nsh
+            link.SYN_num = syn
+            link.DNS_num = dns
+            link.utilization = util
+
+        for entries, active in (
+                (self._entries[protocol.INSTANCE_TYPE_SERVER], values['server_active']),
+                (self._entries[protocol.INSTANCE_TYPE_LINK], values['link_active'])):
+            # 只修改状态发生变化的实例
+            current = np.fromiter((_[protocol.ATTR_ACTIVE] for _ in entries.values()), dtype=bool, count=len(entries))
+            if not (current == active).all():
+                keys = list(entries.keys())
+                for i in np.flatnonzero(current != active).tolist():
+                    entries[keys[i]][protocol.ATTR_ACTIVE] = bool(active[i])
+
+    def message(self) -> LocalMessage:
+        """
+        返回当前tick的数据消息，格式与Simulator/Measurer发来的消息相同
+        """
+
+        data = {
+            instance_type: {self.zone: entries} for instance_type, entries in self._entries.items() if entries
+        }
+        return LocalMessage(self._msg_type, LocalBody(data))
+
+    def step(self) -> LocalMessage:
+        self.apply(self.sample())
+        self.tick += 1
+        return self.message()
+
+
+def synthetic_zones(total: int, zones: list=None, seed: int=0, **kwargs) -> list:
+    """
+    生成实例总数为total的若干个zone，实例平均分配到各个zone
+    """
+
+    zones = zones or [ma.TURBONET_ZONE]
+    return [
+        SyntheticZone(zone, split_counts(total // len(zones)), seed=seed + i, **kwargs)
+        for i, zone in enumerate(zones)
+    ]
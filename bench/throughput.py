@@ -0,0 +1,109 @@
+# 端到端吞吐量基准测试：在合成拓扑上驱动IOHandler -> Dispatcher -> Worker，输出JSON格式的结果
+# 用法: python -m bench.throughput --sizes 1000 10000 100000 1000000 --ticks 20 --workers 4 --output throughput.json
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+
+import numpy as np
+
+from bench.pipeline import Pipeline
+from bench.synthetic import synthetic_zones
+
+
+def percentiles(values: list) -> dict:
+    values = np.asarray(values) * 1000
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p99': float(np.percentile(values, 99)),
+        'mean': float(np.mean(values)),
+        'max': float(np.max(values)),
+    }
+
+
+def run(instances: int, ticks: int, warmup: int, num_workers: int, inline: bool, zones: list, seed: int) -> dict:
+    """
+    在一个实例规模下运行warmup + ticks个tick，只统计后ticks个tick
+    """
+
+    synthetic = synthetic_zones(instances, zones, seed=seed)
+    pipeline = Pipeline(num_workers=num_workers, inline=inline)
+    try:
+        costs = []
+        for tick in range(warmup + ticks):
+            messages = [_.step() for _ in synthetic]
+            cost = pipeline.step(messages)
+            if tick >= warmup:
+                costs.append(cost)
+        rss = pipeline.peak_rss()
+    finally:
+        pipeline.close()
+
+    total = [_['total'] for _ in costs]
+    count = sum(_.instance_count() for _ in synthetic)
+    return {
+        'instances': count,
+        'counts': {zone.zone: zone.counts for zone in synthetic},
+        'ticks': ticks,
+        'tick_latency_ms': percentiles(total),
+        'stage_latency_ms': {
+            stage: percentiles([_[stage] for _ in costs]) for stage in ('recv', 'dispatch', 'detect', 'report')
+        },
+        'instances_per_s': count * len(total) / sum(total),
+        'peak_rss_mb': rss,
+        'alerts': sum(_['alerts'] for _ in costs),
+    }
+
+
+def _run_in_process(result_queue, *args):
+    logging.basicConfig(level=logging.ERROR)
+    result_queue.put(run(*args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help='实例总数')
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3, help='不计入结果的tick数（包括创建实例的第一个tick）')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--inline', action='store_true', help='所有worker在同一个进程中依次处理')
+    parser.add_argument('--zones', type=str, nargs='+', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='结果的JSON文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        # 每个规模在新的进程中运行，使峰值内存互不影响
+        ctx = multiprocessing.get_context('spawn')
+        result_queue = ctx.Queue()
+        p = ctx.Process(
+            target=_run_in_process,
+            args=(result_queue, size, args.ticks, args.warmup, args.workers, args.inline, args.zones, args.seed)
+        )
+        p.start()
+        result = result_queue.get()
+        p.join()
+        results.append(result)
+        print(f'{result["instances"]:>8d} 实例: p50 {result["tick_latency_ms"]["p50"]:.1f}ms  '
+              f'p99 {result["tick_latency_ms"]["p99"]:.1f}ms  '
+              f'{result["instances_per_s"]:.0f} 实例/s  峰值内存 {result["peak_rss_mb"]["total"]:.0f}MB',
+              file=sys.stderr)
+
+    output = {
+        'benchmark': 'throughput',
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'inline': args.inline,
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
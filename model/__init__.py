@@ -1,2 +1,4 @@
 from .time_series import TimeSeries
 from .history_values import HistoryValues
+from .history_store import HistoryStore
+from .instance_registry import InstanceRegistry
@@ -0,0 +1,111 @@
+from typing import Optional
+
+import numpy as np
+
+
+class HistoryStore:
+    def __init__(self, metrics: list, len_limit: int=30):
+        """
+        按行存储一类实例的各指标历史数据，每个实例占用一行，时间戳和各指标分别为一个二维数组。
+        每行预留2*len_limit个位置，写满后把最新的len_limit个数据点整体移到行首（均摊O(1)），
+        因此每行的时间戳始终连续且有序，可以直接用二分查找定位时间窗口。
+        只有一个线程写入，每行带有一个版本号（写入过程中为奇数），读取时版本号不一致则重试，读取不需要加锁也不会读到写了一半的行。
+        """
+
+        self._metrics = list(metrics)
+        self._len_limit = len_limit
+        self._width = 2 * len_limit
+
+        self._rows = 0
+        self._free = []     # 已释放的行号
+        self._lengths = np.zeros(0, dtype=np.int64)
+        self._versions = np.zeros(0, dtype=np.int64)
+        self._timestamps = np.zeros((0, self._width), dtype=np.float64)
+        self._values = {metric: np.zeros((0, self._width), dtype=np.float64) for metric in self._metrics}
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._lengths))
+        pad = capacity - len(self._lengths)
+        # 整体替换数组，正在读取旧数组的线程不受影响
+        self._values = {
+            metric: np.vstack([self._values[metric], np.zeros((pad, self._width), dtype=np.float64)])
+            for metric in self._metrics
+        }
+        self._timestamps = np.vstack([self._timestamps, np.zeros((pad, self._width), dtype=np.float64)])
+        self._versions = np.concatenate([self._versions, np.zeros(pad, dtype=np.int64)])
+        self._lengths = np.concatenate([self._lengths, np.zeros(pad, dtype=np.int64)])
+
+    def new_row(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._rows == len(self._lengths):
+            self._grow()
+        row = self._rows
+        self._rows += 1
+        return row
+
+    def free_row(self, row: int):
+        """
+        释放一行，由之后新增的实例复用
+        """
+
+        self._versions[row] += 1
+        self._lengths[row] = 0
+        self._versions[row] += 1
+        self._free.append(row)
+
+    def metrics(self) -> list:
+        return self._metrics
+
+    def append(self, row: int, timestamp: float, values: dict):
+        self._versions[row] += 1
+        n = int(self._lengths[row])
+        if n == self._width:
+            keep = self._len_limit
+            self._timestamps[row, :keep] = self._timestamps[row, n - keep:n]
+            for metric in self._metrics:
+                self._values[metric][row, :keep] = self._values[metric][row, n - keep:n]
+            n = keep
+
+        self._timestamps[row, n] = timestamp
+        for metric, value in values.items():
+            self._values[metric][row, n] = value
+        self._lengths[row] = n + 1
+        self._versions[row] += 1
+
+    def _window(self, lengths: np.ndarray, timestamps: np.ndarray, row: int,
+                num: Optional[int]=None, end: Optional[float]=None) -> tuple:
+        n = int(lengths[row])
+        hi = n if end is None else int(np.searchsorted(timestamps[row, :n], end, side='right'))
+        lo = max(0, hi - (num or self._len_limit))
+        return lo, hi
+
+    def window(self, row: int, num: Optional[int]=None, end: Optional[float]=None) -> tuple:
+        """
+        返回时间戳不晚于end的最近num个数据点的下标范围[lo, hi)
+        """
+
+        return self._window(self._lengths, self._timestamps, row, num, end)
+
+    def query(self, row: int, metric: Optional[str]=None, num: Optional[int]=None, end: Optional[float]=None):
+        """
+        查询某一行的历史数据，返回(timestamps, values)。
+        指定metric时values为该指标的list，否则为{metric: list}
+        """
+
+        while True:
+            # 先取得各数组的引用，扩容时数组被整体替换，不影响本次读取
+            versions, lengths, timestamps, values = self._versions, self._lengths, self._timestamps, self._values
+            version = int(versions[row])
+            if version % 2 == 1:
+                continue
+
+            lo, hi = self._window(lengths, timestamps, row, num, end)
+            result_timestamps = timestamps[row, lo:hi].tolist()
+            if metric is not None:
+                result = result_timestamps, values[metric][row, lo:hi].tolist()
+            else:
+                result = result_timestamps, {_: values[_][row, lo:hi].tolist() for _ in self._metrics}
+
+            if int(versions[row]) == version:
+                return result
@@ -1,12 +1,13 @@
+from collections import deque
+
+
 class HistoryValues:
     def __init__(self, len_limit: int=30):
         self._len_limit = len_limit
-        self._values = []
+        self._values = deque(maxlen=len_limit)
 
     def append(self, obj):
         self._values.append(obj)
-        if len(self._values) > self._len_limit:
-            self._values.pop(0)
 
     def value(self):
-        return self._values
+        return list(self._values)
@@ -0,0 +1,149 @@
+import numpy as np
+
+
+class InstanceRegistry:
+    def __init__(self, capacity: int=1024):
+        """
+        Worker负责的全部实例。每个实例(zone, instance_type, idx)分配一个稠密的行号，
+        异常/故障状态和各时间戳保存在按行号索引的NumPy数组中，各指标的TimeSeries保存在按行号索引的列表中，
+        不为每个实例单独创建字典，也不保留原始的sam对象。
+        只由数据处理线程修改；数组扩容时整体替换，其他线程持有的旧数组不受影响。
+        长时间没有出现的实例被移除后，其行号放入空闲列表，由之后新增的实例复用。
+        """
+
+        self._rows = {}         # (zone, instance_type, idx) -> row
+        self._keys = []         # row -> (zone, instance_type, idx)，已移除的行为None
+        self._free = []         # 已移除的行号
+        self._scopes = {}       # (zone, instance_type) -> {idx: row}，用于只访问相关的实例
+        self._abnormal = {}     # (zone, instance_type) -> 最近一次检测结果为异常的idx集合，在检测结果变化时维护
+        self._failure = {}      # (zone, instance_type) -> 处于故障状态的idx集合，在状态变化时维护
+
+        self.metrics = []       # row -> {metric: TimeSeries}，没有需要检测的指标时为None
+        self.abnormal_state = np.zeros(capacity, dtype=np.int64)    # 最后一次abnormal的时间，处在报警冷却过程中时仍然更新
+        self.failure_state = np.zeros(capacity, dtype=bool)
+        self.detected_abnormal = np.zeros(capacity, dtype=bool)     # 最近一次检测的结果，用于记录状态变化
+        self.last_abnormal = np.zeros(capacity, dtype=np.float64)   # 最后一次报告异常的时间
+        self.last_failure = np.zeros(capacity, dtype=np.float64)    # 最后一次报告故障的时间
+        self.history_row = np.full(capacity, -1, dtype=np.int64)    # 在对应类型HistoryStore中的行号，-1为没有
+        self.last_seen = np.zeros(capacity, dtype=np.int64)         # 最后一次收到数据的tick序号
+        self.live = np.zeros(capacity, dtype=bool)                  # 该行是否对应一个实例
+
+    _ARRAYS = ('abnormal_state', 'failure_state', 'detected_abnormal',
+               'last_abnormal', 'last_failure', 'history_row', 'last_seen', 'live')
+
+    @staticmethod
+    def _default(name: str) -> int:
+        return -1 if name == 'history_row' else 0
+
+    def _grow(self):
+        capacity = 2 * len(self.abnormal_state)
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.full(capacity, self._default(name), dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def row(self, key: tuple):
+        return self._rows.get(key)
+
+    def key(self, row: int) -> tuple:
+        return self._keys[row]
+
+    def rows(self) -> np.ndarray:
+        """
+        当前所有实例的行号
+        """
+
+        return np.flatnonzero(self.live[:len(self._keys)])
+
+    def add(self, key: tuple) -> int:
+        if self._free:
+            row = self._free.pop()
+            self._keys[row] = key
+        else:
+            row = len(self._keys)
+            if row == len(self.abnormal_state):
+                self._grow()
+            self._keys.append(key)
+            self.metrics.append(None)
+        self._rows[key] = row
+        self.live[row] = True
+
+        zone, instance_type, idx = key
+        self._scopes.setdefault((zone, instance_type), {})[idx] = row
+        return row
+
+    def remove(self, row: int):
+        """
+        移除一个实例，清空其状态并回收行号
+        """
+
+        key = self._keys[row]
+        zone, instance_type, idx = key
+        del self._rows[key]
+        del self._scopes[(zone, instance_type)][idx]
+        self._abnormal.get((zone, instance_type), set()).discard(idx)
+        self._failure.get((zone, instance_type), set()).discard(idx)
+
+        self._keys[row] = None
+        self.metrics[row] = None
+        for name in self._ARRAYS:
+            getattr(self, name)[row] = self._default(name)
+        self._free.append(row)
+
+    def expired(self, tick: int, ttl: int) -> np.ndarray:
+        """
+        连续超过ttl个tick没有收到数据的实例的行号
+        """
+
+        n = len(self._keys)
+        return np.flatnonzero(self.live[:n] & (self.last_seen[:n] < tick - ttl))
+
+    def scope(self, zone: str, instance_type: str) -> dict:
+        return self._scopes.get((zone, instance_type), {})
+
+    def abnormal_ids(self, zone: str, instance_type: str) -> set:
+        return self._abnormal.get((zone, instance_type), set())
+
+    def failure_ids(self, zone: str, instance_type: str) -> set:
+        return self._failure.get((zone, instance_type), set())
+
+    def set_abnormal(self, row: int, timestamp: float):
+        """
+        记录实例最后一次异常的时间；该时间一直保留，异常实例集合由set_detected()维护
+        """
+
+        self.abnormal_state[row] = timestamp
+
+    def set_failure(self, row: int, failure: bool) -> bool:
+        """
+        更新实例的故障状态，返回状态是否发生了变化
+        """
+
+        if self.failure_state[row] == failure:
+            return False
+        self.failure_state[row] = failure
+        zone, instance_type, idx = self._keys[row]
+        if failure:
+            self._failure.setdefault((zone, instance_type), set()).add(idx)
+        else:
+            self._failure[(zone, instance_type)].discard(idx)
+        return True
+
+    def set_detected(self, row: int, abnormal: bool) -> bool:
+        """
+        记录最近一次检测的结果，并相应地加入或移出异常实例集合，返回结果是否发生了变化
+        """
+
+        if self.detected_abnormal[row] == abnormal:
+            return False
+        self.detected_abnormal[row] = abnormal
+        zone, instance_type, idx = self._keys[row]
+        if abnormal:
+            self._abnormal.setdefault((zone, instance_type), set()).add(idx)
+        else:
+            self._abnormal[(zone, instance_type)].discard(idx)
+        return True
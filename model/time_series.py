@@ -1,9 +1,10 @@
-import logging
 from typing import Optional
 import math
 import numpy as np
 
 class StatList:
+    __slots__ = ('_mu', '_sigma', '_value', '_lim')
+
     def __init__(self, lim: int=5):
         self._mu = 0
         self._sigma = 0
@@ -37,7 +38,18 @@ class StatList:
     def stats(self):
         return self._mu, self._sigma
 
+    def state(self) -> tuple:
+        return self._mu, self._sigma, list(self._value)
+
+    def load_state(self, mu: float, sigma: float, value: list):
+        self._mu = mu
+        self._sigma = sigma
+        self._value = list(value)
+
 class TimeSeries:
+    __slots__ = ('_k', '_normal_window_length', '_abnormal_window_length', '_minimum_sigma',
+                 '_value', '_count', '_epoch', '_capacity', '_stat_value')
+
     def __init__(self,
                  k: float=3,
                  normal_window_length: int=10,
@@ -47,6 +59,8 @@ class TimeSeries:
         """
         对于时间序列的前normal_window_length个元素，认为其是正常的。
         用正常的部分训练模型、获取算法需要的超参数。
+        只保留最近normal_window_length + abnormal_window_length个值，另外记录总共加入的值的个数。
+        epoch为数据所属的重置周期（Dispatcher确定的重置时间），加入的值属于新的周期时先丢弃之前的数据。
         """
 
         self._k = k
@@ -55,22 +69,60 @@ class TimeSeries:
         self._minimum_sigma = minimum_sigma
 
         self._value = list()
+        self._count = 0
+        self._epoch = 0
+        self._capacity = normal_window_length + abnormal_window_length
         self._stat_value = StatList(normal_window_length + abnormal_window_length)
 
     def reset(self):
         self._value = list()
+        self._count = 0
         self._stat_value.reset()
 
-    def add(self, value: float):
+    def state(self, epoch: float=None) -> tuple:
+        """
+        检测器的全部状态及其所属的重置周期，用于保存检查点和迁移。
+        epoch为实例当前所属的重置周期，晚于数据所属的周期时说明已经重置但还没有加入新的值，返回重置后的状态
+        """
+
+        if epoch is not None and epoch > self._epoch:
+            return 0, [], 0, 0, [], epoch
+        return (self._count, list(self._value)) + self._stat_value.state() + (self._epoch,)
+
+    def load_state(self, count: int, value: list, mu: float, sigma: float, stat_value: list, epoch: float=0):
+        # 旧的检查点中没有epoch
+        self._count = count
+        self._value = list(value)
+        self._stat_value.load_state(mu, sigma, stat_value)
+        self._epoch = epoch
+
+    def rebase(self, epoch: float):
+        """
+        恢复的状态所属的周期早于本worker中实例当前所属的周期epoch时丢弃，之后加入的值都属于epoch。
+        恢复的状态所属的周期更晚时（本worker重启后还没有收到那次重置）保留
+        """
+
+        if self._epoch < epoch:
+            self.reset()
+        self._epoch = epoch
+
+    def capacity(self) -> int:
+        return self._capacity
+
+    def add(self, value: float, epoch: int=0):
         assert type(value) in (float, int)
 
-        try:
-            self._value.append(value)
-            # 最新的值暂时不参与mu和sigma的计算
-            if len(self._value) > self._abnormal_window_length:
-                self._stat_value.add(self._value[- self._abnormal_window_length - 1])
-        except:
-            logging.warning('多线程导致Timeseries数据出错')
+        if epoch != self._epoch:
+            self.reset()
+            self._epoch = epoch
+
+        self._value.append(value)
+        self._count += 1
+        # 最新的值暂时不参与mu和sigma的计算
+        if len(self._value) > self._abnormal_window_length:
+            self._stat_value.add(self._value[- self._abnormal_window_length - 1])
+        if len(self._value) > self._capacity:
+            del self._value[0]
 
     def value(self, limit: Optional[int]=None) -> list:
         if limit and len(self._value) > limit:
@@ -93,7 +145,7 @@ class TimeSeries:
         return False
 
     def __len__(self):
-        return len(self._value)
+        return self._count
 
     def __str__(self):
         return f'Value:\t{self.value()}\n'
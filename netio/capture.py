@@ -0,0 +1,76 @@
+import os
+import pickle
+import zlib
+
+import numpy as np
+
+# 每条记录在capture.bin中的位置
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<f8'),   # 收到数据的时间
+    ('offset', '<u8'),
+    ('length', '<u8'),
+])
+
+
+class CaptureWriter:
+    def __init__(self, path: str):
+        """
+        记录IOHandler收到的原始数据，用于离线回放。
+        capture.bin: 依次存放每条消息(msg_type, 数据)经过pickle和zlib压缩后的结果；
+        capture.idx: 每条消息一个INDEX_DTYPE的定长记录，回放时通过内存映射读取，可以直接定位到任意一条消息。
+        """
+
+        os.makedirs(path, exist_ok=True)
+        self._data_file = open(os.path.join(path, 'capture.bin'), 'ab')
+        self._index_file = open(os.path.join(path, 'capture.idx'), 'ab')
+        self._offset = self._data_file.tell()
+
+    def append(self, timestamp: float, msg_type: str, data: dict):
+        chunk = zlib.compress(pickle.dumps((msg_type, data), protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self._data_file.write(chunk)
+        self._data_file.flush()
+
+        record = np.array([(timestamp, self._offset, len(chunk))], dtype=INDEX_DTYPE)
+        self._index_file.write(record.tobytes())
+        self._index_file.flush()
+        self._offset += len(chunk)
+
+    def close(self):
+        self._data_file.close()
+        self._index_file.close()
+
+
+class CaptureReader:
+    def __init__(self, path: str):
+        """
+        读取CaptureWriter记录的数据
+        """
+
+        index_path = os.path.join(path, 'capture.idx')
+        count = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self._index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,)) if count > 0 \
+            else np.zeros(0, dtype=INDEX_DTYPE)
+        self._data_file = open(os.path.join(path, 'capture.bin'), 'rb')
+
+    def __len__(self):
+        return len(self._index)
+
+    def timestamps(self) -> np.ndarray:
+        return np.asarray(self._index['timestamp'])
+
+    def read(self, i: int) -> tuple:
+        """
+        返回第i条消息的(timestamp, msg_type, 数据)
+        """
+
+        timestamp, offset, length = self._index[i].tolist()
+        self._data_file.seek(offset)
+        msg_type, data = pickle.loads(zlib.decompress(self._data_file.read(length)))
+        return timestamp, msg_type, data
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read(i)
+
+    def close(self):
+        self._data_file.close()
@@ -1,4 +1,5 @@
 import datetime
+import queue
 import random
 import time
 import uuid
@@ -11,7 +12,14 @@ from sam.base.command import CMD_TYPE_ABNORMAL_DETECTOR_RESET
 from sam.base.messageAgentAuxillary.msgConstant import MSG_TYPE_ABNORMAL_DETECTOR_CMD
 
 from netio import protocol
-from util import anomaly_report, threading
+from util import anomaly_report, threading, tracing
+from util.metrics import SharedMetrics, MetricsServer, SLOT_IO_HANDLER, SLOT_DISPATCHER
+from util.dashboard_query import DashboardQuery
+from util.state_reply import StateReply
+from util.topology import Topology
+from util.sfc_index import SFCIndex
+from util.logging_config import Lazy
+from netio.capture import CaptureWriter
 
 from sam.base import command, messageAgent as ma, request
 from sam.base.messageAgentAuxillary.msgAgentRPCConf import ABNORMAL_DETECTOR_IP, ABNORMAL_DETECTOR_PORT, SIMULATOR_IP, \
@@ -33,10 +41,21 @@ class IOHandler(ABC):
             anom_queue: Queue,      # 用于接收异常告警信息，并将其发送给调度器
             cmd_queue:  Queue,      # 用于接收命令消息，并将其送到主进程
             res_queue:  Queue,      # 用于接收前端返回的查询结果，并将其发送给前端
-            send_reports: bool=True # 是否要发送异常告警
+            send_reports: bool=True,    # 是否要发送异常告警
+            switch_alert_ratio: float=0.8,  # 交换机发出的链路中超过该比例异常时，合并为交换机告警
+            capture_dir: str=None,  # 不为None时，把收到的数据记录到该目录下，用于离线回放
+            agent=None,             # 替代MessageAgent的对象，用于回放，为None时使用MessageAgent
+            recv_interval: float=0.1,   # 每次接收消息之后的等待时间
+            metrics: SharedMetrics=None,    # 各进程共享的运行指标，为None时不记录
+            metrics_port: int=None,     # 不为None时，在该端口的/metrics以Prometheus文本格式提供运行指标（需要metrics）
+            metrics_host: str='127.0.0.1',
+            query_timeout: float=10     # 超过该时间（秒）仍有worker没有返回时，只发送已收到的结果，为None时一直等待
     ):
 
-        self._agent = None
+        self._agent = agent
+        self._capture_dir = capture_dir
+        self._capture = None    # 在run()中打开
+        self._recv_interval = recv_interval
         self._interval = interval
         self._num_workers = num_workers
 
@@ -57,6 +76,21 @@ class IOHandler(ABC):
         }
 
         self._dashboard_command_results = {}
+        self._dashboard_queries = {}    # cmd_id -> DashboardQuery，用于按查询范围组织返回结果
+        self._expected_results = {}     # cmd_id -> 需要返回结果的worker数
+        self._profile_commands = set()  # 性能分析命令的cmd_id
+        self._query_timeout = query_timeout
+        self._reply_deadlines = {}      # cmd_id -> 最晚发送结果的时间
+        self._topology = Topology(switch_alert_ratio)
+        self._sfc_index = SFCIndex()
+        self._metrics = metrics
+        self._metrics_slot = None if metrics is None else metrics.slot(SLOT_IO_HANDLER)
+        self._metrics_port = metrics_port
+        self._metrics_host = metrics_host
+        self._tracer = tracing.Tracer(self._metrics_slot)
+        self._trace_id = 0          # 每收到一条数据加1，作为数据的tick ID
+        self._query_recv = {}       # cmd_id -> 收到查询的时间
+        self._query_timings = {}    # cmd_id -> 各个worker处理查询的(开始时间, 结束时间)
 
     def _send_simulator(self):
         """
@@ -109,7 +143,7 @@ class IOHandler(ABC):
         发送一次报障结果
         """
 
-        logging.warning('故障报警结果：\t' + anomaly_report.data_format(report))
+        logging.warning('故障报警结果：\t%s', Lazy(anomaly_report.data_format, report))
         if not self._send_reports:
             return
 
@@ -127,7 +161,7 @@ class IOHandler(ABC):
         """
 
         try:
-            logging.info(f'发送前端查询结果 {cmd_id}')
+            logging.info('发送前端查询结果 %s', cmd_id)
             cmd = command.CommandReply(
                 cmdID=cmd_id,
                 cmdState=command.CMD_STATE_SUCCESSFUL,
@@ -149,6 +183,44 @@ class IOHandler(ABC):
         msg = ma.SAMMessage(ma.MSG_TYPE_ABNORMAL_DETECTOR_CMD, cmd)
         self._agent.sendMsgByRPC(REGULATOR_IP, REGULATOR_PORT, msg, maxRetryNum=0)
 
+    def _flush_anomaly_reports(self) -> int:
+        """
+        取出告警队列中的全部告警，合并为一次报障结果发送，返回告警数
+        """
+
+        report = anomaly_report.empty_anomaly_report_set()
+        count = 0
+        received = set()    # 产生这些告警的数据被IOHandler收到的时间
+        flushed = tracing.now()
+        while not self._anom_queue.empty():
+            anom = self._anom_queue.get()
+            zone, type_, switchID, serverID, linkID, trace = anom
+            count += 1
+            if trace is not None:
+                received.add(trace[0])
+                self._tracer.record(tracing.STAGE_ALERT_QUEUE, flushed - trace[1])
+
+            if switchID is not None:
+                report[zone][type_][protocol.ATTR_SWITCH_ID_LIST].add(switchID)
+            if serverID is not None:
+                report[zone][type_][protocol.ATTR_SERVER_ID_LIST].add(serverID)
+            if linkID is not None:
+                report[zone][type_][protocol.ATTR_LINK_ID_LIST].add(linkID)
+
+        if count > 0:
+            self._add_affected_services(report)
+            self._aggregate_switch_alerts(report)
+            report = anomaly_report.get_anomaly_report_list(report)
+            t0 = tracing.now()
+            self._send_anomaly_report(report)
+            t1 = tracing.now()
+            self._tracer.record(tracing.STAGE_REGULATOR_SEND, t1 - t0)
+            if self._metrics_slot is not None:
+                self._metrics_slot.inc('reports')
+            for _ in received:
+                self._tracer.record(tracing.STAGE_ALERT, t1 - _)
+        return count
+
     def _monitor_anomaly_report(self):
         """
         处理告警队列
@@ -156,26 +228,91 @@ class IOHandler(ABC):
         """
 
         while True:
-            report = anomaly_report.empty_anomaly_report_set()
-            count = 0
-            while not self._anom_queue.empty():
-                anom = self._anom_queue.get()
-                zone, type_, switchID, serverID, linkID = anom
-                count += 1
-
-                if switchID is not None:
-                    report[zone][type_][protocol.ATTR_SWITCH_ID_LIST].add(switchID)
-                if serverID is not None:
-                    report[zone][type_][protocol.ATTR_SERVER_ID_LIST].add(serverID)
-                if linkID is not None:
-                    report[zone][type_][protocol.ATTR_LINK_ID_LIST].add(linkID)
-
-            if count > 0:
-                report = anomaly_report.get_anomaly_report_list(report)
-                self._send_anomaly_report(report)
-
+            self._flush_anomaly_reports()
             time.sleep(3)
 
+    def _add_affected_services(self, report: dict):
+        """
+        在告警中附带依赖异常/故障服务器和链路的SFCI和VNFI
+        """
+
+        for zone, zone_report in report.items():
+            for anomaly_desc in zone_report.values():
+                sfci_ids, vnfi_ids = self._sfc_index.affected(
+                    zone,
+                    anomaly_desc[protocol.ATTR_SERVER_ID_LIST],
+                    anomaly_desc[protocol.ATTR_LINK_ID_LIST]
+                )
+                anomaly_desc[protocol.ATTR_SFCI_ID_LIST].update(sfci_ids)
+                anomaly_desc[protocol.ATTR_VNFI_ID_LIST].update(vnfi_ids)
+
+    def _aggregate_switch_alerts(self, report: dict):
+        """
+        交换机告警合并：某个交换机发出的链路中超过一定比例异常时，报告该交换机异常，并从告警中去掉这些链路
+        """
+
+        for zone, zone_report in report.items():
+            abnormal = zone_report[protocol.ATTR_ABNORMAL]
+            switches, links = self._topology.aggregate(zone, abnormal[protocol.ATTR_LINK_ID_LIST])
+            if not switches:
+                continue
+            abnormal[protocol.ATTR_SWITCH_ID_LIST].update(switches)
+            abnormal[protocol.ATTR_LINK_ID_LIST].difference_update(links)
+            logging.info('%s 合并了%d条链路的告警为%d个交换机告警', zone, len(links), len(switches))
+
+    @staticmethod
+    def _format_dashboard_reply(query: DashboardQuery, results: list) -> dict:
+        """
+        将各个worker返回的结果合并为前端需要的格式
+        实例状态查询: {zone: {instance_type: {idx: 状态}}}
+        其他查询: {query_type: xxx, value: {zone: {instance_type: 结果}}}
+        """
+
+        formatted_results = {
+            zone: {
+                instance_type: [] if query.query_type == protocol.QUERY_TYPE_INSTANCE_ID else {}
+                for instance_type in query.instance_types
+            } for zone in query.zones
+        }
+
+        if query.query_type is None:
+            reply = StateReply()
+            for item in results:
+                reply.merge(item)
+
+            # 只在这里才对各个Worker的结果进行解码
+            for zone, instance_type, idx, abnormal, failure in reply.items():
+                formatted_results.setdefault(zone, {}).setdefault(instance_type, {})[idx] = {
+                    protocol.ATTR_VALUE: None,
+                    protocol.ATTR_ABNORMAL: abnormal,
+                    protocol.ATTR_FAILURE: failure,
+                }
+            return formatted_results
+
+        for item in results:
+            for (zone, instance_type), r in item.items():
+                target = formatted_results.setdefault(zone, {})
+                if query.query_type == protocol.QUERY_TYPE_INSTANCE_ID:
+                    target.setdefault(instance_type, []).extend(r)
+                else:
+                    target.setdefault(instance_type, {}).update(r)
+
+        return {
+            protocol.ATTR_QUERY_TYPE: query.query_type,
+            protocol.ATTR_VALUE: formatted_results
+        }
+
+    @staticmethod
+    def _format_profile_reply(results: list) -> dict:
+        """
+        合并各个worker的性能分析摘要: {value: {worker名: 摘要}}
+        """
+
+        value = {}
+        for item in results:
+            value.update(item)
+        return {protocol.ATTR_VALUE: value}
+
     def _monitor_dashboard_reply(self):
         """
         处理前端查询结果
@@ -185,74 +322,198 @@ class IOHandler(ABC):
 
         while True:
             try:
-                cmd_id, cmd_attr = self._res_queue.get()
-                if cmd_id not in self._dashboard_command_results:
-                    self._dashboard_command_results[cmd_id] = []
-                self._dashboard_command_results[cmd_id].append(cmd_attr)
-
-                if len(self._dashboard_command_results[cmd_id]) == self._num_workers:   # 所有worker都已返回查询结果
-                    results = self._dashboard_command_results[cmd_id]
-                    r = {}
-                    for item in results:
-                        r.update(item)
-
-                    formatted_results = {
-                        zone: {
-                            instance_type: {}
-                            for instance_type in protocol.INSTANCE_TYPES
-                        } for zone in protocol.ZONES
-                    }
-                    for instance_idx, v in r.items():
-                        zone, instance_type, idx = instance_idx
-                        formatted_results[zone][instance_type][idx] = v
-
-                    self._send_dashboard_reply(cmd_id, formatted_results)
-                    self._dashboard_command_results.pop(cmd_id)
+                try:
+                    cmd_id, cmd_attr, timing = self._res_queue.get(timeout=1)
+                    self._collect_result(cmd_id, cmd_attr, timing)
+                except queue.Empty:
+                    pass
+                self._expire_replies()
 
             except Exception as e:
                 logging.warning(f'前端请求结果发生错误 {e}')
 
+    def _collect_result(self, cmd_id, cmd_attr, timing: tuple):
+        """
+        记录一个worker返回的结果，所有需要返回的worker都已返回时发送
+        """
+
+        if cmd_id not in self._expected_results:
+            # 已经超时发送过的结果
+            logging.debug('丢弃超时的结果 %s', cmd_id)
+            return
+
+        results = self._dashboard_command_results.setdefault(cmd_id, [])
+        results.append(cmd_attr)
+        if cmd_id not in self._profile_commands:
+            self._query_timings.setdefault(cmd_id, []).append(timing)
+        if len(results) >= self._expected_results[cmd_id]:
+            self._send_results(cmd_id)
+
+    def _expire_replies(self):
+        """
+        发送超时的查询已经收到的部分结果，使得单个worker失去响应时查询不会一直等待
+        """
+
+        now = tracing.now()
+        for cmd_id, deadline in list(self._reply_deadlines.items()):
+            if now < deadline:
+                continue
+            received = len(self._dashboard_command_results.get(cmd_id, []))
+            logging.warning('%s 超时，只有%d个worker返回了结果', cmd_id, received)
+            self._send_results(cmd_id)
+
+    def _send_results(self, cmd_id):
+        """
+        合并已收到的各个worker的结果并发送
+        """
+
+        results = self._dashboard_command_results.pop(cmd_id, [])
+        self._reply_deadlines.pop(cmd_id, None)
+        self._expected_results.pop(cmd_id, None)
+        if cmd_id in self._profile_commands:
+            self._profile_commands.discard(cmd_id)
+            self._send_dashboard_reply(cmd_id, self._format_profile_reply(results))
+            return
+
+        t0 = tracing.now()
+        query = self._dashboard_queries.pop(cmd_id, None) or DashboardQuery({})
+        self._send_dashboard_reply(cmd_id, self._format_dashboard_reply(query, results))
+        self._trace_query(cmd_id, t0, tracing.now())
+
+    @staticmethod
+    def _postprocessing(data: dict) -> dict:
+        if IOHandler.SFCI_NAME in data.keys():
+            data[protocol.INSTANCE_TYPE_SFCI] = data[IOHandler.SFCI_NAME]
+            data.pop(IOHandler.SFCI_NAME)
+        return data
+
+    def _current_workers(self) -> int:
+        """
+        当前正在运行的worker数，自动伸缩时由Dispatcher记录在共享运行指标中，即一条命令需要返回结果的worker数
+        """
+
+        if self._metrics is not None:
+            workers = int(self._metrics.slot(SLOT_DISPATCHER).get('workers'))
+            if workers > 0:
+                return workers
+        return self._num_workers
+
+    def _process_message(self, msg):
+        """
+        处理收到的一条消息：数据放入data_queue，重置信息和前端查询放入cmd_queue
+        """
+
+        received = tracing.now()
+        msg_type = msg.getMessageType()
+        if msg_type in self._receive_message_type:
+            body = msg.getbody()
+            data = body.attributes
+            now = datetime.datetime.now().timestamp()
+            if self._capture is not None:
+                self._capture.append(now, msg_type, data)
+            data = self._postprocessing(data)
+
+            logging.info('收到%s\t数据 (%.2fs)', self.DATA_SOURCE[msg_type], now - self._last_recv_timestamp[msg_type])
+            self._last_recv_timestamp[msg_type] = now
+
+            for zone, links in data.get(protocol.INSTANCE_TYPE_LINK, {}).items():
+                if self._topology.update(zone, links.keys()):
+                    logging.info('%s 拓扑已更新: %d条链路', zone, len(links))
+
+            sfcis = data.get(protocol.INSTANCE_TYPE_SFCI, {})
+            vnfis = data.get(protocol.INSTANCE_TYPE_VNFI, {})
+            for zone in set(sfcis) | set(vnfis):
+                self._sfc_index.update(zone, sfcis.get(zone, {}), vnfis.get(zone, {}))
+
+            self._trace_id += 1
+            queued = tracing.now()
+            data[protocol.ATTR_TRACE] = (self._trace_id, received, queued)
+            self._tracer.record(tracing.STAGE_RECV, queued - received)
+            if self._metrics_slot is not None:
+                self._metrics_slot.set('ticks', self._trace_id)
+            self._data_queue.put(data)
+        elif msg_type == ma.MSG_TYPE_ABNORMAL_DETECTOR_CMD:
+            cmd: command.Command = msg.getbody()
+            attr = cmd.attributes
+            if cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_QUERY:
+                if attr is not None:
+                    logging.info('收到前端查询 %s', attr)
+                    self._dashboard_queries[cmd.cmdID] = DashboardQuery(attr)
+                    self._expected_results[cmd.cmdID] = self._current_workers()
+                    self._query_recv[cmd.cmdID] = received
+                    if self._query_timeout is not None:
+                        self._reply_deadlines[cmd.cmdID] = received + self._query_timeout
+                    if self._metrics_slot is not None:
+                        self._metrics_slot.inc('queries')
+                    self._cmd_queue.put(cmd)
+            elif cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_RESET:
+                logging.warning(f'重置算法历史数据 {attr}')
+                self._cmd_queue.put(cmd)
+            elif cmd.cmdType == protocol.CMD_TYPE_ABNORMAL_DETECTOR_PROFILE:
+                worker_idx = (attr or {}).get(protocol.ATTR_WORKER)
+                num_workers = self._current_workers()
+                if worker_idx is not None and not 0 <= worker_idx < num_workers:
+                    logging.warning(f'性能分析命令的worker不存在 {worker_idx}')
+                    return
+                logging.warning(f'开始性能分析 {attr}')
+                self._profile_commands.add(cmd.cmdID)
+                self._expected_results[cmd.cmdID] = 1 if worker_idx is not None else num_workers
+                if self._query_timeout is not None:
+                    self._reply_deadlines[cmd.cmdID] = \
+                        received + float((attr or {}).get(protocol.ATTR_PROFILE_SECONDS, 30)) + self._query_timeout
+                self._cmd_queue.put(cmd)
+
     def _monitor_recv_data(self):
         """
         从Simulator和Measurer处接收数据，或接收重置信息和前端查询
         [阻塞方法]
         """
 
-        def postprocessing(_: dict):
-            if self.SFCI_NAME in _.keys():
-                _[protocol.INSTANCE_TYPE_SFCI] = _[self.SFCI_NAME]
-                _.pop(self.SFCI_NAME)
-            return _
-
         while True:
             try:
-                msg = self._agent.getMsgByRPC(ABNORMAL_DETECTOR_IP, ABNORMAL_DETECTOR_PORT)
-                msg_type = msg.getMessageType()
-                if msg_type in self._receive_message_type:
-                    body = msg.getbody()
-                    data = body.attributes
-                    data = postprocessing(data)
-
-                    now = datetime.datetime.now().timestamp()
-                    logging.info(f'收到{self.DATA_SOURCE[msg_type]}\t数据 '
-                                 f'({now - self._last_recv_timestamp[msg_type]:.2f}s)')
-                    self._last_recv_timestamp[msg_type] = now
-
-                    self._data_queue.put(data)
-                elif msg_type == ma.MSG_TYPE_ABNORMAL_DETECTOR_CMD:
-                    cmd: command.Command = msg.getbody()
-                    attr = cmd.attributes
-                    if cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_QUERY:
-                        if attr is not None:
-                            logging.info(f'收到前端查询')
-                            logging.info(f'{cmd.attributes}')
-                            self._cmd_queue.put(cmd)
-                    elif cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_RESET:
-                        logging.warning(f'重置算法历史数据')
-                        self._cmd_queue.put(cmd)
+                self._process_message(self._agent.getMsgByRPC(ABNORMAL_DETECTOR_IP, ABNORMAL_DETECTOR_PORT))
             except Exception as e:
-                logging.warning(f'接收数据非法 {e}')
-            time.sleep(0.1)
+                logging.warning('接收数据非法 %s', e)
+                if self._metrics_slot is not None:
+                    self._metrics_slot.inc('ticks_dropped')
+            if self._recv_interval > 0:
+                time.sleep(self._recv_interval)
+
+    def _trace_query(self, cmd_id, fanin: float, replied: float):
+        """
+        记录一次前端查询各个阶段的耗时
+        """
+
+        received = self._query_recv.pop(cmd_id, None)
+        timings = self._query_timings.pop(cmd_id, [])
+        for start, end in timings:
+            if received is not None:
+                self._tracer.record(tracing.STAGE_QUERY_FANOUT, start - received)
+            self._tracer.record(tracing.STAGE_QUERY_WORKER, end - start)
+        if timings:
+            self._tracer.record(tracing.STAGE_QUERY_FANIN, fanin - max(_[1] for _ in timings))
+        self._tracer.record(tracing.STAGE_QUERY_REPLY, replied - fanin)
+        if received is not None:
+            self._tracer.record(tracing.STAGE_QUERY, replied - received)
+
+    def _update_metrics(self):
+        self._metrics_slot.set('queue_depth', self._anom_queue.qsize())
+        self._metrics_slot.set('heartbeat', tracing.now())
+
+    def _serve_metrics(self):
+        """
+        提供/metrics
+        [阻塞方法]
+        """
+
+        server = MetricsServer(self._metrics, self._metrics_host, self._metrics_port, self._update_metrics)
+        logging.info(f'运行指标: http://{self._metrics_host}:{self._metrics_port}/metrics')
+        server.serve_forever()
+
+    def _print_trace(self):
+        while True:
+            time.sleep(20)
+            logging.info('IOHandler 各阶段延迟(p50/p99)\t%s', Lazy(self._tracer.format))
 
     def run(self):
         logging.info('IOHandler 开始运行...')
@@ -263,10 +524,15 @@ class IOHandler(ABC):
                 ABNORMAL_DETECTOR_PORT,
                 msgBufferSize=100000
             )
+        if self._capture_dir is not None:
+            self._capture = CaptureWriter(self._capture_dir)
 
         self._send_initialization()
 
-        with ThreadPoolExecutor(max_workers=4) as pool:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            pool.submit(self._print_trace).add_done_callback(threading.thread_done_callback)
+            if self._metrics is not None and self._metrics_port is not None:
+                pool.submit(self._serve_metrics).add_done_callback(threading.thread_done_callback)
             pool.submit(self._monitor_recv_data).add_done_callback(threading.thread_done_callback)
             pool.submit(self._monitor_dashboard_reply).add_done_callback(threading.thread_done_callback)
             pool.submit(self._monitor_anomaly_report).add_done_callback(threading.thread_done_callback)
@@ -0,0 +1,77 @@
+import collections
+import logging
+import time
+
+from netio import protocol
+from netio.capture import CaptureReader
+
+
+class LocalBody:
+    def __init__(self, attributes: dict):
+        self.attributes = attributes
+
+
+class LocalMessage:
+    def __init__(self, msg_type, body):
+        self._msg_type = msg_type
+        self._body = body
+
+    def getMessageType(self):
+        return self._msg_type
+
+    def getbody(self):
+        return self._body
+
+
+class LocalMessageAgent:
+    def __init__(self, capture_dir: str, speed: float=1.0):
+        """
+        MessageAgent的本地替代，用于回放CaptureWriter记录的数据，不需要Simulator、Measurer等服务。
+        speed为回放速度的倍数，按记录中的时间间隔除以speed发出每条消息；为0时以最快速度回放。
+        回放的数据中带有记录时的时间戳（protocol.ATTR_TIMESTAMP），Dispatcher使用该时间戳，因此任意速度下的检测结果都相同。
+        发出的消息不会被发送，只按目标地址计数，并保留最近的若干条。
+        """
+
+        self._capture_dir = capture_dir
+        self._speed = speed
+        self._reader = None     # 在第一次读取时打开，使得该对象可以被传给子进程
+        self._next = 0
+        self._start = None      # (第一条消息的时间戳, 开始回放的时间)
+
+        self.sent_count = collections.Counter()     # (ip, port) -> 发出的消息数
+        self.sent = collections.deque(maxlen=100)   # 最近发出的(ip, port, msg)
+
+    def startMsgReceiverRPCServer(self, ip, port, msgBufferSize=None):
+        pass
+
+    def sendMsgByRPC(self, ip, port, msg, maxRetryNum=0):
+        self.sent_count[(ip, port)] += 1
+        self.sent.append((ip, port, msg))
+
+    def finished(self) -> bool:
+        return self._reader is not None and self._next >= len(self._reader)
+
+    def getMsgByRPC(self, ip, port) -> LocalMessage:
+        if self._reader is None:
+            self._reader = CaptureReader(self._capture_dir)
+            logging.info(f'开始回放 {self._capture_dir}: {len(self._reader)}条消息，速度{self._speed or "最快"}')
+
+        if self._next >= len(self._reader):
+            if self._next == len(self._reader):
+                logging.info('回放完成')
+                self._next += 1
+            time.sleep(0.1)
+            return LocalMessage(None, None)
+
+        timestamp, msg_type, data = self._reader.read(self._next)
+        self._next += 1
+
+        if self._start is None:
+            self._start = (timestamp, time.time())
+        if self._speed > 0:
+            delay = self._start[1] + (timestamp - self._start[0]) / self._speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        data[protocol.ATTR_TIMESTAMP] = timestamp
+        return LocalMessage(msg_type, LocalBody(data))
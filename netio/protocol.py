@@ -6,13 +6,19 @@ ATTR_ABNORMAL = 'abnormal'
 ATTR_SWITCH_ID_LIST = 'switchIDList'
 ATTR_SERVER_ID_LIST = 'serverIDList'
 ATTR_LINK_ID_LIST = 'linkIDList'
+ATTR_SFCI_ID_LIST = 'sfciIDList'    # 受影响的SFCI
+ATTR_VNFI_ID_LIST = 'vnfiIDList'    # 受影响的VNFI
 
 ATTR_QUERY_TYPE = 'query_type'
 ATTR_METRIC_NAME = 'metric_name'
 ATTR_ZONE = 'zone'
 ATTR_TIME_WINDOW = 'time_window_datapoints_num'
+ATTR_TIME_START = 'time_start'
+ATTR_TIME_END = 'time_end'
+ATTR_RESOLUTION = 'resolution'
 ATTR_INSTANCE_TYPE = 'instance_type'
 ATTR_INSTANCE_ID_LIST = 'instance_id_list'
+ATTR_ABNORMAL_ONLY = 'abnormal_only'
 
 INSTANCE_TYPE_SWITCH = 'switches'
 INSTANCE_TYPE_LINK = 'links'
@@ -24,9 +30,29 @@ QUERY_TYPE_HISTORY = 'history_value'
 QUERY_TYPE_ANOMALY = 'anomaly_record'
 QUERY_TYPE_FAILURE = 'failure_record'
 QUERY_TYPE_INSTANCE_ID = 'instance_id_list'
+QUERY_TYPE_EVENT = 'event_record'
+
+# 性能分析命令，与前端查询一样以MSG_TYPE_ABNORMAL_DETECTOR_CMD发送，结果发给前端
+CMD_TYPE_ABNORMAL_DETECTOR_PROFILE = 'CMD_TYPE_ABNORMAL_DETECTOR_PROFILE'
+ATTR_PROFILE_MODE = 'profile_mode'
+ATTR_PROFILE_SECONDS = 'profile_seconds'
+ATTR_PROFILE_TOP = 'profile_top'    # 结果中返回的条目数
+ATTR_PROFILE_DIR = 'profile_dir'    # 结果文件所在的目录
+ATTR_WORKER = 'worker'              # worker的序号，为None时所有worker
+ATTR_FILE = 'file'
+ATTR_ERROR = 'error'
+
+PROFILE_MODE_CPU = 'cpu'            # cProfile
+PROFILE_MODE_MEMORY = 'memory'      # tracemalloc
 
 ATTR_ACTIVE = 'Active'
 ATTR_TIMESTAMP = 'timestamp'
+ATTR_TRACE = 'trace'   # 数据的跟踪信息: (tick ID, IOHandler收到的时间, 放入队列的时间)
+ATTR_MIGRATE_OUT = 'migrate_out'    # worker增减时，Dispatcher要求worker交出的实例
+ATTR_MIGRATE_IN = 'migrate_in'      # worker增减时，交给worker的实例及其检测器状态
+ATTR_STOP = 'stop'                  # worker被减少时，Dispatcher要求worker保存状态后退出
+ATTR_DROP = 'drop'                  # 重启的worker恢复后，Dispatcher要求暂时接管其实例的worker删除的实例副本
+ATTR_RESET_EPOCH = 'reset_epoch'    # Dispatcher在重置命令中加入的周期号（收到命令的时间），各worker使用同一个周期号
 ATTR_SERVER = 'server'
 ATTR_SWITCH = 'switch'
 ATTR_LINK = 'link'
@@ -39,6 +65,7 @@ ATTR_ABNORMAL_STATE = 'abnormal_state'
 ATTR_FAILURE_STATE = 'failure_state'
 ATTR_LAST_ABNORMAL = 'last_abnormal'
 ATTR_LAST_FAILURE = 'last_failure'
+ATTR_EVENT = 'event'
 ATTR_ID = 'id'
 
 ATTR_SERVER_CPU_UTILIZATION = 'cpu_utilization'
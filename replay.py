@@ -0,0 +1,57 @@
+# 回放IOHandler记录的数据（见run.py中的capture_dir），不需要Simulator、Measurer等服务
+# 用法: python replay.py capture --speed 10
+
+import argparse
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor
+
+from util import threading
+from netio.io_handler import IOHandler
+from netio.local_agent import LocalMessageAgent
+from util.dispatcher import Dispatcher
+from util.logging_config import logging_config
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture_dir', type=str)
+    parser.add_argument('--speed', type=float, default=1.0, help='回放速度的倍数，为0时以最快速度回放')
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--storage-dir', type=str, default=None)
+    parser.add_argument('--supervise', action='store_true',
+                        help='与正式运行一样重启没有心跳或积压过多的worker，默认不监控worker')
+    args = parser.parse_args()
+
+    logging_config()
+
+    data_queue  = Manager().Queue()
+    anom_queue  = Manager().Queue()
+    cmd_queue   = Manager().Queue()
+    res_queue   = Manager().Queue()
+    dispatcher = Dispatcher(
+        k=5,
+        data_queue=data_queue,
+        anom_queue=anom_queue,
+        cmd_queue=cmd_queue,
+        res_queue=res_queue,
+        num_workers=args.num_workers,
+        debug=False,
+        storage_dir=args.storage_dir,
+        # 快速回放时worker的积压和处理一批数据的时间都是预期的，重启会丢弃积压的数据
+        heartbeat_timeout=30 if args.supervise else None,
+        max_lag=20 if args.supervise else None
+    )
+    io_handler = IOHandler(
+        interval=3.0,
+        num_workers=args.num_workers,
+        data_queue=data_queue,
+        anom_queue=anom_queue,
+        cmd_queue=cmd_queue,
+        res_queue=res_queue,
+        send_reports=True,
+        agent=LocalMessageAgent(args.capture_dir, speed=args.speed),
+        recv_interval=0
+    )
+
+    pool = ProcessPoolExecutor(max_workers=1)
+    pool.submit(io_handler.run).add_done_callback(threading.thread_done_callback)
+    dispatcher.run()
@@ -1,19 +1,35 @@
+import argparse
 from multiprocessing import Manager
 from concurrent.futures import ProcessPoolExecutor
 
 from util import threading
 from netio.io_handler import IOHandler
 from util.dispatcher import Dispatcher
+from util.metrics import SharedMetrics
 from util.logging_config import logging_config
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-workers', type=int, default=18, help='启动时的worker数')
+    parser.add_argument('--min-workers', type=int, default=None,
+                        help='按worker的时间占比在[min-workers, max-workers]之间自动伸缩，默认等于num-workers，即不伸缩')
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--storage-dir', type=str, default=None, help='状态变化日志、长期历史数据和检查点的目录，默认不记录')
+    parser.add_argument('--capture-dir', type=str, default=None, help='记录收到的数据的目录，可以用replay.py回放，默认不记录')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在该端口的/metrics提供运行指标，默认不提供')
+    args = parser.parse_args()
+
     logging_config()
 
     data_queue  = Manager().Queue()
     anom_queue  = Manager().Queue()
     cmd_queue   = Manager().Queue()
     res_queue   = Manager().Queue()
-    num_workers = 18
+    num_workers = args.num_workers
+    min_workers = num_workers if args.min_workers is None else args.min_workers
+    max_workers = num_workers if args.max_workers is None else args.max_workers
+    # IOHandler按其中Dispatcher记录的worker数确定一条命令需要等待的结果数
+    metrics     = SharedMetrics(max_workers)
     dispatcher = Dispatcher(
         k=5,
         data_queue=data_queue,
@@ -21,7 +37,11 @@ if __name__ == '__main__':
         cmd_queue=cmd_queue,
         res_queue=res_queue,
         num_workers=num_workers,
-        debug=False
+        min_workers=min_workers,
+        max_workers=max_workers,
+        debug=False,
+        storage_dir=args.storage_dir,
+        metrics=metrics
     )
     io_handler = IOHandler(
         interval=3.0,
@@ -31,6 +51,9 @@ if __name__ == '__main__':
         cmd_queue=cmd_queue,
         res_queue=res_queue,
         send_reports=True,
+        capture_dir=args.capture_dir,
+        metrics=metrics,
+        metrics_port=args.metrics_port,
     )
 
     pool = ProcessPoolExecutor(max_workers=1)
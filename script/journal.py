@@ -0,0 +1,23 @@
+# 读取Worker的异常/故障状态变化日志，用于事后分析
+# 用法: python -m script.journal data/w_00/journal --start 1690000000 --end 1690003600
+
+import argparse
+import datetime
+import sys
+
+from storage import EventJournal
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('--start', type=float, default=None)
+    parser.add_argument('--end', type=float, default=None)
+    args = parser.parse_args()
+
+    try:
+        journal = EventJournal(args.path, read_only=True)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    for tick, (zone, instance_type, idx), event, state in journal.read(args.start, args.end):
+        t = datetime.datetime.fromtimestamp(tick).strftime('%Y-%m-%d %H:%M:%S')
+        print(f'{t}\t{zone}\t{instance_type}\t{idx}\t{event}\t{"进入" if state else "离开"}')
@@ -0,0 +1,54 @@
+# 向运行中的异常检测服务发送性能分析命令，结果文件写在服务所在的机器上，摘要发给前端
+# 用法: python -m script.profile cpu --seconds 30 --worker 3
+#       python -m script.profile memory --seconds 60 --wait
+# --wait时在前端的地址上接收结果并输出，需要前端没有在运行
+
+import argparse
+import json
+import time
+import uuid
+
+from sam.base import command, messageAgent as ma
+from sam.base.messageAgentAuxillary.msgAgentRPCConf import ABNORMAL_DETECTOR_IP, ABNORMAL_DETECTOR_PORT, \
+    DASHBOARD_IP, DASHBOARD_PORT
+
+from netio import protocol
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', type=str, choices=[protocol.PROFILE_MODE_CPU, protocol.PROFILE_MODE_MEMORY])
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--worker', type=int, default=None, help='worker的序号，默认为所有worker')
+    parser.add_argument('--top', type=int, default=20, help='摘要中的条目数')
+    parser.add_argument('--dir', type=str, default=None, help='结果文件的目录，默认为worker的storage_dir/profiles')
+    parser.add_argument('--wait', action='store_true', help='等待并输出结果')
+    args = parser.parse_args()
+
+    agent = ma.MessageAgent()
+    if args.wait:
+        agent.startMsgReceiverRPCServer(DASHBOARD_IP, DASHBOARD_PORT)
+
+    cmd = command.Command(
+        cmdType=protocol.CMD_TYPE_ABNORMAL_DETECTOR_PROFILE,
+        cmdID=uuid.uuid1(),
+        attributes={
+            protocol.ATTR_PROFILE_MODE: args.mode,
+            protocol.ATTR_PROFILE_SECONDS: args.seconds,
+            protocol.ATTR_PROFILE_TOP: args.top,
+            protocol.ATTR_PROFILE_DIR: args.dir,
+            protocol.ATTR_WORKER: args.worker,
+        }
+    )
+    agent.sendMsgByRPC(ABNORMAL_DETECTOR_IP, ABNORMAL_DETECTOR_PORT,
+                       ma.SAMMessage(ma.MSG_TYPE_ABNORMAL_DETECTOR_CMD, cmd), maxRetryNum=0)
+    print(f'已发送 {cmd.cmdID}')
+
+    while args.wait:
+        msg = agent.getMsgByRPC(DASHBOARD_IP, DASHBOARD_PORT)
+        if msg is None or msg.getMessageType() != ma.MSG_TYPE_ABNORMAL_DETECTOR_CMD_REPLY:
+            time.sleep(0.1)
+            continue
+        reply = msg.getbody()
+        if reply.cmdID == cmd.cmdID:
+            print(json.dumps(reply.attributes, indent=2, ensure_ascii=False))
+            break
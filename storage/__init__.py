@@ -0,0 +1,4 @@
+from .event_journal import EventJournal, EVENT_ABNORMAL, EVENT_FAILURE
+from .segment_store import SegmentStore
+from .checkpoint import Checkpoint
+from .spill_store import SpillStore
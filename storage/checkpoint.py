@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+# 每个实例的状态，与keys.json中的实例一一对应
+STATE_DTYPE = np.dtype([
+    ('abnormal_state', '<f8'),
+    ('failure_state', 'u1'),
+    ('detected_abnormal', 'u1'),
+    ('last_abnormal', '<f8'),
+    ('last_failure', '<f8'),
+])
+
+
+def _metric_dtype(capacity: int, stat_capacity: int) -> np.dtype:
+    return np.dtype([
+        ('row', '<u4'),
+        ('count', '<i8'),
+        ('n_value', '<u4'),
+        ('value', '<f8', (capacity,)),
+        ('mu', '<f8'),
+        ('sigma', '<f8'),
+        ('n_stat', '<u4'),
+        ('stat', '<f8', (stat_capacity,)),
+        ('epoch', '<f8'),
+    ])
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        """
+        检测器状态的检查点，每个Worker一份，为一个目录：
+        keys.json: 各实例的(zone, instance_type, idx)；
+        state.npy: 各实例的异常/故障状态和报警冷却时间戳，STATE_DTYPE的定长结构数组；
+        metric_<指标名>.npy: 各实例该指标的窗口数据、mu、sigma和所属的重置周期，用row对应到实例。
+        写入时先写到临时目录再整体替换，读取时通过内存映射打开。
+        """
+
+        self._path = path
+        self._tmp_path = path + '.tmp'
+        self._old_path = path + '.old'
+
+    def save(self, entries: list):
+        """
+        entries: [((zone, instance_type, idx), (abnormal_state, failure_state, detected_abnormal,
+                  last_abnormal, last_failure), {metric: TimeSeries.state()})]
+        """
+
+        if os.path.exists(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+        os.makedirs(self._tmp_path)
+
+        with open(os.path.join(self._tmp_path, 'keys.json'), 'w') as f:
+            json.dump([list(key) for key, _, _ in entries], f)
+
+        state = np.zeros(len(entries), dtype=STATE_DTYPE)
+        for row, (_, s, _) in enumerate(entries):
+            state[row] = s
+        np.save(os.path.join(self._tmp_path, 'state.npy'), state)
+
+        metrics = {}    # metric -> [(row, TimeSeries.state())]
+        for row, (_, _, metric_states) in enumerate(entries):
+            for metric, s in metric_states.items():
+                metrics.setdefault(metric, []).append((row, s))
+
+        for metric, items in metrics.items():
+            capacity = max(1, max(len(s[1]) for _, s in items))
+            stat_capacity = max(1, max(len(s[4]) for _, s in items))
+            array = np.zeros(len(items), dtype=_metric_dtype(capacity, stat_capacity))
+            for i, (row, (count, value, mu, sigma, stat, epoch)) in enumerate(items):
+                r = array[i]
+                r['row'] = row
+                r['count'] = count
+                r['n_value'] = len(value)
+                r['value'][:len(value)] = value
+                r['mu'] = mu
+                r['sigma'] = sigma
+                r['n_stat'] = len(stat)
+                r['stat'][:len(stat)] = stat
+                r['epoch'] = epoch
+            np.save(os.path.join(self._tmp_path, f'metric_{metric}.npy'), array)
+
+        # 保证任意时刻path或old_path中至少有一份完整的检查点
+        if os.path.exists(self._old_path):
+            shutil.rmtree(self._old_path)
+        if os.path.exists(self._path):
+            os.replace(self._path, self._old_path)
+        os.replace(self._tmp_path, self._path)
+        if os.path.exists(self._old_path):
+            shutil.rmtree(self._old_path)
+
+    def load(self) -> list:
+        """
+        读取检查点，返回值的格式与save()的参数相同；没有检查点时返回空列表
+        """
+
+        path = self._path if os.path.exists(self._path) else self._old_path
+        if not os.path.exists(os.path.join(path, 'state.npy')):
+            return []
+
+        with open(os.path.join(path, 'keys.json')) as f:
+            keys = [
+                (zone, instance_type, tuple(idx) if isinstance(idx, list) else idx)
+                for zone, instance_type, idx in json.load(f)
+            ]
+        state = np.load(os.path.join(path, 'state.npy'), mmap_mode='r')
+        entries = [(key, tuple(s), {}) for key, s in zip(keys, state.tolist())]
+
+        for filename in os.listdir(path):
+            if not (filename.startswith('metric_') and filename.endswith('.npy')):
+                continue
+            metric = filename[len('metric_'):-len('.npy')]
+            array = np.load(os.path.join(path, filename), mmap_mode='r')
+            # 之前版本的检查点中没有epoch
+            epochs = array['epoch'].tolist() if 'epoch' in array.dtype.names else [0] * len(array)
+            columns = zip(
+                array['row'].tolist(), array['count'].tolist(),
+                array['n_value'].tolist(), array['value'].tolist(),
+                array['mu'].tolist(), array['sigma'].tolist(),
+                array['n_stat'].tolist(), array['stat'].tolist(), epochs,
+            )
+            for row, count, n_value, value, mu, sigma, n_stat, stat, epoch in columns:
+                entries[row][2][metric] = (count, value[:n_value], mu, sigma, stat[:n_stat], epoch)
+        return entries
@@ -0,0 +1,142 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from netio import protocol
+
+EVENT_ABNORMAL = 0
+EVENT_FAILURE = 1
+EVENT_NAMES = {
+    EVENT_ABNORMAL: protocol.ATTR_ABNORMAL,
+    EVENT_FAILURE: protocol.ATTR_FAILURE,
+}
+
+RECORD_DTYPE = np.dtype([
+    ('tick', '<f8'),
+    ('row', '<u4'),
+    ('type', 'u1'),
+    ('state', 'u1'),
+], align=True)
+
+_MAGIC = 0x4a524e4c   # 'JRNL'
+_HEADER_SIZE = 64
+_GROW_RECORDS = 1 << 16
+
+
+class EventJournal:
+    def __init__(self, path: str, index_stride: int=1024, read_only: bool=False):
+        """
+        只追加的异常/故障状态变化日志，每个Worker一份。
+        events.bin: 64字节的文件头（magic, 记录数）+ 定长记录(tick, row, type, state)，通过内存映射读写；
+        rows.jsonl: row对应的实例(zone, instance_type, idx)，同样只追加。
+        记录按tick非递减的顺序写入，每index_stride条记录取一个tick作为稀疏时间索引，
+        按时间范围查询时只需读取相关的一段记录。
+        read_only为True时只读打开已有的日志（不创建文件，也不修改正在写入的日志），读到的是打开时已有的记录。
+        """
+
+        self._path = path
+        self._index_stride = index_stride
+        self._read_only = read_only
+        self._events_path = os.path.join(path, 'events.bin')
+        self._rows_path = os.path.join(path, 'rows.jsonl')
+        if read_only:
+            for file in (self._events_path, self._rows_path):
+                if not os.path.exists(file):
+                    raise FileNotFoundError(f'{file} 不存在，{path} 不是状态变化日志的目录')
+        else:
+            os.makedirs(path, exist_ok=True)
+
+        self._keys = []     # row -> (zone, instance_type, idx)
+        self._rows = {}     # (zone, instance_type, idx) -> row
+        if os.path.exists(self._rows_path):
+            with open(self._rows_path) as f:
+                for line in f:
+                    zone, instance_type, idx = json.loads(line)
+                    key = (zone, instance_type, tuple(idx) if isinstance(idx, list) else idx)
+                    self._rows[key] = len(self._keys)
+                    self._keys.append(key)
+        self._rows_file = None if read_only else open(self._rows_path, 'a')
+
+        if not os.path.exists(self._events_path):
+            with open(self._events_path, 'wb') as f:
+                f.truncate(_HEADER_SIZE + _GROW_RECORDS * RECORD_DTYPE.itemsize)
+            header = np.memmap(self._events_path, dtype='<u8', mode='r+', shape=(2,))
+            header[:] = (_MAGIC, 0)
+            header.flush()
+
+        self._header = np.memmap(self._events_path, dtype='<u8', mode='r' if read_only else 'r+', shape=(2,))
+        assert self._header[0] == _MAGIC, f'{self._events_path} 不是合法的日志文件'
+        self._count = int(self._header[1])
+        self._records = self._map_records()
+        self._index = self._records['tick'][:self._count:self._index_stride].tolist()
+        self._dirty = False
+
+    def _map_records(self) -> np.memmap:
+        capacity = (os.path.getsize(self._events_path) - _HEADER_SIZE) // RECORD_DTYPE.itemsize
+        return np.memmap(self._events_path, dtype=RECORD_DTYPE, mode='r' if self._read_only else 'r+',
+                         offset=_HEADER_SIZE, shape=(capacity,))
+
+    def _row(self, key: tuple) -> int:
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            self._rows[key] = row
+            self._keys.append(key)
+            zone, instance_type, idx = key
+            self._rows_file.write(json.dumps([zone, instance_type, idx]) + '\n')
+        return row
+
+    def append(self, tick: float, key: tuple, event_type: int, state: bool):
+        assert not self._read_only, f'{self._path} 以只读方式打开'
+        if self._count == len(self._records):
+            with open(self._events_path, 'r+b') as f:
+                f.truncate(_HEADER_SIZE + (self._count + _GROW_RECORDS) * RECORD_DTYPE.itemsize)
+            self._records = self._map_records()
+
+        if self._count % self._index_stride == 0:
+            self._index.append(tick)
+        self._records[self._count] = (tick, self._row(key), event_type, state)
+        self._count += 1
+        self._header[1] = self._count
+        self._dirty = True
+
+    def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._rows_file.flush()
+        self._records.flush()
+        self._header.flush()
+
+    def read(self, start: Optional[float]=None, end: Optional[float]=None) -> list:
+        """
+        读取tick在[start, end)内的所有记录，返回[(tick, (zone, instance_type, idx), event, state)]
+        先用稀疏索引定位到相关的段，再在段内二分查找
+        """
+
+        count = self._count
+        records = self._records[:count]
+
+        index = self._index[:(count + self._index_stride - 1) // self._index_stride]
+        lo_block = 0 if start is None else max(0, int(np.searchsorted(index, start, side='left')) - 1)
+        hi_block = len(index) if end is None else int(np.searchsorted(index, end, side='left'))
+        base = lo_block * self._index_stride
+        hi = min(count, hi_block * self._index_stride)
+        if hi <= base:
+            return []
+
+        ticks = records['tick'][base:hi]
+        lo = base if start is None else base + int(np.searchsorted(ticks, start, side='left'))
+        if end is not None:
+            hi = base + int(np.searchsorted(ticks, end, side='left'))
+
+        segment = np.array(records[lo:hi])
+        return [
+            (float(tick), self._keys[row], EVENT_NAMES[event_type], bool(state))
+            for tick, row, event_type, state in segment.tolist()
+        ]
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,480 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+from netio import protocol
+from storage import gorilla
+from util import threading
+
+RAW = 0     # 原始数据层的分辨率
+STATS = ('min', 'mean', 'max')
+_COMPRESS_BLOCK = 4096   # 压缩时每次转置的列数
+
+
+def _decode_key(key: list) -> tuple:
+    zone, instance_type, idx = key
+    return zone, instance_type, tuple(idx) if isinstance(idx, list) else idx
+
+
+@lru_cache(maxsize=32)
+def _load_columns(path: str) -> dict:
+    """
+    读取已封存的段的列号映射，只缓存最近使用的若干个段
+    """
+
+    columns = {}
+    with open(os.path.join(path, 'columns.jsonl')) as f:
+        for col, line in enumerate(f):
+            columns[_decode_key(json.loads(line))] = col
+    return columns
+
+
+def _load_meta(path: str) -> dict:
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def _write_meta(path: str, meta: dict):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+def _tmp_path(path: str) -> str:
+    # 不以seg_开头，列出段时不会被看到
+    return os.path.join(os.path.dirname(path), '.tmp_' + os.path.basename(path))
+
+
+def _parse_name(name: str) -> tuple:
+    """
+    段的目录名为seg_<起始时间>或seg_<起始时间>_<序号>（起始时间相同的段），返回(起始时间, 序号)
+    """
+
+    start, _, seq = name[len('seg_'):].partition('_')
+    return float(start), int(seq or 0)
+
+
+class _Segment:
+    def __init__(self, path: str, metrics: list, start: float, tick_capacity: int, column_capacity: int):
+        """
+        正在写入的原始数据段：每个指标一个[tick_capacity, column_capacity]的float32矩阵，按tick逐行写入。
+        先在临时目录中创建所有文件，再改名为path，其他线程列出段时不会看到没有meta.json的段；
+        已写入的行数记录在内存映射的rows.i8中，每个tick只修改内存，进程退出后仍可用于恢复未封存的段，封存时再写入meta.json
+        """
+
+        tmp_path = _tmp_path(path)
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        self.start = start
+        self.tick_capacity = tick_capacity
+        self.column_capacity = column_capacity
+
+        self.ticks = np.memmap(os.path.join(tmp_path, 'ticks.f8'), dtype=np.float64, mode='w+', shape=(tick_capacity,))
+        self.rows = np.memmap(os.path.join(tmp_path, 'rows.i8'), dtype=np.int64, mode='w+', shape=(1,))
+        self.values = {
+            metric: np.memmap(
+                os.path.join(tmp_path, f'{metric}.f4'), dtype=np.float32, mode='w+',
+                shape=(tick_capacity, column_capacity)
+            ) for metric in metrics
+        }
+        self.columns = {}
+        self.n_ticks = 0
+        self._columns_file = open(os.path.join(tmp_path, 'columns.jsonl'), 'a')
+        self._meta = {
+            'start': start,
+            'tick_capacity': tick_capacity,
+            'column_capacity': column_capacity,
+        }
+        _write_meta(tmp_path, self._meta)
+        # 内存映射和打开的文件在改名后仍然有效
+        os.rename(tmp_path, path)
+        self.path = path
+
+    def column(self, key: tuple) -> Optional[int]:
+        col = self.columns.get(key)
+        if col is None:
+            if len(self.columns) == self.column_capacity:
+                return None
+            col = len(self.columns)
+            self.columns[key] = col
+            self._columns_file.write(json.dumps(list(key)) + '\n')
+        return col
+
+    def advance(self, tick: float) -> bool:
+        if self.n_ticks == self.tick_capacity:
+            return False
+        self.ticks[self.n_ticks] = tick
+        for v in self.values.values():
+            v[self.n_ticks, :] = np.nan
+        self.n_ticks += 1
+        self.rows[0] = self.n_ticks
+        return True
+
+    def seal(self):
+        self._columns_file.close()
+        self.ticks.flush()
+        self.rows.flush()
+        for v in self.values.values():
+            v.flush()
+        meta = dict(self._meta)
+        meta['n_ticks'] = self.n_ticks
+        meta['end'] = float(self.ticks[self.n_ticks - 1]) if self.n_ticks > 0 else self.start
+        _write_meta(self.path, meta)
+
+
+class SegmentStore:
+    def __init__(
+            self,
+            path: str,
+            metrics: list,
+            segment_span: float     =3600,                  # 每个原始数据段覆盖的时间（秒）
+            tick_capacity: int      =1500,                  # 每个原始数据段最多容纳的tick数
+            raw_retention: float    =7 * 86400,             # 原始数据保留时间（秒）
+            rollups: tuple          =((60, 14 * 86400), (600, 90 * 86400)),    # (分辨率, 保留时间)
+    ):
+        """
+        按时间分段、按指标分列存储的长期历史数据，每个Worker的每类实例一份。
+        原始数据段为float32的定宽矩阵，写入时通过内存映射逐tick追加，查询时以只读方式映射，Worker内存占用不随历史长度增长。
+        段封存后在后台线程中降采样为1分钟和10分钟两层的min/mean/max，再将原始数据按实例压缩为Gorilla格式的块，
+        并按各层的保留时间删除过期数据。
+        查询时根据时间范围或指定的分辨率只读取需要的层和段。
+        """
+
+        self._path = path
+        self._metrics = list(metrics)
+        self._segment_span = segment_span
+        self._tick_capacity = tick_capacity
+        self._retention = {RAW: raw_retention}
+        self._retention.update(dict(rollups))
+        self._tiers = sorted(self._retention.keys())
+
+        os.makedirs(self._tier_path(RAW), exist_ok=True)
+        self._active: Optional[_Segment] = None
+        self._tick = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        for resolution in self._tiers:
+            tier_path = self._tier_path(resolution)
+            for name in os.listdir(tier_path) if os.path.exists(tier_path) else []:
+                if name.startswith('.tmp_'):
+                    # 上次运行时没有创建完的段
+                    shutil.rmtree(os.path.join(tier_path, name), ignore_errors=True)
+        # 上次运行时未封存的段
+        for _, seg_path in self._segments(RAW):
+            if 'n_ticks' not in _load_meta(seg_path):
+                self._executor.submit(self._recover, seg_path).add_done_callback(threading.thread_done_callback)
+
+    def _tier_path(self, resolution: int) -> str:
+        return os.path.join(self._path, 'raw' if resolution == RAW else f'rollup_{resolution}')
+
+    def metrics(self) -> list:
+        return self._metrics
+
+    def _rotate(self, tick: float):
+        column_capacity = 1024
+        if self._active is not None:
+            column_capacity = max(column_capacity, -(-len(self._active.columns) * 3 // 2 // 1024) * 1024)
+            sealed = self._active
+            sealed.seal()
+            self._executor.submit(self._post_seal, sealed.path).add_done_callback(threading.thread_done_callback)
+
+        start = tick if self._active is not None and tick < self._active.start + self._segment_span \
+            else tick - tick % self._segment_span
+        # 列数不足而换段时，新段与原来的段起始时间相同，以序号区分
+        name = f'seg_{start:.3f}'
+        path, seq = os.path.join(self._tier_path(RAW), name), 0
+        while os.path.exists(path):
+            seq += 1
+            path = os.path.join(self._tier_path(RAW), f'{name}_{seq}')
+        self._active = _Segment(
+            path,
+            self._metrics,
+            start,
+            self._tick_capacity,
+            column_capacity
+        )
+        self._active.advance(tick)
+
+    def append(self, tick: float, key: tuple, values: dict):
+        """
+        写入某个实例在tick时刻的各指标值，同一tick的数据需要连续写入
+        """
+
+        if tick != self._tick:
+            self._tick = tick
+            if self._active is None or tick >= self._active.start + self._segment_span or \
+                    not self._active.advance(tick):
+                self._rotate(tick)
+
+        col = self._active.column(key)
+        if col is None:     # 列数不足，换一个更宽的段
+            self._rotate(tick)
+            col = self._active.column(key)
+
+        row = self._active.n_ticks - 1
+        for metric, value in values.items():
+            self._active.values[metric][row, col] = value
+
+    def _recover(self, seg_path: str):
+        """
+        封存上次运行时未封存的段
+        """
+
+        meta = _load_meta(seg_path)
+        ticks = np.memmap(os.path.join(seg_path, 'ticks.f8'), dtype=np.float64, mode='r')
+        rows_path = os.path.join(seg_path, 'rows.i8')
+        # 没有rows.i8的为之前版本写入的段，只能按非0的时间戳计数
+        n_ticks = int(np.fromfile(rows_path, dtype=np.int64)[0]) if os.path.exists(rows_path) \
+            else int(np.count_nonzero(ticks))
+        meta['n_ticks'] = n_ticks
+        meta['end'] = float(ticks[n_ticks - 1]) if n_ticks > 0 else meta['start']
+        _write_meta(seg_path, meta)
+        self._post_seal(seg_path)
+
+    def _post_seal(self, seg_path: str):
+        """
+        [后台线程] 对封存的段降采样，将原始数据压缩，并删除过期数据
+        """
+
+        meta = _load_meta(seg_path)
+        n_ticks = meta['n_ticks']
+        name = os.path.basename(seg_path)
+        if n_ticks > 0 and not meta.get('compressed', False):
+            ticks = np.array(np.memmap(os.path.join(seg_path, 'ticks.f8'), dtype=np.float64, mode='r')[:n_ticks])
+            for resolution in self._tiers:
+                if resolution == RAW:
+                    continue
+                self._rollup(seg_path, meta, ticks, resolution, os.path.join(self._tier_path(resolution), name))
+            self._compress(seg_path, meta, ticks)
+
+        self._expire()
+
+    def _compress(self, seg_path: str, meta: dict, ticks: np.ndarray):
+        """
+        将封存的原始数据段按列（即每个实例）压缩为Gorilla格式的块，之后删除定宽矩阵
+        <metric>.gor为各列的块依次拼接，<metric>.gor.idx为各块的起始偏移
+        """
+
+        n_columns = sum(1 for _ in open(os.path.join(seg_path, 'columns.jsonl')))
+        for metric in self._metrics:
+            raw = np.memmap(
+                os.path.join(seg_path, f'{metric}.f4'), dtype=np.float32, mode='r',
+                shape=(meta['tick_capacity'], meta['column_capacity'])
+            )[:meta['n_ticks'], :n_columns]
+
+            offsets = [0]
+            with open(os.path.join(seg_path, f'{metric}.gor'), 'wb') as f:
+                for c0 in range(0, n_columns, _COMPRESS_BLOCK):
+                    block = np.ascontiguousarray(raw[:, c0:c0 + _COMPRESS_BLOCK].T)
+                    for column in block:
+                        mask = ~np.isnan(column)
+                        chunk = gorilla.encode(ticks[mask], column[mask])
+                        f.write(chunk)
+                        offsets.append(offsets[-1] + len(chunk))
+            np.asarray(offsets, dtype=np.uint64).tofile(os.path.join(seg_path, f'{metric}.gor.idx'))
+
+        meta['compressed'] = True
+        _write_meta(seg_path, meta)
+        for metric in self._metrics:
+            os.remove(os.path.join(seg_path, f'{metric}.f4'))
+
+    def _rollup(self, seg_path: str, meta: dict, ticks: np.ndarray, resolution: int, out_path: str):
+        buckets = np.floor(ticks / resolution) * resolution
+        bucket_starts, boundaries = np.unique(buckets, return_index=True)
+        n_columns = sum(1 for _ in open(os.path.join(seg_path, 'columns.jsonl')))
+
+        # 与原始数据段一样，在临时目录中写好之后再改名
+        final_path, out_path = out_path, _tmp_path(out_path)
+        if os.path.exists(out_path):
+            shutil.rmtree(out_path)
+        os.makedirs(out_path)
+        for metric in self._metrics:
+            raw = np.memmap(
+                os.path.join(seg_path, f'{metric}.f4'), dtype=np.float32, mode='r',
+                shape=(meta['tick_capacity'], meta['column_capacity'])
+            )[:meta['n_ticks'], :n_columns]
+            valid = ~np.isnan(raw)
+            count = np.add.reduceat(valid.astype(np.int32), boundaries, axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stats = {
+                    'min': np.fmin.reduceat(raw, boundaries, axis=0),
+                    'mean': np.add.reduceat(np.where(valid, raw, 0), boundaries, axis=0) / count,
+                    'max': np.fmax.reduceat(raw, boundaries, axis=0),
+                }
+            for stat, value in stats.items():
+                value.astype(np.float32).tofile(os.path.join(out_path, f'{metric}.{stat}.f4'))
+            # 相邻两个段中同一区间的mean按数据点个数加权合并
+            count.astype(np.int32).tofile(os.path.join(out_path, f'{metric}.count.i4'))
+
+        bucket_starts.astype(np.float64).tofile(os.path.join(out_path, 'ticks.f8'))
+        shutil.copyfile(os.path.join(seg_path, 'columns.jsonl'), os.path.join(out_path, 'columns.jsonl'))
+        _write_meta(out_path, {
+            'start': meta['start'],
+            'end': meta['end'],
+            'n_ticks': len(bucket_starts),
+            'column_capacity': n_columns,
+        })
+        if os.path.exists(final_path):
+            # 上次运行时降采样之后、压缩之前退出
+            shutil.rmtree(final_path)
+        os.rename(out_path, final_path)
+
+    def _expire(self):
+        now = self._tick
+        if now is None:
+            return
+        for resolution in self._tiers:
+            for seg_start, seg_path in self._segments(resolution):
+                if self._active is not None and seg_path == self._active.path:
+                    continue
+                meta = _load_meta(seg_path)
+                if meta.get('end', seg_start) < now - self._retention[resolution]:
+                    shutil.rmtree(seg_path, ignore_errors=True)
+
+    def _segments(self, resolution: int) -> list:
+        tier_path = self._tier_path(resolution)
+        if not os.path.exists(tier_path):
+            return []
+        names = sorted((_parse_name(name), name) for name in os.listdir(tier_path) if name.startswith('seg_'))
+        return [(start, os.path.join(tier_path, name)) for (start, _), name in names]
+
+    def _choose_tier(self, start: Optional[float], resolution: Optional[int]) -> int:
+        if resolution is not None:
+            return min(self._tiers, key=lambda _: abs(_ - resolution))
+        if start is None or self._tick is None:
+            return RAW
+        for tier in self._tiers:
+            if start >= self._tick - self._retention[tier]:
+                return tier
+        return self._tiers[-1]
+
+    def _read_segment(self, tier: int, seg_path: str, key: tuple, metric: str,
+                      start: Optional[float], end: Optional[float]) -> Optional[tuple]:
+        """
+        读取一个段中某个实例的数据，返回(ticks, {stat: values})，已去掉缺失的数据点
+        """
+
+        active = self._active
+        if tier == RAW and active is not None and seg_path == active.path:
+            meta = {'n_ticks': active.n_ticks, 'column_capacity': active.column_capacity}
+            columns = active.columns
+        else:
+            meta = _load_meta(seg_path)
+            if 'n_ticks' not in meta:
+                return None
+            columns = _load_columns(seg_path)
+        col = columns.get(key)
+        n_ticks = meta['n_ticks']
+        if col is None or n_ticks == 0:
+            return None
+
+        if meta.get('compressed', False):
+            offsets = np.fromfile(os.path.join(seg_path, f'{metric}.gor.idx'), dtype=np.uint64)
+            chunk = np.memmap(os.path.join(seg_path, f'{metric}.gor'), dtype=np.uint8, mode='r')
+            ticks, column = gorilla.decode(chunk[int(offsets[col]):int(offsets[col + 1])].tobytes())
+            lo = 0 if start is None else int(np.searchsorted(ticks, start, side='left'))
+            hi = len(ticks) if end is None else int(np.searchsorted(ticks, end, side='left'))
+            return ticks[lo:hi], {protocol.ATTR_VALUE: column[lo:hi]}
+
+        ticks = np.memmap(os.path.join(seg_path, 'ticks.f8'), dtype=np.float64, mode='r')[:n_ticks]
+        lo = 0 if start is None else int(np.searchsorted(ticks, start, side='left'))
+        hi = n_ticks if end is None else int(np.searchsorted(ticks, end, side='left'))
+        if lo >= hi:
+            return None
+
+        column_capacity = meta['column_capacity']
+        if tier == RAW:
+            column = {protocol.ATTR_VALUE: np.memmap(
+                os.path.join(seg_path, f'{metric}.f4'), dtype=np.float32, mode='r'
+            ).reshape(-1, column_capacity)[lo:hi, col]}
+        else:
+            column = {
+                stat: np.memmap(
+                    os.path.join(seg_path, f'{metric}.{stat}.f4'), dtype=np.float32, mode='r'
+                ).reshape(-1, column_capacity)[lo:hi, col]
+                for stat in STATS
+            }
+            count_path = os.path.join(seg_path, f'{metric}.count.i4')
+            # 之前版本的降采样数据没有数据点个数，合并时按相同的权重
+            column['count'] = np.memmap(count_path, dtype=np.int32, mode='r').reshape(-1, column_capacity)[lo:hi, col] \
+                if os.path.exists(count_path) else np.ones(hi - lo, dtype=np.int32)
+
+        mask = ~np.isnan(next(iter(column.values())))
+        return ticks[lo:hi][mask], {stat: np.array(v)[mask] for stat, v in column.items()}
+
+    def read(
+            self,
+            key: tuple,
+            metric: str,
+            start: Optional[float]=None,
+            end: Optional[float]=None,
+            resolution: Optional[int]=None
+    ) -> dict:
+        """
+        读取某个实例的某个指标在[start, end)内的历史数据。
+        未指定分辨率时，选择保留时间能覆盖start的最细的一层。
+        原始数据返回{timestamp, resolution, value}，降采样数据返回{timestamp, resolution, min, mean, max}
+        """
+
+        tier = self._choose_tier(start, resolution)
+        segments = self._segments(tier)
+
+        timestamps = []
+        values = {stat: [] for stat in ((protocol.ATTR_VALUE,) if tier == RAW else STATS + ('count',))}
+        for i, (seg_start, seg_path) in enumerate(segments):
+            next_start = segments[i + 1][0] if i + 1 < len(segments) else None
+            # 起始时间相同的段中，前一个段可能也有next_start时刻的数据
+            if (end is not None and seg_start >= end) or (start is not None and next_start is not None and
+                                                          next_start < start):
+                continue
+
+            for _ in range(2):  # 读取期间段可能刚好被压缩，此时重新读取一次
+                try:
+                    r = self._read_segment(tier, seg_path, key, metric, start, end)
+                    break
+                except FileNotFoundError:   # 段已被压缩或过期被删除
+                    r = None
+            if r is None:
+                continue
+
+            seg_ticks, column = r
+            timestamps.extend(seg_ticks.tolist())
+            for stat, v in column.items():
+                values[stat].extend(v.tolist())
+
+        if tier != RAW and len(timestamps) > 0:
+            # 提前换段时同一个降采样区间可能分布在相邻的两个段中，需要合并
+            timestamps, inverse = np.unique(timestamps, return_inverse=True)
+            if len(timestamps) < len(inverse):
+                merged = {
+                    'min': np.full(len(timestamps), np.inf),
+                    'mean': np.zeros(len(timestamps)),
+                    'max': np.full(len(timestamps), -np.inf),
+                }
+                count = np.asarray(values['count'], dtype=np.float64)
+                np.minimum.at(merged['min'], inverse, values['min'])
+                np.add.at(merged['mean'], inverse, np.asarray(values['mean']) * count)
+                np.maximum.at(merged['max'], inverse, values['max'])
+                merged['mean'] /= np.bincount(inverse, weights=count)
+                values = merged
+            values.pop('count', None)
+            timestamps = timestamps.tolist()
+            values = {stat: np.asarray(v).tolist() for stat, v in values.items()}
+
+        result = {protocol.ATTR_TIMESTAMP: timestamps, protocol.ATTR_RESOLUTION: tier}
+        result.update(values)
+        return result
+
+    def close(self):
+        if self._active is not None:
+            self._active.seal()
+            self._executor.submit(self._post_seal, self._active.path)
+            self._active = None
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,117 @@
+import json
+import os
+from typing import Optional
+
+
+def _decode_key(key: list) -> tuple:
+    zone, instance_type, idx = key
+    return zone, instance_type, tuple(idx) if isinstance(idx, list) else idx
+
+
+class SpillStore:
+    def __init__(self, path: str, compact_min: int=1024):
+        """
+        被移除的实例的检测器状态，每个Worker一份，为一个只追加的文件spill.jsonl：
+        每行为一个实例的状态[key, state, metric_states]（格式同Checkpoint.save()的一项），或取出后追加的删除标记[key]。
+        内存中只保存每个实例最新一行的(偏移, 长度)，写入和取出一个实例的代价与已写入的实例数无关。
+        失效的行超过有效行数且超过compact_min时，重写一次文件，只保留有效的行。
+        """
+
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        self._file_path = os.path.join(path, 'spill.jsonl')
+        self._index = {}    # key -> (偏移, 长度)
+        self._garbage = 0   # 失效的行数（被覆盖的状态和删除标记）
+        self._compact_min = compact_min
+
+        if os.path.exists(self._file_path):
+            with open(self._file_path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # 上次运行时没有写完的一行
+                        break
+                    record = json.loads(line)
+                    key = _decode_key(record[0])
+                    if key in self._index:
+                        self._garbage += 1
+                    if len(record) == 1:
+                        self._index.pop(key, None)
+                        self._garbage += 1
+                    else:
+                        self._index[key] = (offset, len(line))
+                    offset += len(line)
+            with open(self._file_path, 'r+b') as f:
+                f.truncate(offset)
+        self._file = open(self._file_path, 'ab')
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _append(self, record: list) -> tuple:
+        line = (json.dumps(record) + '\n').encode()
+        offset = self._file.tell()
+        self._file.write(line)
+        return offset, len(line)
+
+    def put(self, entries: list):
+        """
+        entries: Checkpoint.save()格式的实例状态，同一实例之前的状态失效
+        """
+
+        for key, state, metric_states in entries:
+            if key in self._index:
+                self._garbage += 1
+            self._index[key] = self._append([list(key), list(state), metric_states])
+        self._file.flush()
+        self._maybe_compact()
+
+    def pop(self, key: tuple) -> Optional[tuple]:
+        """
+        取出一个实例的状态并从文件中删除，没有时返回None
+        """
+
+        location = self._index.get(key)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self._file_path, 'rb') as f:
+            f.seek(offset)
+            _, state, metric_states = json.loads(f.read(length))
+        self.discard([key])
+        return key, tuple(state), {metric: tuple(s) for metric, s in metric_states.items()}
+
+    def discard(self, keys: list):
+        """
+        删除实例的状态（例如实例被迁移到了本worker，之前的状态已经过时）
+        """
+
+        removed = False
+        for key in keys:
+            if self._index.pop(key, None) is not None:
+                self._append([list(key)])
+                self._garbage += 2
+                removed = True
+        if removed:
+            self._file.flush()
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._garbage < self._compact_min or self._garbage < len(self._index):
+            return
+
+        tmp_path = self._file_path + '.tmp'
+        index = {}
+        with open(self._file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for key, (offset, length) in self._index.items():
+                src.seek(offset)
+                index[key] = (dst.tell(), length)
+                dst.write(src.read(length))
+        self._file.close()
+        os.replace(tmp_path, self._file_path)
+        self._file = open(self._file_path, 'ab')
+        self._index = index
+        self._garbage = 0
@@ -0,0 +1,35 @@
+import queue
+
+import pytest
+
+
+@pytest.fixture
+def make_worker():
+    """
+    创建不启动线程的Worker，直接调用其数据处理方法；依赖sam，没有sam时跳过
+    """
+
+    pytest.importorskip('sam')
+    from threading import Lock
+    from util.worker import Worker
+
+    def make(name: str='w_00', **kwargs) -> Worker:
+        params = dict(
+            k=3,
+            data_queue=queue.Queue(),
+            anom_queue=queue.Queue(),
+            cmd_queue=queue.Queue(),
+            res_queue=queue.Queue(),
+            history_len_limit=30,
+            cooldown=30,
+            normal_window_length=5,
+            abnormal_window_length=2,
+            debug=False,
+            name=name,
+            migrate_queue=queue.Queue(),
+        )
+        params.update(kwargs)
+        worker = Worker(**params)
+        worker._checkpoint_lock = Lock()
+        return worker
+    return make
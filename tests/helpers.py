@@ -0,0 +1,34 @@
+from sam.base import messageAgent as ma
+
+from bench.synthetic import Server
+from netio import protocol
+
+ZONE = ma.TURBONET_ZONE
+
+
+def server_element(idx: int, cpu: float, mem: float, active: bool=True) -> dict:
+    """
+    Dispatcher发给worker的一个服务器元素，服务器对象使用bench.synthetic中的轻量替代
+    """
+
+    server = Server(idx)
+    server.cpu_util = [cpu]
+    server.dram_usage = mem
+    return {
+        protocol.ATTR_INSTANCE_TYPE: protocol.INSTANCE_TYPE_SERVER,
+        protocol.ATTR_ZONE: ZONE,
+        protocol.ATTR_ACTIVE: active,
+        protocol.ATTR_VALUE: server,
+        protocol.ATTR_ID: idx,
+    }
+
+
+def server_batch(timestamp: float, values: dict) -> dict:
+    """
+    values: {服务器ID: (CPU使用率, 内存使用率)}
+    """
+
+    return {
+        protocol.ATTR_TIMESTAMP: timestamp,
+        protocol.ATTR_VALUE: [server_element(idx, cpu, mem) for idx, (cpu, mem) in values.items()],
+    }
@@ -0,0 +1,71 @@
+import queue
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sam')
+
+from helpers import ZONE, server_batch
+from netio import protocol
+from storage import Checkpoint
+
+CPU = protocol.ATTR_SERVER_CPU_UTILIZATION
+VALUES = {idx: (50.0 + idx % 3, 40.0) for idx in range(10)}
+
+
+def _worker(make_worker, chunk: int):
+    worker = make_worker(instance_ttl=2)
+    worker.CHECKPOINT_CHUNK = chunk
+    worker._checkpoint_pending = queue.Queue()
+    return worker
+
+
+def _copy(worker) -> list:
+    worker._checkpoint_due = True
+    while worker._checkpoint_pending.empty():
+        worker._copy_checkpoint()
+    assert not worker._checkpoint_due
+    return worker._checkpoint_pending.get_nowait()
+
+
+def test_round_trip(make_worker, tmp_path):
+    worker = _worker(make_worker, chunk=3)
+    for t in range(8):
+        worker._process_batch(server_batch(t * 3, VALUES))
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    checkpoint.save(_copy(worker))
+
+    restored = make_worker()
+    for entry in checkpoint.load():
+        restored._load_entry(entry)
+    assert len(restored._instances) == len(VALUES)
+    for idx in VALUES:
+        key = (ZONE, protocol.INSTANCE_TYPE_SERVER, idx)
+        ts = restored._instances.metrics[restored._instances.row(key)][CPU]
+        np.testing.assert_allclose(ts.value(), worker._instances.metrics[worker._instances.row(key)][CPU].value())
+
+
+def test_copy_in_chunks_drops_removed_instances(make_worker):
+    worker = _worker(make_worker, chunk=4)
+    worker._process_batch(server_batch(0, VALUES))
+    worker._checkpoint_due = True
+    worker._copy_checkpoint()
+    assert worker._checkpoint_pending.empty()
+
+    # 复制期间只有一部分实例还在收到数据，其余的被移除
+    for t in range(1, 5):
+        worker._process_batch(server_batch(t * 3, {idx: VALUES[idx] for idx in range(2)}))
+    entries = _copy(worker)
+    assert sorted(key[2] for key, _, _ in entries) == [0, 1]
+
+
+def test_reset_restarts_copy(make_worker):
+    worker = _worker(make_worker, chunk=4)
+    for t in range(8):
+        worker._process_batch(server_batch(t * 3, VALUES))
+    worker._checkpoint_due = True
+    worker._copy_checkpoint()
+    worker._reset_ksigma({protocol.ATTR_RESET_EPOCH: 100.0})
+    entries = _copy(worker)
+    assert len(entries) == len(VALUES)
+    assert all(metrics[CPU][0] == 0 for _, _, metrics in entries)
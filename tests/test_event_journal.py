@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('sam')
+
+from netio import protocol
+from storage import EventJournal, EVENT_ABNORMAL, EVENT_FAILURE
+
+KEY = ('zone', 'server', 1)
+LINK = ('zone', 'link', (1, 2))
+
+
+def test_journal_read_ranges(tmp_path):
+    journal = EventJournal(str(tmp_path), index_stride=4)
+    for t in range(20):
+        journal.append(float(t), KEY if t % 2 else LINK, EVENT_ABNORMAL if t % 3 else EVENT_FAILURE, t % 4 < 2)
+    journal.flush()
+
+    records = journal.read(5, 9)
+    assert [r[0] for r in records] == [5, 6, 7, 8]
+    assert records[0] == (5.0, KEY, protocol.ATTR_ABNORMAL, True)
+    assert len(journal.read()) == 20
+    assert journal.read(30) == []
+
+    reopened = EventJournal(str(tmp_path), index_stride=4, read_only=True)
+    assert reopened.read(18) == [(18.0, LINK, protocol.ATTR_FAILURE, False), (19.0, KEY, protocol.ATTR_ABNORMAL, False)]
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sam')
+
+from storage import gorilla
+
+
+@pytest.mark.parametrize('values', [
+    np.zeros(0),
+    np.array([42.0]),
+    np.full(100, 7.25),
+    np.random.default_rng(0).normal(50, 10, 1000),
+    np.array([0.0, -0.0, 1e-30, 3.4e38, -3.4e38, 1.0]),
+])
+def test_gorilla_round_trip(values):
+    rng = np.random.default_rng(1)
+    timestamps = np.cumsum(rng.integers(1, 5000, len(values))) / 1000 + 1.7e9
+    chunk = gorilla.encode(timestamps, values)
+    ticks, decoded = gorilla.decode(chunk)
+    np.testing.assert_allclose(ticks, timestamps, rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(decoded, values.astype(np.float32))
+
+
+def test_gorilla_compresses_regular_series():
+    timestamps = np.arange(1000) * 3.0
+    values = np.full(1000, 50.0)
+    assert len(gorilla.encode(timestamps, values)) < 1000
@@ -0,0 +1,36 @@
+import numpy as np
+
+from model import InstanceRegistry
+
+ZONE = 'turbonet'
+
+
+def test_abnormal_ids_follow_detection():
+    registry = InstanceRegistry(capacity=2)
+    rows = [registry.add((ZONE, 'server', idx)) for idx in range(3)]
+    assert registry.set_detected(rows[0], True)
+    assert not registry.set_detected(rows[0], True)
+    registry.set_abnormal(rows[0], 100)
+    registry.set_detected(rows[1], True)
+    assert registry.abnormal_ids(ZONE, 'server') == {0, 1}
+
+    # 恢复正常后移出集合，最后一次异常的时间仍然保留
+    assert registry.set_detected(rows[0], False)
+    assert registry.abnormal_ids(ZONE, 'server') == {1}
+    assert registry.abnormal_state[rows[0]] == 100
+
+    registry.remove(rows[1])
+    assert registry.abnormal_ids(ZONE, 'server') == set()
+
+
+def test_failure_ids_and_row_reuse():
+    registry = InstanceRegistry(capacity=1)
+    rows = [registry.add((ZONE, 'link', (idx, idx + 1))) for idx in range(3)]
+    assert registry.set_failure(rows[2], True)
+    assert registry.failure_ids(ZONE, 'link') == {(2, 3)}
+
+    registry.remove(rows[2])
+    assert registry.failure_ids(ZONE, 'link') == set()
+    assert registry.add((ZONE, 'link', (9, 10))) == rows[2]
+    assert not registry.failure_state[rows[2]]
+    np.testing.assert_array_equal(registry.rows(), rows)
@@ -0,0 +1,34 @@
+import logging
+
+from util import logging_config
+from util.logging_config import RateLimitFilter, RateLimitFormatter, RATE_KEY, RATE_LIMIT, RATE_SUPPRESSED
+
+
+def _record(msg: str, args=(), level: int=logging.INFO, lineno: int=1, **extra) -> logging.LogRecord:
+    record = logging.LogRecord('test', level, 'worker.py', lineno, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_rate_limit_per_call_site(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(logging_config.time, 'monotonic', lambda: now[0])
+    rate_filter = RateLimitFilter(interval=10, burst=2)
+
+    assert [rate_filter.filter(_record('a')) for _ in range(5)] == [True, True, False, False, False]
+    # 其他调用位置、指定了key、WARNING及以上和不限速的日志不受影响
+    assert rate_filter.filter(_record('b', lineno=2))
+    assert all(rate_filter.filter(_record('c', level=logging.WARNING)) for _ in range(5))
+    assert all(rate_filter.filter(_record('d', **{RATE_LIMIT: False})) for _ in range(5))
+    assert [rate_filter.filter(_record('e', lineno=3, **{RATE_KEY: _})) for _ in 'xyxyx'] == [True] * 4 + [False]
+
+    now[0] = 10
+    record = _record('%s %d', ('a', 1))
+    assert rate_filter.filter(record)
+    assert getattr(record, RATE_SUPPRESSED) == 3
+
+
+def test_formatter_keeps_message():
+    record = _record('%s 已处理 %d', ('w_00', 5), **{RATE_SUPPRESSED: 3})
+    assert RateLimitFormatter('%(message)s', interval=10).format(record) == 'w_00 已处理 5\t(之前10秒内省略了3条)'
+    assert RateLimitFormatter('%(message)s').format(_record('x')) == 'x'
@@ -0,0 +1,122 @@
+import pytest
+
+pytest.importorskip('sam')
+
+from helpers import ZONE, server_batch
+from netio import protocol
+from util.autoscaler import Autoscaler
+from util.hash_ring import HashRing
+
+CPU = protocol.ATTR_SERVER_CPU_UTILIZATION
+KEYS = [(ZONE, protocol.INSTANCE_TYPE_SERVER, idx) for idx in range(1, 4)]
+NORMAL = {idx: (50.0 + idx % 2, 40.0) for _, _, idx in KEYS}
+ABNORMAL = {idx: (99.0, 40.0) for _, _, idx in KEYS}
+
+
+def _ts(worker, key):
+    return worker._instances.metrics[worker._instances.row(key)][CPU]
+
+
+def _hand_over(source, target, keys, migration=1):
+    source._migrate({protocol.ATTR_MIGRATE_OUT: keys, protocol.ATTR_ID: migration})
+    received, entries = source._migrate_queue.get_nowait()
+    assert received == migration
+    target._migrate({protocol.ATTR_MIGRATE_IN: entries})
+
+
+def test_migrated_instance_keeps_window_and_detection(make_worker):
+    source, target, control = make_worker('w_00'), make_worker('w_01'), make_worker('w_02')
+    ticks = [NORMAL] * 10 + [ABNORMAL] * 2
+    for t, values in enumerate(ticks[:10]):
+        source._process_batch(server_batch(t * 3, values))
+        control._process_batch(server_batch(t * 3, values))
+
+    _hand_over(source, target, KEYS)
+    assert len(source._instances) == 0
+    for key in KEYS:
+        assert len(_ts(target, key)) == 10
+
+    for t, values in enumerate(ticks[10:], start=10):
+        target._process_batch(server_batch(t * 3, values))
+        control._process_batch(server_batch(t * 3, values))
+    for key in KEYS:
+        assert len(_ts(target, key)) == 12
+        assert _ts(target, key).value() == _ts(control, key).value()
+        assert _ts(target, key).is_abnormal()
+        assert _ts(target, key).is_abnormal() == _ts(control, key).is_abnormal()
+    assert set(target._instances.abnormal_ids(ZONE, protocol.INSTANCE_TYPE_SERVER)) == {idx for _, _, idx in KEYS}
+
+
+def test_migrate_in_replaces_instance_created_during_migration(make_worker):
+    source, target = make_worker('w_00'), make_worker('w_01')
+    for t in range(10):
+        source._process_batch(server_batch(t * 3, NORMAL))
+    source._migrate({protocol.ATTR_MIGRATE_OUT: KEYS, protocol.ATTR_ID: 1})
+    _, entries = source._migrate_queue.get_nowait()
+
+    # 迁移结果到达之前，新的worker已经收到了这些实例的数据
+    target._process_batch(server_batch(30, NORMAL))
+    target._migrate({protocol.ATTR_MIGRATE_IN: entries})
+    assert len(target._instances) == len(KEYS)
+    for key in KEYS:
+        assert len(_ts(target, key)) == 10
+
+
+def test_migrate_out_saves_checkpoint_without_handed_over_instances(make_worker, tmp_path):
+    from storage import Checkpoint
+
+    source = make_worker('w_00')
+    source._checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    for t in range(3):
+        source._process_batch(server_batch(t * 3, NORMAL))
+    source._migrate({protocol.ATTR_MIGRATE_OUT: KEYS[:1], protocol.ATTR_ID: 1})
+    assert [key for key, _, _ in source._checkpoint.load()] == KEYS[1:]
+
+
+def test_hash_ring_moves_only_to_added_node():
+    keys = [(ZONE, protocol.INSTANCE_TYPE_LINK, (i, i + 1)) for i in range(2000)]
+    ring = HashRing(range(4))
+    before = {key: ring.owner(key) for key in keys}
+    assert set(before.values()) == {0, 1, 2, 3}
+
+    ring.add(4)
+    after = {key: ring.owner(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == 4 for key in moved)
+    assert 0.1 < len(moved) / len(keys) < 0.3
+
+    ring.remove(4)
+    assert {key: ring.owner(key) for key in keys} == before
+    assert ring.nodes() == [0, 1, 2, 3]
+
+
+def test_hash_ring_is_stable_across_instances():
+    keys = [(ZONE, protocol.INSTANCE_TYPE_SERVER, i) for i in range(100)]
+    assert [HashRing(range(3)).owner(_) for _ in keys] == [HashRing([2, 0, 1]).owner(_) for _ in keys]
+
+
+def test_autoscaler():
+    scaler = Autoscaler(1, 4, scale_interval=10)
+    assert scaler.decide(0, {0: 0.0, 1: 0.0}) == 2
+    assert scaler.decide(5, {0: 4.0, 1: 1.0}) == 2     # 还没有到调整的间隔
+    assert scaler.decide(10, {0: 9.0, 1: 1.0}) == 3
+    scaler.decide(10, {0: 9.0, 1: 1.0, 2: 0.0})
+    assert scaler.decide(20, {0: 10.0, 1: 2.0, 2: 0.5}) == 2
+
+
+def test_drop_removes_taken_over_copies(make_worker):
+    worker = make_worker()
+    for t in range(3):
+        worker._process_batch(server_batch(t * 3, NORMAL))
+    worker._migrate({protocol.ATTR_DROP: KEYS[:2]})
+    assert [worker._instances.row(key) is None for key in KEYS] == [True, True, False]
+
+
+def test_recovered_instance_leaves_abnormal_set(make_worker):
+    worker = make_worker()
+    for t, values in enumerate([NORMAL] * 10 + [ABNORMAL] * 2 + [NORMAL] * 10):
+        worker._process_batch(server_batch(t * 3, values))
+        if t == 11:
+            assert len(worker._instances.abnormal_ids(ZONE, protocol.INSTANCE_TYPE_SERVER)) == len(KEYS)
+    assert not worker._instances.abnormal_ids(ZONE, protocol.INSTANCE_TYPE_SERVER)
+    assert not worker._snapshot.blocks[(ZONE, protocol.INSTANCE_TYPE_SERVER)].abnormal
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sam')
+
+from helpers import ZONE, server_batch
+from model import TimeSeries
+from netio import protocol
+from util.dashboard_query import DashboardQuery
+from util.reset_epochs import ResetEpochs
+
+CPU = protocol.ATTR_SERVER_CPU_UTILIZATION
+KEY = (ZONE, protocol.INSTANCE_TYPE_SERVER, 1)
+
+
+def _filled(n: int, epoch: float=0) -> TimeSeries:
+    ts = TimeSeries(k=3, normal_window_length=5, abnormal_window_length=2)
+    for i in range(n):
+        ts.add(float(i % 3), epoch)
+    return ts
+
+
+def test_state_round_trip_keeps_epoch():
+    ts = _filled(10, epoch=5)
+    restored = TimeSeries(k=3, normal_window_length=5, abnormal_window_length=2)
+    restored.load_state(*ts.state())
+    restored.add(1.0, 5)
+    assert len(restored) == 11
+    assert restored.value() == ts.value()[1:] + [1.0]
+
+
+def test_state_after_pending_reset_is_empty():
+    ts = _filled(10, epoch=5)
+    count, value, _, _, _, epoch = ts.state(epoch=7)
+    assert (count, value, epoch) == (0, [], 7)
+    assert ts.state(epoch=5)[0] == 10
+
+
+def test_rebase():
+    ts = _filled(10, epoch=5)
+    ts.rebase(3)    # 本worker还没有收到那次重置
+    ts.add(1.0, 3)
+    assert len(ts) == 11
+
+    ts.rebase(9)
+    assert len(ts) == 0
+    ts.add(1.0, 9)
+    assert len(ts) == 1
+
+
+def test_old_checkpoint_state_has_epoch_zero():
+    ts = _filled(10)
+    restored = TimeSeries(k=3, normal_window_length=5, abnormal_window_length=2)
+    restored.load_state(*ts.state()[:5])
+    restored.add(1.0, 0)
+    assert len(restored) == 11
+
+
+def test_reset_scopes():
+    epochs = ResetEpochs()
+    query = DashboardQuery({protocol.ATTR_ZONE: ZONE, protocol.ATTR_INSTANCE_TYPE: protocol.INSTANCE_TYPE_SERVER})
+    epochs.reset(query, 10)
+    assert epochs.current(*KEY) == 10
+    assert epochs.current(ZONE, protocol.INSTANCE_TYPE_LINK, 1) == 0
+
+    epochs.reset(DashboardQuery({}), 20)
+    assert epochs.current(ZONE, protocol.INSTANCE_TYPE_LINK, 1) == 20
+
+    # 晚到的旧命令不会使周期倒退
+    epochs.reset(DashboardQuery({}), 15)
+    assert epochs.current(*KEY) == 20
+
+
+def test_id_reset_only_records_owned_instances():
+    epochs = ResetEpochs()
+    query = DashboardQuery({protocol.ATTR_ZONE: ZONE, protocol.ATTR_INSTANCE_ID_LIST: [1, 2]})
+    epochs.reset(query, 10, owned=lambda key: key == KEY)
+    assert epochs._ids == {KEY: 10}
+
+    epochs.forget([KEY])
+    assert epochs._ids == {}
+
+
+def _fill(worker, ticks: int, start: int=0):
+    for t in range(start, start + ticks):
+        worker._process_batch(server_batch(t * 3, {1: (50.0 + t % 3, 40.0)}))
+
+
+def _cpu(worker) -> TimeSeries:
+    return worker._instances.metrics[worker._instances.row(KEY)][CPU]
+
+
+def test_reset_then_migrate(make_worker):
+    source, target = make_worker('w_00'), make_worker('w_01')
+    _fill(source, 10)
+    reset = {protocol.ATTR_RESET_EPOCH: 100.0}
+    source._reset_ksigma(reset)
+    target._reset_ksigma(reset)
+    _fill(source, 4, start=10)
+    assert len(_cpu(source)) == 4
+
+    source._migrate({protocol.ATTR_MIGRATE_OUT: [KEY], protocol.ATTR_ID: 1})
+    _, entries = source._migrate_queue.get_nowait()
+    target._migrate({protocol.ATTR_MIGRATE_IN: entries})
+    _fill(target, 1, start=14)
+    assert len(_cpu(target)) == 5
+
+
+def test_migrate_before_pending_reset_drops_window(make_worker):
+    source, target = make_worker('w_00'), make_worker('w_01')
+    _fill(source, 10)
+    source._reset_ksigma({
+        protocol.ATTR_ZONE: ZONE, protocol.ATTR_INSTANCE_ID_LIST: [1], protocol.ATTR_RESET_EPOCH: 100.0
+    })
+
+    # 重置之后还没有加入新的值就被迁移，目标worker没有记录这次重置
+    source._migrate({protocol.ATTR_MIGRATE_OUT: [KEY], protocol.ATTR_ID: 1})
+    _, entries = source._migrate_queue.get_nowait()
+    assert target._epochs._ids == {}
+    target._migrate({protocol.ATTR_MIGRATE_IN: entries})
+    _fill(target, 1, start=10)
+    assert len(_cpu(target)) == 1
+
+
+def test_reset_then_spill_and_restore(make_worker, tmp_path):
+    from storage import SpillStore
+
+    worker = make_worker(instance_ttl=2, spill_evicted=True)
+    worker._spill = SpillStore(str(tmp_path / 'spill'))
+    _fill(worker, 10)
+    worker._reset_ksigma({protocol.ATTR_RESET_EPOCH: 100.0})
+    _fill(worker, 3, start=10)
+
+    # 连续几个tick没有数据后被移除，再次出现时从磁盘恢复
+    for t in range(13, 17):
+        worker._process_batch(server_batch(t * 3, {}))
+    assert worker._instances.row(KEY) is None and KEY in worker._spill
+    _fill(worker, 1, start=17)
+    assert len(_cpu(worker)) == 4
+
+
+def test_reset_then_checkpoint_restore(make_worker, tmp_path):
+    from storage import Checkpoint
+
+    worker = make_worker()
+    _fill(worker, 10)
+    worker._reset_ksigma({protocol.ATTR_RESET_EPOCH: 100.0})
+    _fill(worker, 3, start=10)
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+    checkpoint.save(worker._checkpoint_entries(worker._instances.rows()))
+
+    # 重启后的worker没有之前的重置周期
+    restarted = make_worker()
+    for entry in checkpoint.load():
+        restarted._load_entry(entry)
+    _fill(restarted, 1, start=13)
+    assert len(_cpu(restarted)) == 4
+    np.testing.assert_allclose(_cpu(restarted).value(), _cpu(worker).value()[-3:] + [50.0 + 13 % 3])
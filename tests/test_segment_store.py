@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sam')
+
+from netio import protocol
+from storage import SegmentStore
+
+METRICS = ['cpu']
+KEY = ('zone', 'server', 1)
+
+
+def _store(path, **kwargs) -> SegmentStore:
+    params = dict(segment_span=3600, tick_capacity=100, rollups=((60, 86400),))
+    params.update(kwargs)
+    return SegmentStore(str(path), METRICS, **params)
+
+
+def test_read_raw_and_rollup(tmp_path):
+    store = _store(tmp_path)
+    for t in range(0, 300, 3):
+        store.append(float(t), KEY, {'cpu': float(t)})
+    r = store.read(KEY, 'cpu', start=30, end=60)
+    assert r[protocol.ATTR_TIMESTAMP] == list(range(30, 60, 3))
+    np.testing.assert_allclose(r[protocol.ATTR_VALUE], range(30, 60, 3))
+
+    store.close()
+    store = _store(tmp_path)
+    r = store.read(KEY, 'cpu', resolution=60)
+    assert r[protocol.ATTR_TIMESTAMP] == [0, 60, 120, 180, 240]
+    np.testing.assert_allclose(r['mean'], [28.5, 88.5, 148.5, 208.5, 268.5])
+    np.testing.assert_allclose(r['max'], [57, 117, 177, 237, 297])
+    # 封存后原始数据被压缩
+    np.testing.assert_allclose(store.read(KEY, 'cpu')[protocol.ATTR_VALUE], range(0, 300, 3))
+    store.close()
+
+
+def test_recover_unsealed_segment(tmp_path):
+    store = _store(tmp_path)
+    for t in range(10):
+        store.append(float(t), KEY, {'cpu': float(t)})
+    meta = os.path.join(store._active.path, 'meta.json')
+    mtime = os.stat(meta).st_mtime_ns
+    store.append(10.0, KEY, {'cpu': 10.0})
+    # 追加数据不会重写meta.json
+    assert os.stat(meta).st_mtime_ns == mtime
+
+    # 没有封存就退出，重新打开时恢复
+    store._executor.shutdown(wait=True)
+    store = _store(tmp_path)
+    store._executor.shutdown(wait=True)
+    r = store.read(KEY, 'cpu')
+    assert r[protocol.ATTR_TIMESTAMP] == list(range(11))
+
+
+def test_rollup_merge_is_weighted_by_count(tmp_path):
+    # 每个段只容纳15个tick，第一个1分钟区间分布在两个段中（15个和5个数据点）
+    store = _store(tmp_path, tick_capacity=15)
+    for t in range(0, 120, 3):
+        store.append(float(t), KEY, {'cpu': float(t)})
+    store.close()
+
+    store = _store(tmp_path, tick_capacity=15)
+    r = store.read(KEY, 'cpu', resolution=60)
+    assert r[protocol.ATTR_TIMESTAMP] == [0, 60]
+    np.testing.assert_allclose(r['mean'], [28.5, 88.5])
+    np.testing.assert_allclose(r['min'], [0, 60])
+    np.testing.assert_allclose(r['max'], [57, 117])
+    assert 'count' not in r
+    store.close()
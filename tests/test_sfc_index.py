@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('sam')
+
+from netio import protocol
+from util.sfc_index import SFCIndex
+
+ZONE = 'zone'
+
+
+class _Server:
+    def __init__(self, server_id):
+        self._server_id = server_id
+
+    def getServerID(self):
+        return self._server_id
+
+
+def _vnfi(server_id):
+    return SimpleNamespace(node=_Server(server_id))
+
+
+def _sfci(servers, path):
+    return SimpleNamespace(
+        vnfiSequence=[[_vnfi(_) for _ in servers]],
+        forwardingPathSet=SimpleNamespace(primaryForwardingPath={1: [[(0, node) for node in path]]}),
+    )
+
+
+def test_affected_follows_changed_dependencies():
+    index = SFCIndex()
+    index.update(ZONE, {1: _sfci([10], [1, 2, 3]), 2: {protocol.ATTR_SFCI: _sfci([11], [3, 4])}},
+                 {5: {protocol.ATTR_VNFI: _vnfi(10)}})
+    assert index.affected(ZONE, [10], []) == ({1}, {5})
+    assert index.affected(ZONE, [], [(3, 4)]) == ({2}, set())
+
+    # 同一个ID的路径改变、VNFI迁移到其他服务器
+    index.update(ZONE, {1: _sfci([10], [1, 5]), 2: {protocol.ATTR_SFCI: _sfci([11], [3, 4])}},
+                 {5: {protocol.ATTR_VNFI: _vnfi(11)}})
+    assert index.affected(ZONE, [], [(1, 2)]) == (set(), set())
+    assert index.affected(ZONE, [], [(1, 5)]) == ({1}, set())
+    assert index.affected(ZONE, [11], []) == ({2}, {5})
+
+    index.update(ZONE, {}, {})
+    assert index.affected(ZONE, [10, 11], [(1, 5), (3, 4)]) == (set(), set())
+    assert index._sfci_by_server[ZONE] == {} and index._vnfi_by_server[ZONE] == {}
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip('sam')
+
+from storage import SpillStore
+
+KEY = ('zone', 'server', 1)
+LINK = ('zone', 'link', (1, 2))
+
+
+def _entry(key, value: float) -> tuple:
+    return key, (0.0, 0, 0, 0.0, 0.0), {'cpu': (3, [value] * 3, value, 0.0, [], 0.0)}
+
+
+def test_spill_round_trip_and_reopen(tmp_path):
+    store = SpillStore(str(tmp_path), compact_min=2)
+    store.put([_entry(KEY, 1.0), _entry(LINK, 2.0)])
+    store.put([_entry(KEY, 3.0)])
+    assert KEY in store and len(store) == 2
+
+    key, _, metrics = store.pop(KEY)
+    assert key == KEY and metrics['cpu'][1] == [3.0] * 3
+    assert store.pop(KEY) is None
+
+    # 重新打开时按文件中最新的一行恢复，没有写完的一行被丢弃
+    with open(tmp_path / 'spill.jsonl', 'ab') as f:
+        f.write(b'[["zone", "server", 9]')
+    reopened = SpillStore(str(tmp_path))
+    assert len(reopened) == 1
+    assert reopened.pop(LINK)[2]['cpu'][2] == 2.0
+
+
+def test_spill_compaction(tmp_path):
+    store = SpillStore(str(tmp_path), compact_min=4)
+    for i in range(10):
+        store.put([_entry(KEY, float(i))])
+    store.discard([LINK])
+    assert store._garbage < 4
+    assert store.pop(KEY)[2]['cpu'][2] == 9.0
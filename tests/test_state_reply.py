@@ -0,0 +1,37 @@
+import numpy as np
+
+from util.state_reply import StateReply
+
+
+def test_round_trip_sorted_by_id():
+    reply = StateReply()
+    reply.add_block('zone', 'server', [3, 1, 2], [True, False, False], [False, False, True])
+    assert list(reply.items()) == [
+        ('zone', 'server', 1, False, False),
+        ('zone', 'server', 2, False, True),
+        ('zone', 'server', 3, True, False),
+    ]
+
+
+def test_link_ids_and_merge():
+    reply, other = StateReply(), StateReply()
+    reply.add_block('zone', 'link', [(2, 1), (1, 3), (1, 2)], np.array([1, 0, 1], dtype=bool), [False] * 3)
+    # 超过8个实例时位图跨字节
+    other.add_block('zone', 'server', list(range(20, 0, -1)), [_ % 3 == 0 for _ in range(20, 0, -1)], [False] * 20)
+    other.add_block('zone', 'switch', [], [], [])
+    reply.merge(other)
+    assert len(reply) == 23
+
+    items = list(reply.items())
+    assert items[:3] == [
+        ('zone', 'link', (1, 2), True, False),
+        ('zone', 'link', (1, 3), False, False),
+        ('zone', 'link', (2, 1), True, False),
+    ]
+    assert [idx for _, _, idx, abnormal, _ in items[3:] if abnormal] == [3, 6, 9, 12, 15, 18]
+
+
+def test_unorderable_ids_keep_order():
+    reply = StateReply()
+    reply.add_block('zone', 'vnfi', ['b', 1, None], [False, True, False], [True, False, False])
+    assert [(idx, a, f) for _, _, idx, a, f in reply.items()] == [('b', False, True), (1, True, False), (None, False, False)]
@@ -0,0 +1,28 @@
+from util.topology import Topology
+
+LINKS = [(1, 2), (1, 3), (1, 4), (2, 1), (2, 3), (3, 1)]
+
+
+def test_aggregate_switches_over_ratio():
+    topology = Topology(ratio=0.5)
+    assert topology.update('zone', set(LINKS))
+    assert not topology.update('zone', set(LINKS))
+
+    # 交换机1的3条链路中2条异常，交换机2的2条中1条异常（没有超过一半）
+    switches, merged = topology.aggregate('zone', {(1, 2), (1, 4), (2, 3), (9, 9)})
+    assert switches == [1]
+    assert sorted(merged) == [(1, 2), (1, 4)]
+
+    switches, merged = topology.aggregate('zone', {(1, 2), (3, 1)})
+    assert switches == [3] and merged == [(3, 1)]
+    assert topology.aggregate('zone', set()) == ([], [])
+    assert topology.aggregate('other', {(1, 2)}) == ([], [])
+
+
+def test_update_rebuilds_on_changed_links():
+    topology = Topology(ratio=0.5)
+    topology.update('zone', set(LINKS))
+    assert topology.update('zone', set(LINKS[:2]))
+    switches, merged = topology.aggregate('zone', {(1, 2), (1, 3)})
+    assert switches == [1] and sorted(merged) == [(1, 2), (1, 3)]
+    assert topology.aggregate('zone', {(2, 3)}) == ([], [])
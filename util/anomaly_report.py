@@ -12,24 +12,32 @@ def empty_anomaly_report_set():
             protocol.ATTR_FAILURE: {
                 protocol.ATTR_SWITCH_ID_LIST: set(),
                 protocol.ATTR_SERVER_ID_LIST: set(),
-                protocol.ATTR_LINK_ID_LIST: set()
+                protocol.ATTR_LINK_ID_LIST: set(),
+                protocol.ATTR_SFCI_ID_LIST: set(),
+                protocol.ATTR_VNFI_ID_LIST: set()
             },
             protocol.ATTR_ABNORMAL: {
                 protocol.ATTR_SWITCH_ID_LIST: set(),
                 protocol.ATTR_SERVER_ID_LIST: set(),
-                protocol.ATTR_LINK_ID_LIST: set()
+                protocol.ATTR_LINK_ID_LIST: set(),
+                protocol.ATTR_SFCI_ID_LIST: set(),
+                protocol.ATTR_VNFI_ID_LIST: set()
             },
         },
         ma.SIMULATOR_ZONE: {
             protocol.ATTR_FAILURE: {
                 protocol.ATTR_SWITCH_ID_LIST: set(),
                 protocol.ATTR_SERVER_ID_LIST: set(),
-                protocol.ATTR_LINK_ID_LIST: set()
+                protocol.ATTR_LINK_ID_LIST: set(),
+                protocol.ATTR_SFCI_ID_LIST: set(),
+                protocol.ATTR_VNFI_ID_LIST: set()
             },
             protocol.ATTR_ABNORMAL: {
                 protocol.ATTR_SWITCH_ID_LIST: set(),
                 protocol.ATTR_SERVER_ID_LIST: set(),
-                protocol.ATTR_LINK_ID_LIST: set()
+                protocol.ATTR_LINK_ID_LIST: set(),
+                protocol.ATTR_SFCI_ID_LIST: set(),
+                protocol.ATTR_VNFI_ID_LIST: set()
             },
         }
     }
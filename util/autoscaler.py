@@ -0,0 +1,48 @@
+class Autoscaler:
+    def __init__(
+            self,
+            min_workers: int,
+            max_workers: int,
+            scale_interval: float=30,   # 两次调整之间至少间隔的时间（秒）
+            up_ratio: float=0.7,
+            down_ratio: float=0.3
+    ):
+        """
+        按worker处理数据的时间占比调整worker数。时间占比为一段时间内处理数据的累计时间除以经过的时间，
+        即每个tick的处理时间与数据间隔之比，接近1时worker开始落后。
+        最忙的worker超过up_ratio时增加一个worker；低于down_ratio，且减少一个之后预计仍低于up_ratio时减少一个。
+        每scale_interval秒判断一次，worker发生变化后重新开始统计
+        """
+
+        assert 1 <= min_workers <= max_workers
+        assert 0 < down_ratio < up_ratio
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._scale_interval = scale_interval
+        self._up_ratio = up_ratio
+        self._down_ratio = down_ratio
+        self._last = None   # (时间, {worker序号: 累计处理时间})
+        self.utilization = None     # 最近一次统计的最忙的worker的时间占比
+
+    def decide(self, now: float, busy: dict) -> int:
+        """
+        busy: {worker序号: 累计处理时间（秒）}，返回调整后的worker数
+        """
+
+        n = len(busy)
+        if self._last is None or self._last[1].keys() != busy.keys():
+            self._last = (now, busy)
+            return n
+        elapsed = now - self._last[0]
+        if elapsed < self._scale_interval:
+            return n
+
+        last = self._last[1]
+        self.utilization = max(busy[idx] - last[idx] for idx in busy) / elapsed
+        self._last = (now, busy)
+        if self.utilization > self._up_ratio and n < self._max_workers:
+            return n + 1
+        if self.utilization < self._down_ratio and n > self._min_workers \
+                and self.utilization * n / (n - 1) < self._up_ratio:
+            return n - 1
+        return n
@@ -0,0 +1,40 @@
+import time
+from abc import ABC, abstractmethod
+
+
+class Clock(ABC):
+    """
+    为每批数据提供时间戳。Dispatcher每批数据只读取一次，Worker中的报警冷却、异常状态和状态变化日志都使用这个时间戳
+    """
+
+    @abstractmethod
+    def now(self) -> float:
+        pass
+
+
+class SystemClock(Clock):
+    def now(self) -> float:
+        return time.time()
+
+
+class SimulatedClock(Clock):
+    def __init__(self, start: float=0, step: float=None):
+        """
+        模拟时钟，用于回放和测试。
+        时间只在调用set()或advance()时变化；指定step时，每次调用now()之后自动前进step秒
+        """
+
+        self._now = start
+        self._step = step
+
+    def set(self, timestamp: float):
+        self._now = timestamp
+
+    def advance(self, seconds: float):
+        self._now += seconds
+
+    def now(self) -> float:
+        result = self._now
+        if self._step is not None:
+            self._now += self._step
+        return result
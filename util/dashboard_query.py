@@ -0,0 +1,59 @@
+from netio import protocol
+
+
+class DashboardQuery:
+    def __init__(self, attr: dict):
+        """
+        解析前端查询的参数。
+        query_type未指定时为实例状态查询，否则为protocol中定义的QUERY_TYPE_*之一；
+        zone和instance_type可以为单个值或列表，未指定时视为查询全部；
+        instance_id_list未指定时视为查询该zone和类型下的全部实例；
+        历史数据查询返回时间戳不晚于time_end的最近time_window_datapoints_num个数据点；
+        指定time_start或resolution时，历史数据查询从长期历史数据中返回[time_start, time_end)内的数据点；
+        状态变化记录查询返回[time_start, time_end)内的记录。
+        重置命令使用同样的zone、instance_type和instance_id_list参数确定重置的范围。
+        """
+
+        attr = attr or {}
+
+        self.query_type = attr.get(protocol.ATTR_QUERY_TYPE)
+        self.metric_name = attr.get(protocol.ATTR_METRIC_NAME)
+        self.time_window = attr.get(protocol.ATTR_TIME_WINDOW)
+        self.time_start = attr.get(protocol.ATTR_TIME_START)
+        self.time_end = attr.get(protocol.ATTR_TIME_END)
+        self.resolution = attr.get(protocol.ATTR_RESOLUTION)
+
+        self.zones = self._as_list(attr.get(protocol.ATTR_ZONE), protocol.ZONES)
+        self.instance_types = self._as_list(attr.get(protocol.ATTR_INSTANCE_TYPE), protocol.INSTANCE_TYPES)
+        # 是否按zone或instance_type进行了过滤
+        self.filtered = attr.get(protocol.ATTR_ZONE) is not None or attr.get(protocol.ATTR_INSTANCE_TYPE) is not None
+
+        id_list = attr.get(protocol.ATTR_INSTANCE_ID_LIST)
+        self.id_list = None if id_list is None else [self._normalize_id(_) for _ in id_list]
+        self.abnormal_only = bool(attr.get(protocol.ATTR_ABNORMAL_ONLY, False))
+
+    @staticmethod
+    def _as_list(value, default: list) -> list:
+        if value is None:
+            return list(default)
+        if isinstance(value, (list, tuple, set)):
+            return list(value)
+        return [value]
+
+    @staticmethod
+    def _normalize_id(idx):
+        # 链路的ID为(src, dst)，经过序列化后可能变为list
+        if isinstance(idx, list):
+            return tuple(idx)
+        return idx
+
+    def scopes(self) -> list:
+        """
+        返回查询涉及的所有(zone, instance_type)
+        """
+
+        return [
+            (zone, instance_type)
+            for zone in self.zones
+            for instance_type in self.instance_types
+        ]
@@ -1,15 +1,23 @@
-import datetime
 import logging
+import multiprocessing
+import os
+import queue
 import time
 from abc import ABC
 import numpy as np
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from multiprocessing import Queue, Manager
+from threading import Lock
 
-from sam.base import sfc
+from sam.base import sfc, command
 
 from netio import protocol
-from util import worker, threading
+from util import worker, threading, tracing
+from util.autoscaler import Autoscaler
+from util.clock import Clock, SystemClock
+from util.hash_ring import HashRing
+from util.logging_config import Lazy
+from util.metrics import SharedMetrics, SLOT_DISPATCHER, worker_slot
 
 
 class Dispatcher(ABC):
@@ -25,15 +33,36 @@ class Dispatcher(ABC):
             cooldown: int               =30,
             normal_window_length: int   =5,
             abnormal_window_length: int =2,
-            debug: bool                 =False
+            debug: bool                 =False,
+            storage_dir: str            =None,  # 持久化数据的目录，每个worker使用其中的一个子目录
+            instance_ttl: int           =30,    # 实例连续多少个tick没有出现后被移除，为None时不移除
+            spill_evicted: bool         =False, # 是否将worker中被移除的实例的状态写入磁盘，再次出现时恢复
+            clock: Clock                =None,  # 每批数据的时间戳来源，默认为系统时间，回放时可替换为SimulatedClock
+            metrics: SharedMetrics      =None,  # 各进程共享的运行指标，由IOHandler对外提供，为None时只用于worker的心跳
+            heartbeat_timeout: float    =30,    # worker超过该时间（秒）没有心跳时被重启，需要大于从检查点恢复的时间，为None时不监控
+            max_lag: int                =20,    # worker未处理的数据超过该批次数时被重启，为None时不因积压重启
+            min_workers: int            =None,  # 自动伸缩时的最少worker数，为None时等于num_workers
+            max_workers: int            =None,  # 自动伸缩时的最多worker数，为None时等于num_workers，大于min_workers时开启自动伸缩
+            scale_interval: float       =30,    # 自动伸缩时两次调整之间至少间隔的时间（秒）
+            migrate_timeout: float      =10     # 增减worker时等待worker交出实例、停止的时间（秒）
     ):
+        """
+        启动时运行num_workers个worker。开启自动伸缩时，按worker处理数据的时间占比在[min_workers, max_workers]之间增减worker，
+        实例按一致性哈希分配，增减worker时只迁移改变归属的实例，检测器状态随实例一起迁移
+        """
+
+        min_workers = num_workers if min_workers is None else min_workers
+        max_workers = num_workers if max_workers is None else max_workers
+        assert min_workers <= num_workers <= max_workers
         self._k = k
-        self._num_workers = num_workers
+        # 各worker的队列、Worker对象和运行指标按max_workers预先创建，正在运行的是其中的前若干个
+        self._num_workers = max_workers
         self._history_len_limit = history_len_limit
         self._cooldown = cooldown
         self._normal_window_length = normal_window_length
         self._abnormal_window_length = abnormal_window_length
         self._debug = debug
+        self._clock = clock or SystemClock()
 
         self._ex = ProcessPoolExecutor(max_workers=self._num_workers)
         self._data_queue = data_queue
@@ -41,8 +70,13 @@ class Dispatcher(ABC):
         self._cmd_queue = cmd_queue
         self._res_queue = res_queue
 
+        if metrics is None:
+            metrics = SharedMetrics(max_workers)
+        self._worker_slots = [metrics.slot(worker_slot(idx)) for idx in range(self._num_workers)]
+
         self._data_queues = [Manager().Queue() for _ in range(self._num_workers)]
         self._cmd_queues = [Manager().Queue() for _ in range(self._num_workers)]
+        self._migrate_queue = Manager().Queue()
         self._workers = [
             worker.Worker(
                 k=self._k,
@@ -55,22 +89,126 @@ class Dispatcher(ABC):
                 normal_window_length=self._normal_window_length,
                 abnormal_window_length=self._abnormal_window_length,
                 debug=self._debug,
-                name=f'w_{idx:02d}'
+                name=f'w_{idx:02d}',
+                storage_dir=None if storage_dir is None else os.path.join(storage_dir, f'w_{idx:02d}'),
+                instance_ttl=instance_ttl,
+                spill_evicted=spill_evicted,
+                metrics_slot=self._worker_slots[idx],
+                migrate_queue=self._migrate_queue
             )
             for idx in range(self._num_workers)
         ]
 
+        self._storage_dir = storage_dir
         self._instances_mapping = {}
-        self._dispatch_time_costs = []
-        self._process_time_costs = []
+        self._instances_last_seen = {}  # instance_idx -> 最后一次出现的tick序号
+        self._instance_ttl = instance_ttl
+        self._tick = 0
+        self._metrics_slot = metrics.slot(SLOT_DISPATCHER)
+        self._tracer = tracing.Tracer(self._metrics_slot)
         self._instance_count = 0
 
+        self._heartbeat_timeout = heartbeat_timeout
+        self._max_lag = max_lag
+        self._processes = [None] * self._num_workers    # 各worker的进程，在run()中启动
+        self._started = [0.0] * self._num_workers       # 各worker进程启动的时间
+        self._sent = [0] * self._num_workers            # 本次启动后发给各worker的数据批次数
+        self._down = frozenset()    # 正在重启的worker，其实例暂时由其他worker处理；只由监控线程替换
+        self._taken_over = {}       # 重启的worker -> {暂时接管的worker -> 实例}，只由数据处理线程修改
+        # 监控线程重启worker和数据处理线程增减worker时都会修改_processes、_active和_down，修改时需要持有该锁
+        self._workers_lock = Lock()
+
+        self._active = list(range(num_workers))     # 正在运行的worker，只由数据处理线程替换
+        self._ring = HashRing(self._active)
+        self._autoscaler = Autoscaler(min_workers, max_workers, scale_interval) if max_workers > min_workers else None
+        self._migration = 0     # 迁移的序号，用于丢弃超时之后才到达的迁移结果
+        self._migrate_timeout = migrate_timeout
+        self._metrics_slot.set('workers', len(self._active))
+
     def _monitor_cmd_queue(self):
         while True:
             cmd = self._cmd_queue.get()
-            for q in self._cmd_queues:
+            queues = [self._cmd_queues[idx] for idx in self._active]
+            if cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_RESET:
+                # 重置的周期号由Dispatcher统一确定，实例在worker之间迁移、从检查点恢复时可以比较
+                cmd.attributes = {**(cmd.attributes or {}), protocol.ATTR_RESET_EPOCH: time.time()}
+            if cmd.cmdType == protocol.CMD_TYPE_ABNORMAL_DETECTOR_PROFILE:
+                # 指定了worker的性能分析命令只发给该worker
+                worker_idx = (cmd.attributes or {}).get(protocol.ATTR_WORKER)
+                if worker_idx is not None:
+                    queues = [self._cmd_queues[worker_idx]]
+            for q in queues:
                 q.put_nowait(cmd)
 
+    def _split(self, data: dict, down: frozenset=frozenset()) -> list:
+        """
+        将IOHandler发来的一批数据按实例分配给各个worker，返回每个worker的一批数据（格式见Worker的data_queue）；
+        down为本批数据分发时正在重启的worker，与分发时使用的是同一个集合
+        """
+
+        self._tick += 1
+        # 回放的数据中带有记录时的时间戳
+        timestamp = data.get(protocol.ATTR_TIMESTAMP)
+        if timestamp is None:
+            timestamp = self._clock.now()
+
+        alive = [_ for _ in self._active if _ not in down] if down else None
+        data_queues_buffer = [[] for _ in range(self._num_workers)]
+        for instance_type in protocol.INSTANCE_TYPES:
+            if instance_type not in data:
+                continue
+            instance_dict = data[instance_type]
+            for zone in instance_dict.keys():
+                zone_dict = instance_dict[zone]
+                for idx, d in zone_dict.items():
+                    instance_idx = (zone, instance_type, idx)
+
+                    if instance_idx not in self._instances_mapping:
+                        # 按实例ID的一致性哈希分配，重启后同一实例仍由持有其检查点的worker处理
+                        self._instances_mapping[instance_idx] = self._ring.owner(instance_idx)
+                    self._instances_last_seen[instance_idx] = self._tick
+
+                    obj = None
+                    if type(d) == sfc.SFCI:
+                        obj = d
+                        active = True
+                    else:
+                        active = d[protocol.ATTR_ACTIVE]
+                        if instance_type == protocol.INSTANCE_TYPE_SWITCH:
+                            obj = d[protocol.ATTR_SWITCH]
+                        elif instance_type == protocol.INSTANCE_TYPE_SERVER:
+                            obj = d[protocol.ATTR_SERVER]
+                        elif instance_type == protocol.INSTANCE_TYPE_LINK:
+                            obj = d[protocol.ATTR_LINK]
+                        elif instance_type == protocol.INSTANCE_TYPE_VNFI:
+                            obj = d[protocol.ATTR_VNFI]
+
+                    dispatch_data = {
+                        protocol.ATTR_INSTANCE_TYPE: instance_type,
+                        protocol.ATTR_ZONE: zone,
+                        protocol.ATTR_ACTIVE: active,
+                        protocol.ATTR_VALUE: obj,
+                        protocol.ATTR_ID: idx
+                    }
+                    worker_idx = self._instances_mapping[instance_idx]
+                    if alive and worker_idx in down:
+                        # 该worker正在重启，由其他worker暂时接管，恢复后删除接管的worker中的副本
+                        owner, worker_idx = worker_idx, alive[hash(instance_idx) % len(alive)]
+                        self._taken_over.setdefault(owner, {}).setdefault(worker_idx, set()).add(instance_idx)
+                    data_queues_buffer[worker_idx].append(dispatch_data)
+                    self._instance_count += 1
+
+        if self._instance_ttl is not None and self._tick % self._instance_ttl == 0:
+            self._evict_mapping()
+
+        # 每批数据只带一个时间戳，worker中的所有逻辑都使用这个时间戳
+        return [
+            {
+                protocol.ATTR_TIMESTAMP: timestamp,
+                protocol.ATTR_VALUE: buffer
+            } for buffer in data_queues_buffer
+        ]
+
     def _monitor_data_queue(self):
         def func_dispatch_data(queue: Queue, _: dict):
             queue.put_nowait(_)
@@ -78,71 +216,166 @@ class Dispatcher(ABC):
 
         while True:
             data = self._data_queue.get()
-            t0 = time.time()
-            timestamp = datetime.datetime.now().timestamp()
-
-            data_queues_buffer = [[] for _ in range(self._num_workers)]
-            for instance_type in protocol.INSTANCE_TYPES:
-                if instance_type not in data:
-                    continue
-                instance_dict = data[instance_type]
-                for zone in instance_dict.keys():
-                    zone_dict = instance_dict[zone]
-                    for idx, d in zone_dict.items():
-                        instance_idx = (zone, instance_type, idx)
-
-                        if instance_idx not in self._instances_mapping:
-                            self._instances_mapping[instance_idx] = np.random.randint(0, self._num_workers)
-
-                        obj = None
-                        if type(d) == sfc.SFCI:
-                            obj = d
-                            active = True
-                        else:
-                            active = d[protocol.ATTR_ACTIVE]
-                            if instance_type == protocol.INSTANCE_TYPE_SWITCH:
-                                obj = d[protocol.ATTR_SWITCH]
-                            elif instance_type == protocol.INSTANCE_TYPE_SERVER:
-                                obj = d[protocol.ATTR_SERVER]
-                            elif instance_type == protocol.INSTANCE_TYPE_LINK:
-                                obj = d[protocol.ATTR_LINK]
-                            elif instance_type == protocol.INSTANCE_TYPE_VNFI:
-                                obj = d[protocol.ATTR_VNFI]
-
-                        dispatch_data = {
-                            protocol.ATTR_TIMESTAMP: timestamp,
-                            protocol.ATTR_INSTANCE_TYPE: instance_type,
-                            protocol.ATTR_ZONE: zone,
-                            protocol.ATTR_ACTIVE: active,
-                            protocol.ATTR_VALUE: obj,
-                            protocol.ATTR_ID: idx
-                        }
-                        data_queues_buffer[self._instances_mapping[instance_idx]].append(dispatch_data)
-                        self._instance_count += 1
-
-            t1 = time.time()
+            t0 = tracing.now()
+            trace = data.pop(protocol.ATTR_TRACE, None)
+            down = self._down
+            batches = self._split(data, down)
+            t1 = tracing.now()
+            if trace is not None:
+                self._tracer.record(tracing.STAGE_DATA_QUEUE, t0 - trace[2])
+                for batch in batches:
+                    batch[protocol.ATTR_TRACE] = (trace[0], trace[1], t1)
 
             with ThreadPoolExecutor(max_workers=self._num_workers) as pool:
-                for worker_idx in range(self._num_workers):
-                    pool.submit(func_dispatch_data, self._data_queues[worker_idx], data_queues_buffer[worker_idx])
+                for worker_idx in self._active:
+                    if worker_idx in down:
+                        continue
+                    self._sent[worker_idx] += 1
+                    pool.submit(func_dispatch_data, self._data_queues[worker_idx], batches[worker_idx])
                 pool.shutdown(wait=True)
 
-            t2 = time.time()
-            self._process_time_costs.append(t1 - t0)
-            self._dispatch_time_costs.append(t2 - t1)
+            t2 = tracing.now()
+            self._tracer.record(tracing.STAGE_DISPATCH, t1 - t0)
+            self._tracer.record(tracing.STAGE_FANOUT, t2 - t1)
+            self._metrics_slot.set('ticks', self._tick)
+            self._metrics_slot.set('instances', self._instance_count)
+            self._metrics_slot.set('live_instances', len(self._instances_mapping))
+            self._metrics_slot.set('queue_depth', self._data_queue.qsize())
+            self._metrics_slot.set('heartbeat', t2)
+            for idx in [_ for _ in self._taken_over if _ not in self._down]:
+                self._drop_taken_over(idx)
+            if self._autoscaler is not None and not self._down:
+                self._autoscale()
 
-    def _print_desc(self):
-        def avg(l: list) -> float:
-            if len(l) == 0:
-                return 0
-            if len(l) < 5:
-                return float(np.mean(l))
-            return float(np.mean(l[-5:]))
+    def _drop_taken_over(self, idx: int):
+        """
+        worker恢复后，其实例的数据重新发给它，它从检查点恢复了这些实例的检测器状态；
+        通知重启期间暂时接管的worker删除这些实例的副本，避免副本一直占用内存、写入检查点并重复报警
+        """
+
+        taken_over = self._taken_over[idx]
+        for worker_idx in list(taken_over):
+            if worker_idx in self._down:
+                # 接管的worker也在重启，重启时会丢弃积压的命令，等它恢复后再删除
+                continue
+            keys = taken_over.pop(worker_idx)
+            if worker_idx in self._active:
+                self._data_queues[worker_idx].put_nowait({protocol.ATTR_DROP: list(keys)})
+            logging.info('Dispatcher 通知worker w_%02d 删除%d个暂时接管w_%02d的实例副本', worker_idx, len(keys), idx)
+        if not taken_over:
+            del self._taken_over[idx]
+
+    def _autoscale(self):
+        """
+        按各worker累计的处理时间（共享运行指标中的直方图）判断是否需要增减worker，在数据处理线程中两批数据之间调用
+        """
+
+        busy = {idx: self._worker_slots[idx].histogram(tracing.STAGE_WORKER).total for idx in self._active}
+        target = self._autoscaler.decide(tracing.now(), busy)
+        if target == len(self._active):
+            return
+
+        logging.warning('Worker 最高时间占比%.2f，worker数 %d -> %d',
+                        self._autoscaler.utilization, len(self._active), target)
+        if target > len(self._active):
+            self._add_worker()
+        else:
+            self._remove_worker()
+        self._metrics_slot.set('workers', len(self._active))
+
+    def _add_worker(self):
+        with self._workers_lock:
+            idx = min(set(range(self._num_workers)) - set(self._active))
+            self._sent[idx] = 0
+            self._worker_slots[idx].set('ticks', 0)
+            self._start_worker(idx)
+            self._ring.add(idx)
+            self._active = sorted(self._active + [idx])
+        self._rebalance()
+
+    def _remove_worker(self):
+        with self._workers_lock:
+            # 移出_active之后监控线程不再检查和重启它
+            idx = max(self._active)
+            self._ring.remove(idx)
+            self._active = [_ for _ in self._active if _ != idx]
+        self._rebalance()
+        # 停止命令在交出实例的命令之后处理，worker保存状态后自行退出；之后不会再有发给它的数据和命令
+        self._data_queues[idx].put_nowait({protocol.ATTR_STOP: True})
+        with self._workers_lock:
+            process, self._processes[idx] = self._processes[idx], None
+        process.join(timeout=self._migrate_timeout)
+        if process.is_alive():
+            logging.error('Worker w_%02d 超过%g秒没有停止，强制结束', idx, self._migrate_timeout)
+            process.kill()
+            process.join()
+
+    def _rebalance(self):
+        """
+        按一致性哈希重新分配实例，通知原来的worker交出改变归属的实例，收集其检测器状态后交给新的worker。
+        迁移命令与数据在同一个队列中按顺序处理，迁移期间到达新worker的数据会新建实例，收到迁移的状态后被替换。
+        最多等待migrate_timeout秒（期间不分发数据），超时没有交出的实例仍归新的worker，由其作为新实例重新积累检测器状态，
+        之后才到达的迁移结果按序号丢弃
+        """
 
+        moves = {}  # 原来的worker -> 改变归属的实例
+        for instance_idx, worker_idx in self._instances_mapping.items():
+            owner = self._ring.owner(instance_idx)
+            if owner != worker_idx:
+                moves.setdefault(worker_idx, []).append(instance_idx)
+                self._instances_mapping[instance_idx] = owner
+        if not moves:
+            return
+
+        self._migration += 1
+        for worker_idx, keys in moves.items():
+            self._data_queues[worker_idx].put_nowait({
+                protocol.ATTR_MIGRATE_OUT: keys,
+                protocol.ATTR_ID: self._migration
+            })
+
+        incoming = {}   # 新的worker -> 迁入的实例状态
+        pending = len(moves)
+        deadline = tracing.now() + self._migrate_timeout
+        while pending > 0:
+            try:
+                migration, entries = self._migrate_queue.get(timeout=max(deadline - tracing.now(), 0))
+            except queue.Empty:
+                lost = sum(len(keys) for keys in moves.values()) - sum(len(_) for _ in incoming.values())
+                logging.error('Dispatcher %g秒内有%d个worker没有交出实例，最多%d个实例的检测器状态将在新的worker中重新积累',
+                              self._migrate_timeout, pending, lost)
+                break
+            if migration != self._migration:
+                continue
+            pending -= 1
+            for entry in entries:
+                incoming.setdefault(self._instances_mapping.get(entry[0]), []).append(entry)
+
+        for worker_idx, entries in incoming.items():
+            if worker_idx is None:
+                # 迁移期间已经过期的实例
+                continue
+            self._data_queues[worker_idx].put_nowait({protocol.ATTR_MIGRATE_IN: entries})
+        logging.info('Dispatcher 迁移了%d个实例', sum(len(keys) for keys in moves.values()))
+
+    def _evict_mapping(self):
+        """
+        移除连续超过instance_ttl个tick没有出现的实例的映射
+        """
+
+        expired = [
+            instance_idx for instance_idx, tick in self._instances_last_seen.items()
+            if tick < self._tick - self._instance_ttl
+        ]
+        for instance_idx in expired:
+            del self._instances_last_seen[instance_idx]
+            del self._instances_mapping[instance_idx]
+
+    def _print_desc(self):
         while True:
             sizes = list()
-            for dq in self._data_queues:
-                sizes.append(dq.qsize())
+            for idx in self._active:
+                sizes.append(self._data_queues[idx].qsize())
             avg_size = np.mean(sizes)
 
             if avg_size > 0:
@@ -150,21 +383,105 @@ class Dispatcher(ABC):
             if self._data_queue.qsize() > 0:
                 logging.info(f'输入数据队列长度: {self._data_queue.qsize()}')
 
-            avg_dispatch_time = avg(self._dispatch_time_costs)
-            avg_process_time = avg(self._process_time_costs)
-            logging.info(f'处理: {avg_process_time:.2f}\t'
-                         f'分发: {avg_dispatch_time:.2f}\t'
-                         f'已处理: {self._instance_count}')
+            if self._down:
+                logging.warning('正在重启的worker: %s', sorted(self._down))
+            logging.info('各阶段延迟(p50/p99)\t%s\t已处理: %d', Lazy(self._tracer.format), self._instance_count)
 
             time.sleep(20)
 
+    def _start_worker(self, idx: int):
+        # self._workers中的对象在本进程中从未运行过，每次启动的都是新的worker，由其从检查点恢复状态
+        process = multiprocessing.Process(target=self._workers[idx].run, name=f'w_{idx:02d}', daemon=True)
+        self._started[idx] = tracing.now()
+        process.start()
+        self._processes[idx] = process
+
+    def _restart_worker(self, idx: int, reason: str):
+        """
+        重启失去响应或落后太多的worker：其实例暂时交给其他worker处理，丢弃积压的数据，新的进程从检查点恢复状态。
+        需要持有_workers_lock，且idx仍在_active中
+        """
+
+        logging.error('Worker w_%02d %s，正在重启', idx, reason)
+        if self._storage_dir is None:
+            logging.warning('Worker w_%02d 没有指定storage_dir，重启后没有检查点，所有实例需要重新积累检测器状态', idx)
+        self._down = self._down | {idx}
+        process = self._processes[idx]
+        if process.is_alive():
+            process.kill()
+        process.join(timeout=10)
+
+        dropped = 0
+        while True:
+            try:
+                self._data_queues[idx].get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+        if dropped > 0:
+            logging.warning('Worker w_%02d 丢弃了%d批积压的数据', idx, dropped)
+            self._metrics_slot.inc('ticks_dropped', dropped)
+
+        self._sent[idx] = 0
+        self._worker_slots[idx].set('ticks', 0)
+        self._start_worker(idx)
+
+    def _check_worker(self, idx: int, now: float) -> str:
+        """
+        返回worker需要重启的原因，正常时返回None
+        """
+
+        process = self._processes[idx]
+        if process is None:
+            # 已经减少的worker
+            return None
+        slot = self._worker_slots[idx]
+        # 新进程在恢复完成之前还没有心跳，从启动时开始计时
+        heartbeat = max(slot.get('heartbeat'), self._started[idx])
+        lag = self._sent[idx] - slot.get('ticks')
+        if not process.is_alive():
+            return '进程已退出'
+        if now - heartbeat > self._heartbeat_timeout:
+            return f'超过{now - heartbeat:.0f}秒没有心跳'
+        if self._max_lag is not None and lag > self._max_lag:
+            return f'有{lag:.0f}批数据没有处理'
+        return None
+
+    def _supervise(self):
+        """
+        监控各worker的心跳和处理进度（记录在共享内存中），重启失去响应或落后太多的worker，
+        重启的worker产生心跳后把实例交还给它
+        [阻塞方法]
+        """
+
+        while True:
+            time.sleep(1)
+            now = tracing.now()
+            for idx in self._active:
+                with self._workers_lock:
+                    if idx not in self._active:
+                        # 检查期间已经被减少的worker
+                        continue
+                    reason = self._check_worker(idx, now)
+                    if reason is not None:
+                        self._restart_worker(idx, reason)
+                    elif idx in self._down and self._worker_slots[idx].get('heartbeat') > self._started[idx]:
+                        self._down = self._down - {idx}
+                        logging.warning('Worker w_%02d 已恢复', idx)
+
     def run(self):
         logging.info('Dispatcher 开始运行...')
+        for idx in self._active:
+            self._start_worker(idx)
+
         ex = ThreadPoolExecutor(max_workers=3)
         ex.submit(self._monitor_data_queue).add_done_callback(threading.thread_done_callback)
         ex.submit(self._print_desc).add_done_callback(threading.thread_done_callback)
         ex.submit(self._monitor_cmd_queue).add_done_callback(threading.thread_done_callback)
 
-        with ProcessPoolExecutor(max_workers=self._num_workers) as pool:
-            for w in self._workers:
-                pool.submit(w.run).add_done_callback(threading.thread_done_callback)
+        if self._heartbeat_timeout is None:
+            for process in self._processes:
+                if process is not None:
+                    process.join()
+        else:
+            self._supervise()
@@ -0,0 +1,41 @@
+import bisect
+import hashlib
+import zlib
+
+
+class HashRing:
+    def __init__(self, nodes: list=(), replicas: int=128):
+        """
+        一致性哈希环：每个节点（worker序号）在环上有replicas个虚拟节点，key归属于顺时针方向的第一个虚拟节点。
+        增加或移除一个节点时只有约1/n的key改变归属，且都是移入新节点或移出被移除的节点
+        """
+
+        self._replicas = replicas
+        self._points = []   # 虚拟节点的哈希值，有序
+        self._nodes = []    # 与_points对应的节点
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key) -> int:
+        return zlib.crc32(repr(key).encode())
+
+    def add(self, node: int):
+        for i in range(self._replicas):
+            # 虚拟节点只在增删节点时计算，使用分布更均匀的哈希
+            point = int.from_bytes(hashlib.md5(f'{node}#{i}'.encode()).digest()[:4], 'little')
+            pos = bisect.bisect(self._points, point)
+            self._points.insert(pos, point)
+            self._nodes.insert(pos, node)
+
+    def remove(self, node: int):
+        kept = [(p, n) for p, n in zip(self._points, self._nodes) if n != node]
+        self._points = [p for p, _ in kept]
+        self._nodes = [n for _, n in kept]
+
+    def nodes(self) -> list:
+        return sorted(set(self._nodes))
+
+    def owner(self, key) -> int:
+        i = bisect.bisect(self._points, self._hash(key))
+        return self._nodes[i % len(self._nodes)]
@@ -1,16 +1,129 @@
+import atexit
 import logging
+import logging.handlers
 import datetime
+import multiprocessing
+import signal
+import time
 
-def logging_config():
-    def to_beijing(sec, what):
-        beijing_time = datetime.datetime.now() + datetime.timedelta(hours=8)
-        return beijing_time.timetuple()
+LOG_FORMAT = '%(asctime)s.%(msecs)03d [%(levelname)s]\t%(processName)s\t' \
+             '%(module)s:%(funcName)s():%(lineno)d\t' \
+             '%(message)s'
+DATE_FORMAT = '%H:%M:%S'
+RATE_KEY = 'rate_key'   # 通过extra={RATE_KEY: key}指定限速的key，默认按调用位置
+RATE_LIMIT = 'rate_limit'   # 通过extra={RATE_LIMIT: False}使一条日志不受限速
+RATE_SUPPRESSED = 'rate_suppressed'     # 限速的周期开始时，记录中附带的上个周期丢弃的条数
 
+
+def to_beijing(sec, what):
+    beijing_time = datetime.datetime.now() + datetime.timedelta(hours=8)
+    return beijing_time.timetuple()
+
+
+class Lazy:
+    __slots__ = ('_func', '_args')
+
+    def __init__(self, func, *args):
+        """
+        日志参数的延迟求值，只在日志确实要输出时才调用func(*args)构造字符串，
+        用法: logging.info('%s', Lazy(anomaly_report.data_format, report))
+        """
+
+        self._func = func
+        self._args = args
+
+    def __str__(self):
+        return str(self._func(*self._args))
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval: float=10, burst: int=5, level: int=logging.WARNING):
+        """
+        按key限制低于level的日志的频率：每个key每interval秒最多输出burst条，其余的丢弃，
+        下一个周期的第一条在RATE_SUPPRESSED属性中附带丢弃的条数（由RateLimitFormatter输出）。
+        key默认为调用位置(文件, 行号)，可以通过extra={RATE_KEY: key}指定；level及以上的日志和extra={RATE_LIMIT: False}的日志不限速
+        """
+
+        super().__init__()
+        self._interval = interval
+        self._burst = burst
+        self._level = level
+        self._windows = {}  # key -> [周期开始时间, 本周期的条数, 本周期丢弃的条数]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self._level or not getattr(record, RATE_LIMIT, True):
+            return True
+        key = getattr(record, RATE_KEY, None) or (record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self._interval:
+            if window is not None and window[2] > 0:
+                setattr(record, RATE_SUPPRESSED, window[2])
+            self._windows[key] = [now, 1, 0]
+            return True
+
+        window[1] += 1
+        if window[1] <= self._burst:
+            return True
+        window[2] += 1
+        return False
+
+
+class RateLimitFormatter(logging.Formatter):
+    def __init__(self, *args, interval: float=10, **kwargs):
+        """
+        在消息之后附带RateLimitFilter丢弃的条数，消息本身按原来的参数格式化
+        """
+
+        super().__init__(*args, **kwargs)
+        self._interval = interval
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = super().formatMessage(record)
+        suppressed = getattr(record, RATE_SUPPRESSED, 0)
+        if suppressed:
+            message = f'{message}\t(之前{self._interval:g}秒内省略了{suppressed}条)'
+        return message
+
+
+def _write_records(queue, level: int):
+    """
+    写日志的进程：从队列中取出各进程的日志记录，格式化后输出
+    [阻塞方法]
+    """
+
+    # Ctrl-C时由主进程通知退出，以便输出队列中剩余的日志
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     logging.Formatter.converter = to_beijing
-    logging.basicConfig(
-        format='%(asctime)s.%(msecs)03d [%(levelname)s]\t%(processName)s\t'
-               '%(module)s:%(funcName)s():%(lineno)d\t'
-               '%(message)s',
-        datefmt='%H:%M:%S',
-        level=logging.INFO
-    )
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    handler.setLevel(level)
+    while True:
+        record = queue.get()
+        if record is None:
+            break
+        handler.handle(record)
+
+
+def _stop_writer(queue, writer: multiprocessing.Process):
+    queue.put(None)
+    writer.join(timeout=5)
+
+
+def logging_config(level: int=logging.INFO, rate_interval: float=10, rate_burst: int=5):
+    """
+    所有进程的日志经QueueHandler放入同一个队列，由单独的进程格式化和输出，
+    记录日志的线程只做限速判断、拼接消息和放入队列（序列化在队列的后台线程中进行），不等待输出。
+    之后fork出的子进程（IOHandler、各个Worker）继承这一配置。
+    """
+
+    queue = multiprocessing.Queue(-1)
+    writer = multiprocessing.Process(target=_write_records, args=(queue, level), name='LogWriter', daemon=True)
+    writer.start()
+    atexit.register(_stop_writer, queue, writer)
+
+    handler = logging.handlers.QueueHandler(queue)
+    # 只拼接消息本身，其余部分在写日志的进程中格式化
+    handler.setFormatter(RateLimitFormatter('%(message)s', interval=rate_interval))
+    handler.addFilter(RateLimitFilter(rate_interval, rate_burst))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
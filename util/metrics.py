@@ -0,0 +1,176 @@
+import atexit
+import os
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from util import tracing
+
+# 计数器: 名称 -> 说明
+COUNTERS = {
+    'ticks': '处理的数据批次数（IOHandler为收到的数据消息数）',
+    'ticks_dropped': '无法处理而丢弃的数据消息数',
+    'instances': '处理的实例数',
+    'evaluations': '检测器的检测次数',
+    'alerts_abnormal': '产生的异常告警数',
+    'alerts_failure': '产生的故障告警数',
+    'queries': '收到的前端查询数',
+    'reports': '发送给regulator的报障结果数',
+}
+# 仪表: 名称 -> 说明
+GAUGES = {
+    'queue_depth': '输入队列的长度（IOHandler为告警队列）',
+    'live_instances': '当前持有的实例数',
+    'heartbeat': '最后一次更新的时间戳',
+    'workers': '正在运行的worker数（只有Dispatcher记录）',
+}
+FIELDS = list(COUNTERS) + list(GAUGES)
+FIELD_INDEX = {name: i for i, name in enumerate(FIELDS)}
+STAGE_OFFSET = {
+    stage: len(FIELDS) + i * tracing.HISTOGRAM_SIZE for i, stage in enumerate(tracing.STAGES)
+}
+ROW_SIZE = len(FIELDS) + len(tracing.STAGES) * tracing.HISTOGRAM_SIZE
+
+SLOT_IO_HANDLER = 0
+SLOT_DISPATCHER = 1
+
+
+def worker_slot(idx: int) -> int:
+    return 2 + idx
+
+
+class SharedMetrics:
+    def __init__(self, num_workers: int, path: str=None):
+        """
+        各进程共享的计数器、仪表和延迟直方图，存放在内存映射的文件中（默认在/dev/shm下）。
+        每个进程（IOHandler、Dispatcher、各个Worker）占一行，只写自己的一行，因此不需要加锁；
+        IOHandler读取所有行，汇总后以Prometheus文本格式对外提供，不需要额外的队列通信。
+        对象被传给子进程时只传递文件路径，在子进程中重新映射。
+        """
+
+        if path is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            fd, path = tempfile.mkstemp(prefix='anomaly_detector_metrics_', dir=directory)
+            os.close(fd)
+            # 由创建的进程在退出时删除，子进程不会执行atexit
+            atexit.register(os.remove, path)
+        self._path = path
+        self._num_workers = num_workers
+        self.array = np.memmap(path, dtype=np.float64, mode='w+', shape=(num_workers + 2, ROW_SIZE))
+
+    def __getstate__(self):
+        return self._path, self._num_workers
+
+    def __setstate__(self, state):
+        self._path, self._num_workers = state
+        self.array = np.memmap(self._path, dtype=np.float64, mode='r+', shape=(self._num_workers + 2, ROW_SIZE))
+
+    def processes(self) -> list:
+        return ['io_handler', 'dispatcher'] + [f'w_{idx:02d}' for idx in range(self._num_workers)]
+
+    def slot(self, index: int) -> 'MetricsSlot':
+        return MetricsSlot(self, index)
+
+    def render(self) -> str:
+        """
+        以Prometheus文本格式输出所有进程的计数器、仪表，以及按阶段汇总的延迟直方图
+        """
+
+        rows = np.array(self.array)
+        processes = self.processes()
+        lines = []
+        for fields, metric_type in ((COUNTERS, 'counter'), (GAUGES, 'gauge')):
+            for name, help_text in fields.items():
+                metric = f'anomaly_detector_{name}' + ('_total' if metric_type == 'counter' else '')
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {metric_type}')
+                column = rows[:, FIELD_INDEX[name]]
+                for process, value in zip(processes, column.tolist()):
+                    lines.append(f'{metric}{{process="{process}"}} {value:.17g}')
+
+        metric = 'anomaly_detector_stage_latency_seconds'
+        lines.append(f'# HELP {metric} 各阶段的延迟')
+        lines.append(f'# TYPE {metric} histogram')
+        for stage, offset in STAGE_OFFSET.items():
+            # 同一阶段在各个进程（如各个Worker）中的直方图相加
+            histogram = rows[:, offset:offset + tracing.HISTOGRAM_SIZE].sum(axis=0)
+            cumsum = np.cumsum(histogram[:-1])
+            if cumsum[-1] == 0:
+                continue
+            for le, count in zip(tracing.BUCKETS, cumsum.tolist()):
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{le:.6g}"}} {count:.0f}')
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {cumsum[-1]:.0f}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram[-1]:.17g}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {cumsum[-1]:.0f}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsSlot:
+    def __init__(self, metrics: SharedMetrics, index: int):
+        """
+        SharedMetrics中一个进程的那一行
+        """
+
+        self._metrics = metrics
+        self._index = index
+        self._row = None
+
+    def __getstate__(self):
+        return self._metrics, self._index
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @property
+    def row(self) -> np.ndarray:
+        if self._row is None:
+            self._row = self._metrics.array[self._index]
+        return self._row
+
+    def set(self, name: str, value: float):
+        self.row[FIELD_INDEX[name]] = value
+
+    def inc(self, name: str, value: float=1):
+        self.row[FIELD_INDEX[name]] += value
+
+    def get(self, name: str) -> float:
+        return float(self.row[FIELD_INDEX[name]])
+
+    def histogram(self, stage: str) -> tracing.Histogram:
+        offset = STAGE_OFFSET[stage]
+        return tracing.Histogram(self.row[offset:offset + tracing.HISTOGRAM_SIZE])
+
+
+class MetricsServer:
+    def __init__(self, metrics: SharedMetrics, host: str, port: int, before_render=None):
+        """
+        在host:port/metrics提供SharedMetrics的内容，每次请求前调用before_render()更新只在请求时计算的仪表
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                if before_render is not None:
+                    before_render()
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 不记录每次请求
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
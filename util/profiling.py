@@ -0,0 +1,163 @@
+import cProfile
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+from abc import ABC, abstractmethod
+
+from netio import protocol
+
+
+class Profile(ABC):
+    MODE = None
+    SUFFIX = None
+
+    def __init__(self, name: str, seconds: float, top: int=20, directory: str=None):
+        """
+        一次性能分析：start()之后持续seconds秒（按实际时间计算），finish()把结果写入directory下的文件，并返回前top条的摘要。
+        只能记录一个线程的分析（如cProfile）需要由该线程调用attach()。没有进行性能分析时不产生任何开销
+        """
+
+        self._seconds = seconds
+        self._top = top
+        self._deadline = None
+
+        directory = directory or tempfile.gettempdir()
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{name}_{self.MODE}_{time.strftime("%Y%m%d_%H%M%S")}{self.SUFFIX}')
+
+    def start(self):
+        self._start()
+        self._deadline = time.time() + self._seconds
+
+    def attach(self):
+        pass
+
+    def remaining(self) -> float:
+        return max(self._deadline - time.time(), 0)
+
+    def expired(self) -> bool:
+        return time.time() >= self._deadline
+
+    def finish(self) -> dict:
+        summary = self._finish()
+        summary[protocol.ATTR_FILE] = self.path
+        return summary
+
+    @abstractmethod
+    def _start(self):
+        pass
+
+    @abstractmethod
+    def _finish(self) -> dict:
+        pass
+
+
+class CpuProfile(Profile):
+    MODE = protocol.PROFILE_MODE_CPU
+    SUFFIX = '.prof'
+
+    def __init__(self, *args, **kwargs):
+        """
+        cProfile只记录调用attach()的线程，finish()也需要由该线程调用，结果文件可以用pstats或snakeviz查看
+        """
+
+        super().__init__(*args, **kwargs)
+        self._profiler = None
+        self._attached = False
+
+    def _start(self):
+        self._profiler = cProfile.Profile()
+
+    def attach(self):
+        if not self._attached:
+            self._attached = True
+            self._profiler.enable()
+
+    def _finish(self) -> dict:
+        self._profiler.disable()
+        self._profiler.dump_stats(self.path)
+        stats = pstats.Stats(self._profiler)
+        self._profiler = None
+
+        def top(key: int) -> list:
+            items = sorted(stats.stats.items(), key=lambda _: _[1][key], reverse=True)[:self._top]
+            return [
+                {
+                    'function': pstats.func_std_string(func),
+                    'calls': nc,
+                    'tottime': tt,
+                    'cumtime': ct,
+                } for func, (cc, nc, tt, ct, callers) in items
+            ]
+
+        return {
+            'total_seconds': stats.total_tt,
+            'calls': stats.total_calls,
+            'tottime': top(2),     # 函数本身耗时最多的
+            'cumtime': top(3),     # 包括调用的函数在内耗时最多的
+        }
+
+
+class MemoryProfile(Profile):
+    MODE = protocol.PROFILE_MODE_MEMORY
+    SUFFIX = '.snapshot'
+
+    def __init__(self, *args, frames: int=5, **kwargs):
+        """
+        tracemalloc只记录start()之后的内存分配，因此快照中是这段时间内分配且仍未释放的内存，用于查找内存增长的来源。
+        结果文件可以用tracemalloc.Snapshot.load()读取
+        """
+
+        super().__init__(*args, **kwargs)
+        self._frames = frames
+        self._started = False
+
+    def _start(self):
+        # 已经通过PYTHONTRACEMALLOC等方式开启时，结束后不关闭
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start(self._frames)
+
+    def _finish(self) -> dict:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        snapshot.dump(self.path)
+
+        return {
+            'current_bytes': current,
+            'peak_bytes': peak,
+            'allocations': [
+                {
+                    'location': str(stat.traceback),
+                    'size': stat.size,
+                    'count': stat.count,
+                } for stat in snapshot.statistics('lineno')[:self._top]
+            ],
+        }
+
+
+PROFILES = {
+    protocol.PROFILE_MODE_CPU: CpuProfile,
+    protocol.PROFILE_MODE_MEMORY: MemoryProfile,
+}
+
+
+def new_profile(attr: dict, name: str, directory: str=None) -> Profile:
+    """
+    按性能分析命令的参数创建Profile，directory为命令中没有指定目录时使用的目录
+    """
+
+    mode = attr.get(protocol.ATTR_PROFILE_MODE, protocol.PROFILE_MODE_CPU)
+    if mode not in PROFILES:
+        raise ValueError(f'未知的性能分析类型: {mode}')
+    return PROFILES[mode](
+        name,
+        seconds=float(attr.get(protocol.ATTR_PROFILE_SECONDS, 30)),
+        top=int(attr.get(protocol.ATTR_PROFILE_TOP, 20)),
+        directory=attr.get(protocol.ATTR_PROFILE_DIR) or directory
+    )
@@ -0,0 +1,51 @@
+from util.dashboard_query import DashboardQuery
+
+
+class ResetEpochs:
+    def __init__(self):
+        """
+        k-sigma算法重置的周期。
+        每次重置只在对应的范围（全部、某个zone和实例类型、某个实例）记录一个新的周期号，代价与实例数量无关；
+        周期号为Dispatcher收到重置命令的时间，各worker之间和重启前后都可以比较，实例当前所属的周期为各个范围中最大的周期号，
+        TimeSeries在加入新的值时发现周期变化，才丢弃之前的数据。
+        """
+
+        self._global = 0
+        self._scopes = {}   # (zone, instance_type) -> 周期号
+        self._ids = {}      # (zone, instance_type, idx) -> 周期号
+        self.version = 0    # reset()的次数，用于判断两次读取之间是否收到了新的重置命令
+
+    def reset(self, query: DashboardQuery, epoch: float, owned=None):
+        """
+        按照查询参数中的zone、instance_type和instance_id_list确定重置的范围，均未指定时重置全部实例。
+        指定实例时只记录owned(key)为True的实例（本worker持有的），其余实例的周期号由持有它们的worker记录
+        """
+
+        if query.id_list is not None:
+            for zone, instance_type in query.scopes():
+                for idx in query.id_list:
+                    key = (zone, instance_type, idx)
+                    if owned is None or owned(key):
+                        self._ids[key] = max(self._ids.get(key, 0), epoch)
+        elif query.filtered:
+            for scope in query.scopes():
+                self._scopes[scope] = max(self._scopes.get(scope, 0), epoch)
+        else:
+            self._global = max(self._global, epoch)
+        self.version += 1
+
+    def forget(self, keys: list):
+        """
+        移除已经不在本worker中的实例(zone, instance_type, idx)的周期号，使记录的实例数不随出现过的实例增长。
+        被移除或迁移出的实例的状态中已经带有其所属的周期，不需要这里的周期号
+        """
+
+        for key in keys:
+            self._ids.pop(key, None)
+
+    def current(self, zone: str, instance_type: str, idx) -> float:
+        return max(
+            self._global,
+            self._scopes.get((zone, instance_type), 0),
+            self._ids.get((zone, instance_type, idx), 0)
+        )
@@ -0,0 +1,137 @@
+import logging
+import threading
+
+from netio import protocol
+
+_MISSING = object()
+
+
+class SFCIndex:
+    def __init__(self):
+        """
+        服务器、链路到依赖它们的SFCI和VNFI的反向索引，用于在告警中附带受影响的服务。
+        SFCI依赖其各个VNFI所在的服务器，以及主转发路径上相邻节点之间的链路；VNFI依赖其所在的服务器。
+        每次收到数据时重新计算各SFCI和VNFI的依赖，只对新增、消失和依赖发生变化（如路径改变、VNFI迁移到其他服务器）的ID
+        增量修改反向索引，查询的代价只与受影响的服务数量有关。
+        """
+
+        self._lock = threading.Lock()
+        self._sfci_deps = {}        # zone -> {sfci_id: (server_ids, link_ids)}
+        self._vnfi_server = {}      # zone -> {vnfi_id: server_id}
+        self._sfci_by_server = {}   # zone -> {server_id: {sfci_id}}
+        self._sfci_by_link = {}     # zone -> {link_id: {sfci_id}}
+        self._vnfi_by_server = {}   # zone -> {server_id: {vnfi_id}}
+
+    @staticmethod
+    def _unwrap(d, attr: str):
+        # 数据中的SFCI可能直接是sfc.SFCI对象，也可能是{ATTR_SFCI: xxx, ATTR_ACTIVE: xxx}
+        if isinstance(d, dict):
+            return d.get(attr)
+        return d
+
+    @staticmethod
+    def _server_of(vnfi):
+        node = getattr(vnfi, 'node', None)
+        if node is None or not hasattr(node, 'getServerID'):
+            return None
+        return node.getServerID()
+
+    @classmethod
+    def _dependencies(cls, sfci) -> tuple:
+        """
+        返回SFCI依赖的(服务器ID集合, 链路ID集合)
+        """
+
+        servers = set()
+        for stage in getattr(sfci, 'vnfiSequence', None) or []:
+            for vnfi in stage if isinstance(stage, (list, tuple)) else [stage]:
+                server_id = cls._server_of(vnfi)
+                if server_id is not None:
+                    servers.add(server_id)
+
+        links = set()
+        path_set = getattr(sfci, 'forwardingPathSet', None)
+        primary = getattr(path_set, 'primaryForwardingPath', None) or {}
+        for path in primary.values():
+            for segment in path:
+                # 路径中的节点可能为(stage, node_id)或node_id
+                nodes = [_[-1] if isinstance(_, (list, tuple)) else _ for _ in segment]
+                links.update(zip(nodes[:-1], nodes[1:]))
+        return servers, links
+
+    @staticmethod
+    def _discard(index: dict, keys, value):
+        for key in keys:
+            values = index.get(key)
+            if values is not None:
+                values.discard(value)
+                if not values:
+                    del index[key]
+
+    def update(self, zone: str, sfcis: dict, vnfis: dict):
+        """
+        用最新收到的SFCI和VNFI更新索引，只修改新增、消失和依赖发生变化的ID
+        """
+
+        sfci_deps = self._sfci_deps.setdefault(zone, {})
+        vnfi_server = self._vnfi_server.setdefault(zone, {})
+        new_deps = {
+            sfci_id: self._dependencies(self._unwrap(d, protocol.ATTR_SFCI)) for sfci_id, d in sfcis.items()
+        }
+        new_server = {
+            vnfi_id: self._server_of(self._unwrap(d, protocol.ATTR_VNFI)) for vnfi_id, d in vnfis.items()
+        }
+        changed_sfcis = [
+            sfci_id for sfci_id in sfci_deps.keys() | new_deps.keys()
+            if sfci_deps.get(sfci_id) != new_deps.get(sfci_id)
+        ]
+        # 服务器ID可能为None，用_MISSING表示没有该VNFI
+        changed_vnfis = [
+            vnfi_id for vnfi_id in vnfi_server.keys() | new_server.keys()
+            if vnfi_server.get(vnfi_id, _MISSING) != new_server.get(vnfi_id, _MISSING)
+        ]
+        if not changed_sfcis and not changed_vnfis:
+            return
+
+        with self._lock:
+            by_server = self._sfci_by_server.setdefault(zone, {})
+            by_link = self._sfci_by_link.setdefault(zone, {})
+            vnfi_by_server = self._vnfi_by_server.setdefault(zone, {})
+
+            for sfci_id in changed_sfcis:
+                if sfci_id in sfci_deps:
+                    servers, links = sfci_deps.pop(sfci_id)
+                    self._discard(by_server, servers, sfci_id)
+                    self._discard(by_link, links, sfci_id)
+                if sfci_id in new_deps:
+                    servers, links = sfci_deps[sfci_id] = new_deps[sfci_id]
+                    for server_id in servers:
+                        by_server.setdefault(server_id, set()).add(sfci_id)
+                    for link_id in links:
+                        by_link.setdefault(link_id, set()).add(sfci_id)
+
+            for vnfi_id in changed_vnfis:
+                if vnfi_id in vnfi_server:
+                    self._discard(vnfi_by_server, [vnfi_server.pop(vnfi_id)], vnfi_id)
+                if vnfi_id in new_server:
+                    server_id = vnfi_server[vnfi_id] = new_server[vnfi_id]
+                    vnfi_by_server.setdefault(server_id, set()).add(vnfi_id)
+
+        logging.info('%s SFC依赖索引已更新: %d个SFCI, %d个VNFI', zone, len(sfci_deps), len(vnfi_server))
+
+    def affected(self, zone: str, server_ids, link_ids) -> tuple:
+        """
+        返回依赖这些服务器和链路的(SFCI ID集合, VNFI ID集合)
+        """
+
+        sfci_ids, vnfi_ids = set(), set()
+        with self._lock:
+            by_server = self._sfci_by_server.get(zone, {})
+            by_link = self._sfci_by_link.get(zone, {})
+            vnfi_by_server = self._vnfi_by_server.get(zone, {})
+            for server_id in server_ids:
+                sfci_ids.update(by_server.get(server_id, ()))
+                vnfi_ids.update(vnfi_by_server.get(server_id, ()))
+            for link_id in link_ids:
+                sfci_ids.update(by_link.get(link_id, ()))
+        return sfci_ids, vnfi_ids
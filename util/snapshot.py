@@ -0,0 +1,59 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+import numpy as np
+
+from model import InstanceRegistry
+
+# 一个(zone, instance_type)下的全部实例，发布之后不再修改
+# ids: 实例ID；positions: {idx: 在ids中的下标}；
+# abnormal_state, failure_state, last_failure, history_row: 与ids一一对应的状态数组（从InstanceRegistry复制）；
+# abnormal, failure: 处于异常、故障状态的ID集合
+Block = namedtuple('Block', [
+    'ids', 'positions',
+    'abnormal_state', 'failure_state', 'last_failure', 'history_row',
+    'abnormal', 'failure'
+])
+
+
+# tick: 快照对应的数据时间戳；blocks: {(zone, instance_type): Block}
+Snapshot = namedtuple('Snapshot', ['tick', 'blocks'])
+
+EMPTY_BLOCK = Block(
+    (), MappingProxyType({}),
+    np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64),
+    frozenset(), frozenset()
+)
+EMPTY_SNAPSHOT = Snapshot(None, MappingProxyType({}))
+
+
+def build_block(registry: InstanceRegistry, zone: str, instance_type: str) -> Block:
+    """
+    由数据处理线程持有的InstanceRegistry构造只读的Block，状态数组按行号一次性复制
+    """
+
+    scope = registry.scope(zone, instance_type)
+    if not scope:
+        return EMPTY_BLOCK
+    ids = tuple(scope.keys())
+    rows = np.fromiter(scope.values(), dtype=np.int64, count=len(ids))
+    return Block(
+        ids,
+        MappingProxyType(dict(zip(ids, range(len(ids))))),
+        registry.abnormal_state[rows],
+        registry.failure_state[rows],
+        registry.last_failure[rows],
+        registry.history_row[rows],
+        frozenset(registry.abnormal_ids(zone, instance_type)),
+        frozenset(registry.failure_ids(zone, instance_type)),
+    )
+
+
+def publish(old: Snapshot, tick: float, blocks: dict) -> Snapshot:
+    """
+    用新构造的blocks替换old中对应的部分，其余的Block直接复用
+    """
+
+    merged = dict(old.blocks)
+    merged.update(blocks)
+    return Snapshot(tick, MappingProxyType(merged))
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class StateReply:
+    def __init__(self):
+        """
+        Worker发回IOHandler的实例状态查询结果的紧凑编码。
+        每个(zone, instance_type)对应一个排好序的ID数组，以及用np.packbits压缩的异常/故障位图，
+        避免为每个实例序列化一个dict。IOHandler只在格式化最终结果时才解码。
+        """
+
+        self._blocks = {}   # (zone, instance_type) -> [(ids, abnormal_bits, failure_bits)]
+
+    @staticmethod
+    def _encode_ids(ids: list) -> np.ndarray:
+        """
+        整数ID编码为一维整数数组，链路ID (src, dst)编码为n*2的整数数组，其他类型的ID保持原样
+        """
+
+        try:
+            array = np.asarray(ids)
+        except ValueError:
+            array = None
+        if array is None or array.dtype.kind not in 'iuU' or array.ndim > 2:
+            array = np.empty(len(ids), dtype=object)
+            array[:] = ids
+        return array
+
+    @staticmethod
+    def _sort_order(ids: np.ndarray) -> np.ndarray:
+        if ids.ndim == 2:
+            return np.lexsort(ids.T[::-1])
+        try:
+            return np.argsort(ids, kind='stable')
+        except TypeError:   # 无法比较大小的ID不排序
+            return np.arange(len(ids))
+
+    def add_block(self, zone: str, instance_type: str, ids: list, abnormal: list, failure: list):
+        if len(ids) == 0:
+            return
+
+        ids = self._encode_ids(ids)
+        order = self._sort_order(ids)
+        self._blocks.setdefault((zone, instance_type), []).append((
+            ids[order],
+            np.packbits(np.asarray(abnormal, dtype=bool)[order]),
+            np.packbits(np.asarray(failure, dtype=bool)[order]),
+        ))
+
+    def merge(self, other: 'StateReply'):
+        """
+        合并另一个Worker的结果，只合并数组的引用，不解码
+        """
+
+        for key, blocks in other._blocks.items():
+            self._blocks.setdefault(key, []).extend(blocks)
+
+    def __len__(self):
+        return sum(len(ids) for blocks in self._blocks.values() for ids, _, _ in blocks)
+
+    def items(self):
+        """
+        解码，依次产生(zone, instance_type, idx, abnormal, failure)
+        """
+
+        for (zone, instance_type), blocks in self._blocks.items():
+            for ids, abnormal_bits, failure_bits in blocks:
+                n = len(ids)
+                id_list = ids.tolist()
+                if ids.ndim == 2:
+                    id_list = [tuple(_) for _ in id_list]
+                abnormal = np.unpackbits(abnormal_bits, count=n).astype(bool).tolist()
+                failure = np.unpackbits(failure_bits, count=n).astype(bool).tolist()
+                for idx, a, f in zip(id_list, abnormal, failure):
+                    yield zone, instance_type, idx, a, f
@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+import numpy as np
+
+# 一个zone的拓扑，以CSR（压缩稀疏行）的形式存储每个交换机发出的链路
+# nodes: 下标 -> 交换机ID；link_src: 链路在CSR中的位置 -> 起点的下标；out_degree: 每个交换机发出的链路数；
+# link_pos: 链路ID (src, dst) -> 在CSR中的位置；link_ids: 位置 -> 链路ID
+Adjacency = namedtuple('Adjacency', ['nodes', 'indptr', 'link_src', 'out_degree', 'link_pos', 'link_ids'])
+
+
+class Topology:
+    def __init__(self, ratio: float=0.8):
+        """
+        由链路ID (src, dst)构建的各zone网络拓扑，用于合并交换机级别的告警：
+        某个交换机发出的链路中超过ratio比例异常时，报告该交换机异常，不再单独报告这些链路。
+        拓扑只在链路集合变化时重建，构建完成后整体替换引用，读取时不需要加锁。
+        """
+
+        self._ratio = ratio
+        self._links = {}        # zone -> 构建拓扑时使用的链路ID集合
+        self._adjacency = {}    # zone -> Adjacency
+
+    def update(self, zone: str, link_ids) -> bool:
+        """
+        用最新收到的链路ID更新拓扑，链路集合没有变化时不重建，返回是否重建
+        """
+
+        if self._links.get(zone) == link_ids:
+            return False
+        links = set(link_ids)
+        self._adjacency[zone] = self._build(links)
+        self._links[zone] = links
+        return True
+
+    @staticmethod
+    def _build(links: set) -> Adjacency:
+        link_ids = list(links)
+        node_index = {}
+        src = np.fromiter(
+            (node_index.setdefault(s, len(node_index)) for s, _ in link_ids),
+            dtype=np.int64, count=len(link_ids)
+        )
+        order = np.argsort(src, kind='stable')
+        link_ids = [link_ids[i] for i in order.tolist()]
+        link_src = src[order]
+
+        out_degree = np.bincount(link_src, minlength=len(node_index))
+        indptr = np.concatenate([[0], np.cumsum(out_degree)])
+        return Adjacency(
+            nodes=list(node_index.keys()),
+            indptr=indptr,
+            link_src=link_src,
+            out_degree=out_degree,
+            link_pos={link_id: pos for pos, link_id in enumerate(link_ids)},
+            link_ids=link_ids,
+        )
+
+    def aggregate(self, zone: str, abnormal_links: set) -> tuple:
+        """
+        返回(需要报告的交换机ID列表, 被合并的链路ID列表)
+        """
+
+        adjacency = self._adjacency.get(zone)
+        if adjacency is None or not abnormal_links:
+            return [], []
+
+        positions = np.fromiter(
+            (adjacency.link_pos[link_id] for link_id in abnormal_links if link_id in adjacency.link_pos),
+            dtype=np.int64
+        )
+        if len(positions) == 0:
+            return [], []
+
+        # 每个交换机发出的异常链路数
+        counts = np.bincount(adjacency.link_src[positions], minlength=len(adjacency.nodes))
+        switches = counts > (adjacency.out_degree * self._ratio).astype(np.int64)
+        if not switches.any():
+            return [], []
+
+        merged = positions[switches[adjacency.link_src[positions]]]
+        return (
+            [adjacency.nodes[i] for i in np.flatnonzero(switches).tolist()],
+            [adjacency.link_ids[pos] for pos in merged.tolist()],
+        )
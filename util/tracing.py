@@ -0,0 +1,130 @@
+import bisect
+import time
+
+import numpy as np
+
+# 数据处理的各个阶段
+STAGE_RECV = 'recv'                     # IOHandler: 收到RPC消息 -> 放入data_queue
+STAGE_DATA_QUEUE = 'data_queue'         # data_queue中的等待时间
+STAGE_DISPATCH = 'dispatch'             # Dispatcher: 按实例分配给各个worker
+STAGE_FANOUT = 'fanout'                 # Dispatcher: 放入各个worker的队列
+STAGE_WORKER_QUEUE = 'worker_queue'     # worker队列中的等待时间
+STAGE_WORKER = 'worker'                 # Worker: 处理一批数据
+STAGE_TICK = 'tick'                     # 收到RPC消息 -> worker处理完成
+STAGE_ALERT_QUEUE = 'alert_queue'       # 告警在anom_queue中的等待时间
+STAGE_REGULATOR_SEND = 'regulator_send'     # 发送报障结果
+STAGE_ALERT = 'alert'                   # 收到RPC消息 -> 报障结果发出
+
+# 前端查询的各个阶段
+STAGE_QUERY_FANOUT = 'query_fanout'     # 收到查询 -> worker开始处理
+STAGE_QUERY_WORKER = 'query_worker'     # Worker: 处理查询
+STAGE_QUERY_FANIN = 'query_fanin'       # 最后一个worker处理完成 -> IOHandler收到全部结果
+STAGE_QUERY_REPLY = 'query_reply'       # 合并结果并发送
+STAGE_QUERY = 'query'                   # 收到查询 -> 结果发出
+
+STAGES = [
+    STAGE_RECV, STAGE_DATA_QUEUE, STAGE_DISPATCH, STAGE_FANOUT, STAGE_WORKER_QUEUE, STAGE_WORKER, STAGE_TICK,
+    STAGE_ALERT_QUEUE, STAGE_REGULATOR_SEND, STAGE_ALERT,
+    STAGE_QUERY_FANOUT, STAGE_QUERY_WORKER, STAGE_QUERY_FANIN, STAGE_QUERY_REPLY, STAGE_QUERY,
+]
+
+# 直方图各个桶的上界（秒），从10us到100s按2^0.5倍增长，最后一个桶记录更大的值
+BUCKETS = [1e-5 * 2 ** (i / 2) for i in range(47)]
+# 直方图占用的数组长度：各个桶的计数和总和
+HISTOGRAM_SIZE = len(BUCKETS) + 2
+
+
+def now() -> float:
+    # 各个进程记录的时间需要能够相减
+    return time.time()
+
+
+class Histogram:
+    __slots__ = ('_buffer', 'counts')
+
+    def __init__(self, buffer: np.ndarray=None):
+        """
+        固定分桶的延迟直方图，记录一个值只需要一次二分查找和一次计数。
+        buffer为长度HISTOGRAM_SIZE的float64数组，依次为各个桶的计数和总和；传入共享内存中的数组时，其他进程可以直接读取
+        """
+
+        self._buffer = np.zeros(HISTOGRAM_SIZE) if buffer is None else buffer
+        self.counts = self._buffer[:-1]
+
+    def __getstate__(self):
+        return np.array(self._buffer)
+
+    def __setstate__(self, buffer):
+        self.__init__(buffer)
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self._buffer[-1] += seconds
+
+    @property
+    def total(self) -> float:
+        return float(self._buffer[-1])
+
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def percentile(self, q: float) -> float:
+        """
+        返回第q百分位所在的桶的上界（秒），没有数据时返回0
+        """
+
+        cumsum = np.cumsum(self.counts)
+        if cumsum[-1] == 0:
+            return 0.0
+        i = int(np.searchsorted(cumsum, cumsum[-1] * q / 100))
+        return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+
+
+class Tracer:
+    def __init__(self, slot=None):
+        """
+        按阶段记录延迟的直方图，每个进程一个。
+        slot为metrics.MetricsSlot时，直方图存放在共享内存中，由IOHandler汇总后对外提供
+        """
+
+        self._slot = slot
+        self._histograms = {}
+
+    def __getstate__(self):
+        # 共享内存中的直方图在子进程中重新映射
+        return self._slot, {} if self._slot is not None else self._histograms
+
+    def __setstate__(self, state):
+        self._slot, self._histograms = state
+
+    def record(self, stage: str, seconds: float):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms[stage] = \
+                Histogram() if self._slot is None else self._slot.histogram(stage)
+        histogram.record(seconds)
+
+    def histograms(self) -> dict:
+        return dict(self._histograms)
+
+    def summary(self) -> dict:
+        """
+        {stage: {count, p50, p99, mean}}，时间单位为秒
+        """
+
+        result = {}
+        for stage, histogram in self._histograms.items():
+            count = histogram.count()
+            result[stage] = {
+                'count': count,
+                'p50': histogram.percentile(50),
+                'p99': histogram.percentile(99),
+                'mean': histogram.total / count if count else 0.0,
+            }
+        return result
+
+    def format(self) -> str:
+        return '\t'.join(
+            f'{stage}: {s["p50"] * 1000:.1f}/{s["p99"] * 1000:.1f}ms'
+            for stage, s in self.summary().items()
+        )
@@ -1,21 +1,40 @@
+import os
+import queue
+import shutil
 import time
 from abc import ABC
 from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Queue
-import copy
-import datetime
+from threading import Lock
 import numpy as np
 import logging
 
 import sam.base.link
 from sam.base import messageAgent as ma, command
 
-from model import TimeSeries
+from model import TimeSeries, HistoryStore, InstanceRegistry
 from netio import protocol
-from util import threading
+from storage import Checkpoint, EventJournal, SegmentStore, SpillStore, EVENT_ABNORMAL, EVENT_FAILURE
+from util import threading, tracing
+from util.dashboard_query import DashboardQuery
+from util.reset_epochs import ResetEpochs
+from util import snapshot, profiling
+from util.state_reply import StateReply
+from util.metrics import MetricsSlot
+from util.logging_config import Lazy
 
 
 class Worker(ABC):
+    # 各指标允许的正常抖动范围
+    METRIC_JITTER = {
+        protocol.ATTR_SERVER_CPU_UTILIZATION: 10,
+        protocol.ATTR_SERVER_MEMORY_UTILIZATION: 5,
+        protocol.ATTR_LINK_SYN_RATIO: 0,
+        protocol.ATTR_LINK_DNS_RATIO: 0,
+    }
+    # 两批数据之间最多复制多少个实例的检查点状态
+    CHECKPOINT_CHUNK = 4096
+
     def __init__(
             self,
             k: float,
@@ -29,22 +48,39 @@ class Worker(ABC):
             abnormal_window_length: int,
             debug: bool,
             name: str,
+            storage_dir: str = None,  # 持久化数据的目录，为None时不记录
+            checkpoint_interval: float = 60,  # 保存检测器状态检查点的间隔（秒）
+            instance_ttl: int = 30,  # 实例连续多少个tick没有收到数据后被移除，为None时不移除
+            spill_evicted: bool = False,  # 是否将被移除的实例的状态写入磁盘，再次出现时恢复（需要storage_dir）
+            metrics_slot: MetricsSlot = None,  # 共享运行指标中本worker的一行，为None时不记录
+            heartbeat_interval: float = 1,  # 没有数据时更新心跳的间隔（秒），心跳记录在metrics_slot中，由Dispatcher监控
+            migrate_queue: Queue = None,  # worker增减时，交出的实例状态放入该队列，由Dispatcher转交给新的worker
     ):
         """
         data_queue: {
-            protocol.ATTR_TIMESTAMP: xxx,
-            protocol.ATTR_INSTANCE_TYPE: xxx,
-            protocol.ATTR_ZONE: xxx,
-            protocol.ATTR_ACTIVE: xxx,
-            protocol.ATTR_VALUE: xxx
-            protocol.ATTR_ID: xxx
+            protocol.ATTR_TIMESTAMP: xxx,   # 整批数据的时间戳，报警冷却、异常状态和状态变化日志都使用这个时间戳
+            protocol.ATTR_VALUE: [
+                {
+                    protocol.ATTR_INSTANCE_TYPE: xxx,
+                    protocol.ATTR_ZONE: xxx,
+                    protocol.ATTR_ACTIVE: xxx,
+                    protocol.ATTR_VALUE: xxx
+                    protocol.ATTR_ID: xxx
+                }
+            ]
         }
+        或者worker增减时迁移实例的命令，与数据按顺序处理:
+        {protocol.ATTR_MIGRATE_OUT: [(zone, instance_type, idx)], protocol.ATTR_ID: 迁移序号}
+        {protocol.ATTR_MIGRATE_IN: [Checkpoint.save()格式的实例状态]}
+        或者重启的worker恢复后删除暂时接管的实例副本的命令: {protocol.ATTR_DROP: [(zone, instance_type, idx)]}
+        或者worker被减少时的停止命令: {protocol.ATTR_STOP: True}
         """
 
         self._data_queue = data_queue
         self._anom_queue = anom_queue
         self._cmd_queue = cmd_queue
         self._res_queue = res_queue
+        self._migrate_queue = migrate_queue
 
         self._name = name
         self._history_len_limit = history_len_limit
@@ -53,24 +89,68 @@ class Worker(ABC):
         self._abnormal_window_length = abnormal_window_length
         self._k = k
         self._debug = debug
-        self._last_reset = datetime.datetime.now().timestamp()
-
-        self._instances = {}
+        self._epochs = ResetEpochs()
+
+        self._instances = InstanceRegistry()
+        # 实例只由数据处理线程修改；每处理完一批数据，将状态发生变化的(zone, instance_type)重新构造为只读的快照，
+        # 通过替换引用的方式发布，前端查询只读取快照
+        self._dirty = set()
+        self._snapshot = snapshot.EMPTY_SNAPSHOT
+        self._history = {           # 各类实例的指标历史数据，实例在其中的行号记录在InstanceRegistry.history_row中
+            protocol.INSTANCE_TYPE_SERVER: HistoryStore(
+                [protocol.ATTR_SERVER_CPU_UTILIZATION, protocol.ATTR_SERVER_MEMORY_UTILIZATION],
+                len_limit=history_len_limit
+            ),
+            protocol.INSTANCE_TYPE_LINK: HistoryStore(
+                [protocol.ATTR_LINK_SYN_RATIO, protocol.ATTR_LINK_DNS_RATIO],
+                len_limit=history_len_limit
+            ),
+        }
         self._link_util_thres = 0.5
         self._link_packet_num_thres = 10000
 
+        self._storage_dir = storage_dir
+        self._journal = None    # 异常/故障状态变化日志，在run()中打开
+        self._segments = None   # 各类实例的长期历史数据，在run()中打开
+        self._checkpoint = None     # 检测器状态的检查点，在run()中打开
+        self._checkpoint_lock = None    # 检查点线程和迁移实例时都会保存检查点，在run()中创建
+        self._checkpoint_due = False    # 由检查点线程设置，数据处理线程在两批数据之间复制实例状态
+        self._checkpoint_pending = None     # 数据处理线程复制好的实例状态，交给检查点线程写入，在run()中创建
+        self._checkpoint_copy = None    # 正在分批复制的检查点: (还没有复制的行号, {实例: 状态}, 开始复制时的重置次数)
+        self._checkpoint_interval = checkpoint_interval
+        self._instance_ttl = instance_ttl
+        self._spill_evicted = spill_evicted
+        self._spill = None      # 被移除的实例的状态，在run()中打开
+        self._tick = 0          # 已处理的数据批次数
+        self._metrics_slot = metrics_slot
+        self._heartbeat_interval = heartbeat_interval
+        self._tracer = tracing.Tracer(metrics_slot)
+        self._evaluations = 0   # 检测器的检测次数
+        self._trace_received = None     # 当前这批数据被IOHandler收到的时间，随告警一起发出
+        self._profile = None    # 正在进行的性能分析: (cmd_id, Profile)，由命令线程开始，数据处理线程结束
+
         self._count = 0
 
-    @staticmethod
-    def _new_instance():
-        return copy.deepcopy({
-            protocol.ATTR_HISTORY_VALUE: None,
-            protocol.ATTR_METRICS: {},
-            protocol.ATTR_ABNORMAL_STATE: 0,  # 最后一次abnormal的时间，注意即使处在报警冷却过程中，该值仍然需要更新
-            protocol.ATTR_FAILURE_STATE: False,
-            protocol.ATTR_LAST_ABNORMAL: 0,
-            protocol.ATTR_LAST_FAILURE: 0
-        })
+    # 只在运行时使用的对象，不随Worker一起pickle
+    _RUNTIME_STATE = ('_snapshot', '_checkpoint_lock', '_checkpoint_pending')
+
+    def __getstate__(self):
+        """
+        快照中的MappingProxyType不能被pickle，只记录其时间戳和包含的(zone, instance_type)，在__setstate__中由实例重新构造
+        """
+
+        state = {k: v for k, v in self.__dict__.items() if k not in self._RUNTIME_STATE}
+        state['_snapshot'] = (self._snapshot.tick, list(self._snapshot.blocks.keys()))
+        return state
+
+    def __setstate__(self, state: dict):
+        tick, scopes = state.pop('_snapshot')
+        self.__dict__.update(state)
+        self._checkpoint_lock = None
+        self._checkpoint_pending = None
+        self._snapshot = snapshot.EMPTY_SNAPSHOT
+        self._dirty = self._dirty | set(scopes)
+        self._publish_snapshot(tick)
 
     def _add_anomaly_report(
             self,
@@ -86,201 +166,731 @@ class Worker(ABC):
 
         assert zone in [ma.TURBONET_ZONE, ma.SIMULATOR_ZONE]
         assert anom_type in [protocol.ATTR_ABNORMAL, protocol.ATTR_FAILURE]
-        self._anom_queue.put((zone, anom_type, switch_id, server_id, link_id))
+        trace = None if self._trace_received is None else (self._trace_received, tracing.now())
+        if self._metrics_slot is not None:
+            self._metrics_slot.inc('alerts_abnormal' if anom_type == protocol.ATTR_ABNORMAL else 'alerts_failure')
+        self._anom_queue.put((zone, anom_type, switch_id, server_id, link_id, trace))
 
     def _new_timeseries(self, jitter: float = 0):
-        return copy.deepcopy(
-            TimeSeries(
-                normal_window_length=self._normal_window_length,
-                abnormal_window_length=self._abnormal_window_length,
-                k=self._k,
-                minimum_sigma=jitter / self._k
-            )
+        return TimeSeries(
+            normal_window_length=self._normal_window_length,
+            abnormal_window_length=self._abnormal_window_length,
+            k=self._k,
+            minimum_sigma=jitter / self._k
         )
 
-    def _reset_ksigma(self):
+    def _new_metrics(self, instance_type: str, row: int) -> dict:
+        """
+        为需要检测的实例创建各指标的TimeSeries，并分配历史数据的行
+        """
+
+        metrics = {
+            metric: self._new_timeseries(jitter=self.METRIC_JITTER[metric])
+            for metric in self._history[instance_type].metrics()
+        }
+        self._instances.metrics[row] = metrics
+        self._instances.history_row[row] = self._history[instance_type].new_row()
+        return metrics
+
+    def _set_abnormal_state(self, zone: str, instance_type: str, row: int, timestamp: int):
+        """
+        记录实例最后一次异常的时间，状态查询中一旦异常就维持这个状态
+        """
+
+        self._instances.set_abnormal(row, timestamp)
+        self._dirty.add((zone, instance_type))
+
+    def _append_history(self, instance_idx: tuple, row: int, timestamp: float, values: dict):
+        """
+        写入内存中的近期历史数据，以及磁盘上的长期历史数据
+        """
+
+        instance_type = instance_idx[1]
+        self._history[instance_type].append(int(self._instances.history_row[row]), timestamp, values)
+        if self._segments is not None:
+            self._segments[instance_type].append(timestamp, instance_idx, values)
+
+    def _record_detection(self, instance_idx: tuple, row: int, abnormal: bool, tick: float):
+        """
+        记录检测结果，检测结果发生变化时更新异常实例集合（只查询异常实例和异常记录时使用）并写入状态变化日志
+        """
+
+        self._evaluations += 1
+        if not self._instances.set_detected(row, abnormal):
+            return
+        self._dirty.add(instance_idx[:2])
+        if self._journal is not None:
+            self._journal.append(tick, instance_idx, EVENT_ABNORMAL, abnormal)
+
+    def _set_failure_state(self, instance_idx: tuple, row: int, failure: bool, tick: float):
+        """
+        更新实例的故障状态，只在状态发生变化时修改故障实例集合并写入状态变化日志
+        """
+
+        if not self._instances.set_failure(row, failure):
+            return
+        self._dirty.add(instance_idx[:2])
+        if self._journal is not None:
+            self._journal.append(tick, instance_idx, EVENT_FAILURE, failure)
+
+    def _publish_snapshot(self, tick: float):
+        """
+        重新构造状态发生变化的(zone, instance_type)，其余部分沿用上一个快照，然后替换快照的引用
+        """
+
+        blocks = {
+            (zone, instance_type): snapshot.build_block(self._instances, zone, instance_type)
+            for zone, instance_type in self._dirty
+        }
+        self._dirty = set()
+        self._snapshot = snapshot.publish(self._snapshot, tick, blocks)
+
+    def _reset_ksigma(self, attr: dict):
         """
         根据收到的重置命令，重置ksigma算法的历史数据
+        只记录新的重置周期，各实例的数据在下一次加入新的值时才丢弃，因此不需要遍历实例，也不会与数据处理线程冲突
+        """
+
+        attr = attr or {}
+        epoch = attr.get(protocol.ATTR_RESET_EPOCH) or time.time()
+        self._epochs.reset(DashboardQuery(attr), epoch, owned=self._owns)
+
+    def _owns(self, key: tuple) -> bool:
+        """
+        实例是否由本worker持有（包括被移除后写入磁盘的实例）
+        """
+
+        return self._instances.row(key) is not None or (self._spill is not None and key in self._spill)
+
+    def _save_checkpoint(self, entries: list):
+        """
+        写入检查点，entries由数据处理线程在两批数据之间复制，因此每个实例的状态都是某一批数据处理完之后的
+        """
+
+        with self._checkpoint_lock:
+            self._checkpoint.save(entries)
+        logging.debug('Worker %s 已保存检查点: %d个实例', self._name, len(entries))
+
+    def _checkpoint_entries(self, rows: np.ndarray) -> list:
+        """
+        将指定行的实例状态复制为Checkpoint.save()的格式，需要在数据处理线程中调用。
+        各指标的状态带有所属的重置周期，已经重置但还没有加入新的值的指标保存为重置后的状态
+        """
+
+        instances = self._instances
+        states = zip(
+            instances.abnormal_state[rows].tolist(),
+            instances.failure_state[rows].tolist(),
+            instances.detected_abnormal[rows].tolist(),
+            instances.last_abnormal[rows].tolist(),
+            instances.last_failure[rows].tolist(),
+        )
+        entries = []
+        for row, state in zip(rows.tolist(), states):
+            key, metrics = instances.key(row), instances.metrics[row]
+            if key is None:
+                continue
+            epoch = self._epochs.current(*key)
+            entries.append((key, state, {metric: ts.state(epoch) for metric, ts in (metrics or {}).items()}))
+        return entries
+
+    def _load_entry(self, entry: tuple) -> int:
+        """
+        按检查点中的一项新增实例并恢复其状态，返回行号。
+        状态所属的重置周期早于本worker中该实例当前所属的周期时，丢弃各指标的窗口数据
+        """
+
+        instance_idx, state, metric_states = entry
+        zone, instance_type, idx = instance_idx
+        abnormal_state, failure_state, detected_abnormal, last_abnormal, last_failure = state
+
+        row = self._instances.add(instance_idx)
+        if abnormal_state > 0:
+            self._instances.set_abnormal(row, int(abnormal_state))
+        self._instances.set_failure(row, bool(failure_state))
+        self._instances.set_detected(row, bool(detected_abnormal))
+        self._instances.last_abnormal[row] = last_abnormal
+        self._instances.last_failure[row] = last_failure
+        self._instances.last_seen[row] = self._tick
+        if metric_states and instance_type in self._history:
+            metrics = self._new_metrics(instance_type, row)
+            epoch = self._epochs.current(zone, instance_type, idx)
+            for metric, metric_state in metric_states.items():
+                metrics[metric].load_state(*metric_state)
+                metrics[metric].rebase(epoch)
+        self._dirty.add((zone, instance_type))
+        return row
+
+    def _restore_checkpoint(self):
+        """
+        从检查点恢复检测器状态，恢复后的实例不需要重新积累窗口数据即可进行检测
+        """
+
+        entries = self._checkpoint.load()
+        for entry in entries:
+            self._load_entry(entry)
+
+        self._publish_snapshot(None)
+        if entries:
+            logging.info(f'Worker {self._name} 从检查点恢复了{len(entries)}个实例')
+
+    def _evict_expired(self):
+        """
+        移除连续超过instance_ttl个tick没有收到数据的实例，spill_evicted为True时将其状态写入磁盘，再次出现时恢复
+        """
+
+        if self._instance_ttl is None:
+            return
+        rows = self._instances.expired(self._tick, self._instance_ttl)
+        if len(rows) == 0:
+            return
+
+        if self._spill is not None:
+            self._spill.put(self._checkpoint_entries(rows))
+
+        self._remove_rows(rows)
+        logging.debug('Worker %s 移除了%d个实例，当前实例数: %d', self._name, len(rows), len(self._instances))
+
+    def _remove_rows(self, rows: np.ndarray):
+        keys = []
+        for row in rows.tolist():
+            zone, instance_type, idx = key = self._instances.key(row)
+            history_row = int(self._instances.history_row[row])
+            if history_row >= 0:
+                self._history[instance_type].free_row(history_row)
+            self._instances.remove(row)
+            self._dirty.add((zone, instance_type))
+            keys.append(key)
+        self._epochs.forget(keys)
+        if self._checkpoint_copy is not None:
+            for key in keys:
+                self._checkpoint_copy[1].pop(key, None)
+
+    def _migrate(self, batch: dict):
+        """
+        worker增减时迁移实例：先保存不含交出的实例的检查点，使得重启时不会恢复已经交出的实例，
+        再把交出的实例连同检测器状态放入migrate_queue（Dispatcher收到之后可能立即停止本worker）；
+        收到的实例按检查点恢复，不需要重新积累窗口数据；暂时接管的实例副本直接删除
+        """
+
+        if protocol.ATTR_DROP in batch:
+            # 重启的worker恢复后，删除重启期间暂时接管的实例副本
+            keys = batch[protocol.ATTR_DROP]
+            self._remove_rows(np.array([_ for _ in map(self._instances.row, keys) if _ is not None], dtype=np.int64))
+            if self._spill is not None:
+                self._spill.discard(keys)
+            if self._checkpoint is not None:
+                self._save_checkpoint(self._checkpoint_entries(self._instances.rows()))
+            logging.info('Worker %s 删除了%d个暂时接管的实例副本，当前实例数: %d', self._name, len(keys), len(self._instances))
+        elif protocol.ATTR_MIGRATE_OUT in batch:
+            keys = batch[protocol.ATTR_MIGRATE_OUT]
+            rows = np.array([_ for _ in map(self._instances.row, keys) if _ is not None], dtype=np.int64)
+            entries = self._checkpoint_entries(rows)
+            self._remove_rows(rows)
+            if self._checkpoint is not None:
+                self._save_checkpoint(self._checkpoint_entries(self._instances.rows()))
+            self._migrate_queue.put((batch[protocol.ATTR_ID], entries))
+            logging.info('Worker %s 交出了%d个实例，当前实例数: %d', self._name, len(entries), len(self._instances))
+        else:
+            entries = batch[protocol.ATTR_MIGRATE_IN]
+            if self._spill is not None:
+                # 本worker之前移除时写入磁盘的状态已经过时
+                self._spill.discard([key for key, _, _ in entries])
+            for entry in entries:
+                row = self._instances.row(entry[0])
+                if row is not None:
+                    # 迁移期间已经以新实例的身份收到了数据
+                    self._remove_rows(np.array([row], dtype=np.int64))
+                self._load_entry(entry)
+            logging.info('Worker %s 接收了%d个实例，当前实例数: %d', self._name, len(entries), len(self._instances))
+        self._publish_snapshot(self._snapshot.tick)
+        if self._metrics_slot is not None:
+            self._metrics_slot.set('live_instances', len(self._instances))
+
+    def _stop(self):
+        """
+        worker被减少时的停止命令，在交出实例的命令之后到达：保存检查点、状态变化日志和长期历史数据，然后结束进程
+        """
+
+        if self._checkpoint is not None:
+            self._save_checkpoint(self._checkpoint_entries(self._instances.rows()))
+        if self._journal is not None:
+            self._journal.flush()
+        if self._segments is not None:
+            for store in self._segments.values():
+                store.close()
+        logging.info('Worker %s 已停止，剩余实例数: %d', self._name, len(self._instances))
+        # 其他线程都在阻塞等待命令或定时器，直接结束进程
+        os._exit(0)
+
+    def _convert_evicted(self, path: str):
+        """
+        之前的版本把被移除的实例整体写为一个检查点，转换为SpillStore之后删除
+        """
+
+        entries = Checkpoint(path).load()
+        if entries:
+            self._spill.put(entries)
+            logging.info('Worker %s 转换了%d个被移除的实例的状态', self._name, len(entries))
+        for p in (path, path + '.old', path + '.tmp'):
+            shutil.rmtree(p, ignore_errors=True)
+
+    def _restore_spilled(self, instance_idx: tuple):
+        """
+        恢复之前被移除并写入磁盘的实例，返回行号，没有找到时返回None
+        """
+
+        entry = self._spill.pop(instance_idx)
+        return None if entry is None else self._load_entry(entry)
+
+    def _checkpoint_loop(self):
+        """
+        定期请求数据处理线程复制实例状态，在本线程中写入文件，不阻塞数据处理
         """
 
-        now = datetime.datetime.now().timestamp()
-        if now - self._last_reset < 10:
+        while True:
+            time.sleep(self._checkpoint_interval)
+            self._checkpoint_due = True
+            self._save_checkpoint(self._checkpoint_pending.get())
+
+    def _copy_checkpoint(self):
+        """
+        在两批数据之间复制最多CHECKPOINT_CHUNK个实例的状态，全部复制完之后交给检查点线程写入，实例很多时不会长时间阻塞数据处理。
+        复制期间被移除的实例从已复制的状态中删除，新增的实例留到下一次检查点；收到重置命令时重新开始复制
+        """
+
+        if self._checkpoint_copy is None or self._checkpoint_copy[2] != self._epochs.version:
+            self._checkpoint_copy = (self._instances.rows(), {}, self._epochs.version)
+        rows, entries, version = self._checkpoint_copy
+        chunk = rows[:self.CHECKPOINT_CHUNK]
+        # 复制期间被移除的行号可能已经由新增的实例复用，这些实例同样可以写入检查点
+        entries.update((entry[0], entry) for entry in self._checkpoint_entries(chunk[self._instances.live[chunk]]))
+        if len(rows) > len(chunk):
+            self._checkpoint_copy = (rows[len(chunk):], entries, version)
             return
-        self._last_reset = now
 
-        for idx, obj in self._instances.items():
-            for metric, ts in obj[protocol.ATTR_METRICS].items():
-                ts.reset()
+        self._checkpoint_copy = None
+        self._checkpoint_due = False
+        self._checkpoint_pending.put(list(entries.values()))
 
     def run(self):
         logging.debug(f'Worker {self._name} 开始运行...')
-        with ThreadPoolExecutor(max_workers=3) as pool:
+        self._checkpoint_lock = Lock()
+        self._checkpoint_pending = queue.Queue()
+        if self._storage_dir is not None:
+            self._checkpoint = Checkpoint(os.path.join(self._storage_dir, 'checkpoint'))
+            self._restore_checkpoint()
+            if self._spill_evicted:
+                self._spill = SpillStore(os.path.join(self._storage_dir, 'spill'))
+                self._convert_evicted(os.path.join(self._storage_dir, 'evicted'))
+            self._journal = EventJournal(os.path.join(self._storage_dir, 'journal'))
+            self._segments = {
+                instance_type: SegmentStore(
+                    os.path.join(self._storage_dir, 'metrics', instance_type),
+                    store.metrics()
+                ) for instance_type, store in self._history.items()
+            }
+        with ThreadPoolExecutor(max_workers=4) as pool:
             pool.submit(self._monitor_cmd_queue).add_done_callback(threading.thread_done_callback)
             pool.submit(self._monitor_data_queue).add_done_callback(threading.thread_done_callback)
             pool.submit(self._print_count).add_done_callback(threading.thread_done_callback)
+            if self._checkpoint is not None:
+                pool.submit(self._checkpoint_loop).add_done_callback(threading.thread_done_callback)
 
     def _print_count(self):
         while True:
             if self._debug:
-                logging.debug(f'Worker {self._name} 已处理元素: {self._count}')
+                logging.debug('Worker %s 已处理元素: %d\t各阶段延迟(p50/p99)\t%s',
+                              self._name, self._count, Lazy(self._tracer.format))
 
             time.sleep(15)
 
-    def _process_dashboard_request(self, attr: dict):
+    @staticmethod
+    def _select(query: DashboardQuery, block: snapshot.Block, ids: frozenset = None) -> tuple:
         """
-        处理前端查询
+        返回快照中某个(zone, instance_type)下符合查询条件的实例ID列表，以及它们在Block各状态数组中的下标，只访问相关的实例
+        ids不为None时只在这些ID中选择
+        """
+
+        positions = block.positions
+        if not positions:
+            return [], np.zeros(0, dtype=np.int64)
+
+        if ids is None and query.abnormal_only:
+            # 只查询异常实例时，直接从异常/故障实例集合出发，不遍历全部实例
+            ids = block.abnormal | block.failure
+        if ids is not None:
+            if query.id_list is not None:
+                ids = ids.intersection(query.id_list)
+            selected = list(ids)
+        elif query.id_list is None:
+            return list(block.ids), np.arange(len(block.ids))
+        else:
+            selected = [idx for idx in query.id_list if idx in positions]
+        return selected, np.fromiter((positions[idx] for idx in selected), dtype=np.int64, count=len(selected))
+
+    def _query_state(self, query: DashboardQuery, snap: snapshot.Snapshot) -> StateReply:
+        result = StateReply()
+        for zone, instance_type in query.scopes():
+            block = snap.blocks.get((zone, instance_type), snapshot.EMPTY_BLOCK)
+            ids, positions = self._select(query, block)
+            result.add_block(
+                zone,
+                instance_type,
+                ids=ids,
+                abnormal=block.abnormal_state[positions] > 0,  # 一旦异常，就维持这个状态
+                failure=block.failure_state[positions],
+            )
+        return result
+
+    def _query_history(self, query: DashboardQuery, snap: snapshot.Snapshot) -> dict:
         """
+        历史数据查询
+        只指定数据点个数时从内存中读取，每个实例的代价只与查询窗口长度有关，且不返回晚于快照的数据点；
+        指定了time_start或resolution时从磁盘上的长期历史数据中读取，只读取需要的层和段
+        """
+
+        long_term = query.time_start is not None or query.resolution is not None
+        if long_term and self._segments is None:
+            return {}
+
+        end = query.time_end
+        if snap.tick is not None:
+            end = snap.tick if end is None else min(end, snap.tick)
 
         result = {}
+        for zone, instance_type in query.scopes():
+            store = self._history.get(instance_type)
+            if store is None or (query.metric_name is not None and query.metric_name not in store.metrics()):
+                continue
+
+            r = {}
+            block = snap.blocks.get((zone, instance_type), snapshot.EMPTY_BLOCK)
+            ids, positions = self._select(query, block)
+            for idx, row in zip(ids, block.history_row[positions].tolist()):
+                if row < 0:
+                    continue
+                if long_term:
+                    segments = self._segments[instance_type]
+                    if query.metric_name is not None:
+                        r[idx] = segments.read((zone, instance_type, idx), query.metric_name,
+                                               query.time_start, query.time_end, query.resolution)
+                    else:
+                        r[idx] = {
+                            metric: segments.read((zone, instance_type, idx), metric,
+                                                  query.time_start, query.time_end, query.resolution)
+                            for metric in store.metrics()
+                        }
+                    continue
+
+                timestamps, values = store.query(row, query.metric_name, query.time_window, end)
+                r[idx] = {
+                    protocol.ATTR_TIMESTAMP: timestamps,
+                    protocol.ATTR_VALUE: values
+                }
+            result[(zone, instance_type)] = r
+        return result
+
+    def _query_records(self, query: DashboardQuery, snap: snapshot.Snapshot, abnormal: bool) -> dict:
+        """
+        异常/故障记录查询，只访问处于对应状态的实例
+        """
 
-        for instance_idx, v in self._instances.items():
-            zone, instance_type, idx = instance_idx
-
-            result[instance_idx] = {
-                protocol.ATTR_VALUE: None,
-                protocol.ATTR_ABNORMAL:
-                # bool(
-                #     (int(datetime.datetime.now().timestamp()) - v[protocol.ATTR_ABNORMAL_STATE]) < self._cooldown
-                # ),
-                bool(v[protocol.ATTR_ABNORMAL_STATE] > 0),  # 一旦异常，就维持这个状态
-                protocol.ATTR_FAILURE: bool(v[protocol.ATTR_FAILURE_STATE]),
+        result = {}
+        for zone, instance_type in query.scopes():
+            block = snap.blocks.get((zone, instance_type), snapshot.EMPTY_BLOCK)
+            ids, positions = self._select(query, block, block.abnormal if abnormal else block.failure)
+            timestamps = (block.abnormal_state if abnormal else block.last_failure)[positions].tolist()
+            result[(zone, instance_type)] = {
+                idx: {
+                    protocol.ATTR_TIMESTAMP: [timestamp],
+                    protocol.ATTR_VALUE: [True]
+                } for idx, timestamp in zip(ids, timestamps)
             }
+        return result
 
+    def _query_events(self, query: DashboardQuery) -> dict:
+        """
+        查询[time_start, time_end)内的异常/故障状态变化记录，只读取日志中相关的一段
+        """
+
+        result = {}
+        if self._journal is None:
+            return result
+
+        scopes = set(query.scopes())
+        id_list = None if query.id_list is None else set(query.id_list)
+        for tick, (zone, instance_type, idx), event, state in self._journal.read(query.time_start, query.time_end):
+            if (zone, instance_type) not in scopes or (id_list is not None and idx not in id_list):
+                continue
+            r = result.setdefault((zone, instance_type), {}).setdefault(idx, {
+                protocol.ATTR_TIMESTAMP: [],
+                protocol.ATTR_EVENT: [],
+                protocol.ATTR_VALUE: []
+            })
+            r[protocol.ATTR_TIMESTAMP].append(tick)
+            r[protocol.ATTR_EVENT].append(event)
+            r[protocol.ATTR_VALUE].append(state)
         return result
 
+    def _query_instance_ids(self, query: DashboardQuery, snap: snapshot.Snapshot) -> dict:
+        return {
+            (zone, instance_type): self._select(query, snap.blocks.get((zone, instance_type), snapshot.EMPTY_BLOCK))[0]
+            for zone, instance_type in query.scopes()
+        }
+
+    def _process_dashboard_request(self, attr: dict):
+        """
+        处理前端查询
+        按照zone、instance_type、instance_id_list和abnormal_only进行过滤，只返回符合条件的实例
+        实例状态查询返回StateReply，其他类型的查询返回{(zone, instance_type): 结果}
+        整个查询只读取开始时取得的同一个快照，不会与数据处理线程冲突
+        """
+
+        query = DashboardQuery(attr)
+        snap = self._snapshot
+        if query.query_type is None:
+            return self._query_state(query, snap)
+        if query.query_type == protocol.QUERY_TYPE_HISTORY:
+            return self._query_history(query, snap)
+        if query.query_type == protocol.QUERY_TYPE_ANOMALY:
+            return self._query_records(query, snap, abnormal=True)
+        if query.query_type == protocol.QUERY_TYPE_FAILURE:
+            return self._query_records(query, snap, abnormal=False)
+        if query.query_type == protocol.QUERY_TYPE_INSTANCE_ID:
+            return self._query_instance_ids(query, snap)
+        if query.query_type == protocol.QUERY_TYPE_EVENT:
+            return self._query_events(query)
+
+        logging.error(f'未知的查询类型： {query.query_type}')
+        return {}
+
     def _monitor_cmd_queue(self):
         while True:
             cmd: command.Command = self._cmd_queue.get()
             attr = cmd.attributes
             if cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_QUERY:
+                t0 = tracing.now()
                 result = self._process_dashboard_request(attr)
-                self._res_queue.put_nowait((cmd.cmdID, result))
+                self._res_queue.put_nowait((cmd.cmdID, result, (t0, tracing.now())))
             elif cmd.cmdType == command.CMD_TYPE_ABNORMAL_DETECTOR_RESET:
-                self._reset_ksigma()
+                self._reset_ksigma(attr)
+            elif cmd.cmdType == protocol.CMD_TYPE_ABNORMAL_DETECTOR_PROFILE:
+                self._request_profile(cmd.cmdID, attr or {})
+
+    def _request_profile(self, cmd_id, attr: dict):
+        """
+        收到性能分析命令后立即开始，时长从收到命令时按实际时间计算；数据处理线程最多在一个心跳间隔内附加到分析上
+        （使得cProfile记录的是数据处理线程），并在到时后结束，空闲时也不会推迟。
+        同一时间只进行一次性能分析，无法开始时直接返回错误
+        """
+
+        t0 = tracing.now()
+        try:
+            if self._profile is not None:
+                raise RuntimeError('正在进行性能分析')
+            directory = None if self._storage_dir is None else os.path.join(self._storage_dir, 'profiles')
+            profile = profiling.new_profile(attr, self._name, directory)
+            profile.start()
+            self._profile = (cmd_id, profile)
+            logging.info(f'Worker {self._name} 开始性能分析 {profile.path}')
+        except Exception as e:
+            logging.warning(f'Worker {self._name} 无法进行性能分析 {e}')
+            self._res_queue.put_nowait((cmd_id, {self._name: {protocol.ATTR_ERROR: str(e)}}, (t0, tracing.now())))
+
+    def _finish_profile(self):
+        """
+        结束性能分析，写入结果文件，并把摘要作为命令的结果返回
+        """
+
+        cmd_id, profile = self._profile
+        t0 = tracing.now()
+        try:
+            summary = profile.finish()
+            logging.info(f'Worker {self._name} 性能分析已完成 {profile.path}')
+        except Exception as e:
+            logging.warning(f'Worker {self._name} 性能分析失败 {e}')
+            summary = {protocol.ATTR_ERROR: str(e)}
+        # 结果写完之后才允许开始下一次性能分析
+        self._profile = None
+        self._res_queue.put_nowait((cmd_id, {self._name: summary}, (t0, tracing.now())))
 
     def _monitor_data_queue(self):
         while True:
-            element_list = self._data_queue.get()
-            for element in element_list:
-                self._count += 1
-                instance_type = element[protocol.ATTR_INSTANCE_TYPE]
-                zone = element[protocol.ATTR_ZONE]
-                active = element[protocol.ATTR_ACTIVE]
-                obj = element[protocol.ATTR_VALUE]
-                idx = element[protocol.ATTR_ID]
-
-                instance_idx = (zone, instance_type, idx)
-                if instance_idx not in self._instances:
-                    self._instances[instance_idx] = self._new_instance()
-
-                self._instances[instance_idx][protocol.ATTR_HISTORY_VALUE] = obj
-                self._instances[instance_idx][protocol.ATTR_FAILURE_STATE] = not active
-
-                if not active:  # 不是active，则证明其已经属于failure，不属于abnormal
-                    last_failure = self._instances[instance_idx][protocol.ATTR_LAST_FAILURE]
-                    if datetime.datetime.now().timestamp() - last_failure >= self._cooldown:
-                        if instance_type == protocol.INSTANCE_TYPE_SERVER:
-                            self._add_anomaly_report(zone, protocol.ATTR_FAILURE, server_id=idx)
-                        if instance_type == protocol.INSTANCE_TYPE_SWITCH:
-                            self._add_anomaly_report(zone, protocol.ATTR_FAILURE, switch_id=idx)
-                        if instance_type == protocol.INSTANCE_TYPE_LINK:
-                            self._add_anomaly_report(zone, protocol.ATTR_FAILURE, link_id=idx)
-                        self._instances[instance_idx][protocol.ATTR_LAST_FAILURE] = \
-                            datetime.datetime.now().timestamp()
-                else:
-                    instance_dict = self._instances[instance_idx][protocol.ATTR_METRICS]
-
-                    if instance_type == protocol.INSTANCE_TYPE_SERVER:  # 服务器，需要对其CPU和内存施行异常检测
-                        if protocol.ATTR_SERVER_CPU_UTILIZATION not in instance_dict:
-                            instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION] = self._new_timeseries(jitter=10)
-                            instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION] = self._new_timeseries(jitter=5)
-
-                        cpu_util_value = float(np.nanmean(obj.getCpuUtil()))
-                        instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION].add(cpu_util_value)
-                        mem_util_value = obj.getDRAMUsagePercentage()
-                        instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION].add(mem_util_value)
-
-                        abnormal = \
-                            instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION].is_abnormal() or \
-                            instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION].is_abnormal()
-
-                        if self._debug and instance_idx[2] in (10001, 10002):
-                            cpu_ts = instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION]
-                            cpu_value = cpu_ts.value(8)
-                            mem_ts = instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION]
-                            mem_value = mem_ts.value(8)
-
-                            mu, sigma = cpu_ts._stat_value.stats()
-                            low = mu - sigma * self._k
-                            high = mu + sigma * self._k
-                            logging.info(f'{instance_idx[2]} CPU  {low:5.2f} {high:5.2f}')
-                            print_s = ''
-                            for item in cpu_value:
-                                print_s += f'{item:.2f}, '
-                            logging.info(print_s)
-
-                            mu, sigma = mem_ts._stat_value.stats()
-                            low = mu - sigma * self._k
-                            high = mu + sigma * self._k
-                            logging.info(f'{instance_idx[2]} MEM  {low:5.2f} {high:5.2f}')
-                            print_s = ''
-                            for item in mem_value:
-                                print_s += f'{item:.2f}, '
-                            logging.info(print_s)
-
-                        if abnormal:
-                            self._instances[instance_idx][protocol.ATTR_ABNORMAL_STATE] = \
-                                int(datetime.datetime.now().timestamp())
-
-                        last_abnormal = self._instances[instance_idx][protocol.ATTR_LAST_ABNORMAL]
-                        if abnormal and datetime.datetime.now().timestamp() - last_abnormal >= self._cooldown:
-                            if self._debug:
-                                logging.info(f'server: {idx}\n'
-                                             f'CPU: {instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION].value()}\n'
-                                             f'memory:{instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION].value()}')
-                            self._add_anomaly_report(zone, protocol.ATTR_ABNORMAL, server_id=idx)
-                            self._instances[instance_idx][protocol.ATTR_LAST_ABNORMAL] = \
-                                datetime.datetime.now().timestamp()
-
-                    elif instance_type == protocol.INSTANCE_TYPE_LINK:  # 链路，需要对其SYN包等统计信息施行异常检测
-                        if protocol.ATTR_LINK_SYN_RATIO not in instance_dict:
-                            instance_dict[protocol.ATTR_LINK_SYN_RATIO] = self._new_timeseries(jitter=0)
-                            instance_dict[protocol.ATTR_LINK_DNS_RATIO] = self._new_timeseries(jitter=0)
-
-                        nsh_num_value = obj.NSH_num
-                        syn_num_value = obj.SYN_num
-                        dns_num_value = obj.DNS_num
-                        link_util_value = obj.utilization
-                        total_num_value = nsh_num_value + syn_num_value + dns_num_value
-
-                        syn_ratio_value = syn_num_value / total_num_value if total_num_value > 0 else 0
-                        instance_dict[protocol.ATTR_LINK_SYN_RATIO].add(syn_ratio_value)
-                        dns_ratio_value = dns_num_value / total_num_value if total_num_value > 0 else 0
-                        instance_dict[protocol.ATTR_LINK_DNS_RATIO].add(dns_ratio_value)
-
-                        # util大于阈值，且DNS包或者SYN包的比例有大的变化
-                        abnormal = \
-                            link_util_value > self._link_util_thres and (
-                                    instance_dict[protocol.ATTR_LINK_SYN_RATIO].is_abnormal() or
-                                    instance_dict[protocol.ATTR_LINK_DNS_RATIO].is_abnormal() or
-                                    syn_ratio_value > 0.95 or
-                                    dns_ratio_value > 0.95
-                            ) and (
-                                    syn_num_value > self._link_packet_num_thres or
-                                    dns_num_value > self._link_packet_num_thres
-                            )
-
-                        if abnormal:
-                            self._instances[instance_idx][protocol.ATTR_ABNORMAL_STATE] = \
-                                int(datetime.datetime.now().timestamp())
-
-                            logging.debug(f'LINK ABNORMAL: {instance_idx[-1]} {link_util_value:.3f} '
-                                          f'{instance_dict[protocol.ATTR_LINK_SYN_RATIO].is_abnormal()} '
-                                          f'{instance_dict[protocol.ATTR_LINK_DNS_RATIO].is_abnormal()} '
-                                          f'{syn_ratio_value:.2f} {dns_ratio_value:.2f}')
-
-                        last_abnormal = self._instances[instance_idx][protocol.ATTR_LAST_ABNORMAL]
-                        if abnormal and datetime.datetime.now().timestamp() - last_abnormal >= self._cooldown:
-                            self._add_anomaly_report(zone, protocol.ATTR_ABNORMAL, link_id=idx)
-                            self._instances[instance_idx][protocol.ATTR_LAST_ABNORMAL] = \
-                                datetime.datetime.now().timestamp()
+            if self._checkpoint_due:
+                self._copy_checkpoint()
+            timeout = self._heartbeat_interval
+            profile = self._profile
+            if profile is not None:
+                if profile[1].expired():
+                    self._finish_profile()
+                    continue
+                profile[1].attach()
+                timeout = min(timeout, profile[1].remaining())
+            try:
+                batch = self._data_queue.get(timeout=timeout)
+            except queue.Empty:
+                # 没有数据时也更新心跳，使Dispatcher能区分空闲和失去响应
+                if self._metrics_slot is not None:
+                    self._metrics_slot.set('heartbeat', tracing.now())
+                continue
+            if protocol.ATTR_STOP in batch:
+                self._stop()
+            if protocol.ATTR_VALUE not in batch:
+                self._migrate(batch)
+                continue
+            t0 = tracing.now()
+            trace = batch.get(protocol.ATTR_TRACE)
+            self._trace_received = None if trace is None else trace[1]
+            self._process_batch(batch)
+            t1 = tracing.now()
+            self._tracer.record(tracing.STAGE_WORKER, t1 - t0)
+            if trace is not None:
+                self._tracer.record(tracing.STAGE_WORKER_QUEUE, t0 - trace[2])
+                self._tracer.record(tracing.STAGE_TICK, t1 - trace[1])
+            if self._metrics_slot is not None:
+                self._update_metrics(t1)
+
+    def _update_metrics(self, timestamp: float):
+        self._metrics_slot.set('ticks', self._tick)
+        self._metrics_slot.set('instances', self._count)
+        self._metrics_slot.set('evaluations', self._evaluations)
+        self._metrics_slot.set('live_instances', len(self._instances))
+        self._metrics_slot.set('queue_depth', self._data_queue.qsize())
+        self._metrics_slot.set('heartbeat', timestamp)
+
+    def _format_bounds(self, ts: TimeSeries) -> str:
+        """
+        调试用：指标的正常范围和最近的数据点
+        """
+
+        mu, sigma = ts._stat_value.stats()
+        values = ', '.join(f'{item:.2f}' for item in ts.value(8))
+        return f'{mu - sigma * self._k:5.2f} {mu + sigma * self._k:5.2f}\n{values}'
+
+    def _process_batch(self, batch: dict):
+        """
+        处理Dispatcher发来的一批数据，格式见data_queue
+        """
+
+        timestamp = batch[protocol.ATTR_TIMESTAMP]
+        element_list = batch[protocol.ATTR_VALUE]
+        self._tick += 1
+        for element in element_list:
+            self._count += 1
+            instance_type = element[protocol.ATTR_INSTANCE_TYPE]
+            zone = element[protocol.ATTR_ZONE]
+            active = element[protocol.ATTR_ACTIVE]
+            obj = element[protocol.ATTR_VALUE]
+            idx = element[protocol.ATTR_ID]
+
+            instance_idx = (zone, instance_type, idx)
+            row = self._instances.row(instance_idx)
+            if row is None and self._spill is not None and instance_idx in self._spill:
+                row = self._restore_spilled(instance_idx)
+            if row is None:
+                row = self._instances.add(instance_idx)
+                self._dirty.add((zone, instance_type))
+            self._instances.last_seen[row] = self._tick
+
+            self._set_failure_state(instance_idx, row, not active, timestamp)
+
+            if not active:  # 不是active，则证明其已经属于failure，不属于abnormal
+                last_failure = self._instances.last_failure[row]
+                if timestamp - last_failure >= self._cooldown:
+                    if instance_type == protocol.INSTANCE_TYPE_SERVER:
+                        self._add_anomaly_report(zone, protocol.ATTR_FAILURE, server_id=idx)
+                    if instance_type == protocol.INSTANCE_TYPE_SWITCH:
+                        self._add_anomaly_report(zone, protocol.ATTR_FAILURE, switch_id=idx)
+                    if instance_type == protocol.INSTANCE_TYPE_LINK:
+                        self._add_anomaly_report(zone, protocol.ATTR_FAILURE, link_id=idx)
+                    self._instances.last_failure[row] = timestamp
+                    self._dirty.add((zone, instance_type))
+            else:
+                instance_dict = self._instances.metrics[row]
+                epoch = self._epochs.current(zone, instance_type, idx)
+
+                if instance_type == protocol.INSTANCE_TYPE_SERVER:  # 服务器，需要对其CPU和内存施行异常检测
+                    if instance_dict is None:
+                        instance_dict = self._new_metrics(instance_type, row)
+
+                    cpu_util_value = float(np.nanmean(obj.getCpuUtil()))
+                    instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION].add(cpu_util_value, epoch)
+                    mem_util_value = obj.getDRAMUsagePercentage()
+                    instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION].add(mem_util_value, epoch)
+                    self._append_history(instance_idx, row, timestamp, {
+                        protocol.ATTR_SERVER_CPU_UTILIZATION: cpu_util_value,
+                        protocol.ATTR_SERVER_MEMORY_UTILIZATION: mem_util_value
+                    })
+
+                    abnormal = \
+                        instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION].is_abnormal() or \
+                        instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION].is_abnormal()
+
+                    if self._debug and instance_idx[2] in (10001, 10002):
+                        for name, metric in (('CPU', protocol.ATTR_SERVER_CPU_UTILIZATION),
+                                             ('MEM', protocol.ATTR_SERVER_MEMORY_UTILIZATION)):
+                            logging.info('%s %s  %s', idx, name, Lazy(self._format_bounds, instance_dict[metric]))
+
+                    self._record_detection(instance_idx, row, abnormal, timestamp)
+                    if abnormal:
+                        self._set_abnormal_state(zone, instance_type, row, int(timestamp))
+
+                    last_abnormal = self._instances.last_abnormal[row]
+                    if abnormal and timestamp - last_abnormal >= self._cooldown:
+                        if self._debug:
+                            logging.info('server: %s\nCPU: %s\nmemory:%s', idx,
+                                         Lazy(instance_dict[protocol.ATTR_SERVER_CPU_UTILIZATION].value),
+                                         Lazy(instance_dict[protocol.ATTR_SERVER_MEMORY_UTILIZATION].value))
+                        self._add_anomaly_report(zone, protocol.ATTR_ABNORMAL, server_id=idx)
+                        self._instances.last_abnormal[row] = timestamp
+
+                elif instance_type == protocol.INSTANCE_TYPE_LINK:  # 链路，需要对其SYN包等统计信息施行异常检测
+                    if instance_dict is None:
+                        instance_dict = self._new_metrics(instance_type, row)
+
+                    nsh_num_value = obj.NSH_num
+                    syn_num_value = obj.SYN_num
+                    dns_num_value = obj.DNS_num
+                    link_util_value = obj.utilization
+                    total_num_value = nsh_num_value + syn_num_value + dns_num_value
+
+                    syn_ratio_value = syn_num_value / total_num_value if total_num_value > 0 else 0
+                    instance_dict[protocol.ATTR_LINK_SYN_RATIO].add(syn_ratio_value, epoch)
+                    dns_ratio_value = dns_num_value / total_num_value if total_num_value > 0 else 0
+                    instance_dict[protocol.ATTR_LINK_DNS_RATIO].add(dns_ratio_value, epoch)
+                    self._append_history(instance_idx, row, timestamp, {
+                        protocol.ATTR_LINK_SYN_RATIO: syn_ratio_value,
+                        protocol.ATTR_LINK_DNS_RATIO: dns_ratio_value
+                    })
+
+                    # util大于阈值，且DNS包或者SYN包的比例有大的变化
+                    abnormal = \
+                        link_util_value > self._link_util_thres and (
+                                instance_dict[protocol.ATTR_LINK_SYN_RATIO].is_abnormal() or
+                                instance_dict[protocol.ATTR_LINK_DNS_RATIO].is_abnormal() or
+                                syn_ratio_value > 0.95 or
+                                dns_ratio_value > 0.95
+                        ) and (
+                                syn_num_value > self._link_packet_num_thres or
+                                dns_num_value > self._link_packet_num_thres
+                        )
+
+                    self._record_detection(instance_idx, row, abnormal, timestamp)
+                    if abnormal:
+                        self._set_abnormal_state(zone, instance_type, row, int(timestamp))
+
+                        logging.debug('LINK ABNORMAL: %s %.3f %s %s %.2f %.2f', idx, link_util_value,
+                                      Lazy(instance_dict[protocol.ATTR_LINK_SYN_RATIO].is_abnormal),
+                                      Lazy(instance_dict[protocol.ATTR_LINK_DNS_RATIO].is_abnormal),
+                                      syn_ratio_value, dns_ratio_value)
+
+                    last_abnormal = self._instances.last_abnormal[row]
+                    if abnormal and timestamp - last_abnormal >= self._cooldown:
+                        self._add_anomaly_report(zone, protocol.ATTR_ABNORMAL, link_id=idx)
+                        self._instances.last_abnormal[row] = timestamp
+
+        self._evict_expired()
+        if self._journal is not None:
+            self._journal.flush()
+        self._publish_snapshot(timestamp)